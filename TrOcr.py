@@ -1,47 +1,263 @@
-from typing import List
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
 import base64
 from io import BytesIO
 
-from stopOllamaModel import stop_ollama_model
-
-def image_to_text(images: List[Image.Image]) -> str:
-    ollama_api_url = "http://localhost:11434/api/generate"
-    all_text = ""
-    session = requests.Session()
-    
-    try:
-        for image in images:
-            buffer = BytesIO()
-            image.save(buffer, format="PNG")
-            base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            buffer.close()
-            
-            payload = {
-                "model": "granite3.2-vision:2b",
-                "prompt": "Extract all text from this image. Return only the extracted text with no additional commentary.",
-                "images": [base64_image],
-                "stream": False
-            }
-            
-            response = session.post(ollama_api_url, json=payload)
-            
+from model_residency import residency
+from response_cache import ResponseCache, get_ocr_cache
+
+OLLAMA_API_URL = "http://localhost:11434/api/generate"
+OCR_MODEL = "granite3.2-vision:2b"
+OCR_PROMPT = "Extract all text from this image. Return only the extracted text with no additional commentary."
+
+# Number of pages sent to the vision model at the same time
+OCR_MAX_IN_FLIGHT = int(os.getenv("OCR_MAX_IN_FLIGHT", "2"))
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", "2"))
+OCR_RETRY_BACKOFF = float(os.getenv("OCR_RETRY_BACKOFF", "2"))  # seconds, doubled per retry
+OCR_CONNECT_TIMEOUT = float(os.getenv("OCR_CONNECT_TIMEOUT", "10"))
+OCR_READ_TIMEOUT = float(os.getenv("OCR_READ_TIMEOUT", "600"))
+
+# How pages are encoded before being sent to the vision model. Grayscale and
+# downscaling to the model's working resolution shrink the payload and the
+# image tokenizer's work; JPEG/WEBP trade a little fidelity for much smaller
+# bodies. Use benchmark_ocr_encoding.py to compare settings on sample sheets;
+# the defaults stay the original colour, full-size PNG until a benchmark
+# shows another encoding loses no accuracy.
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "PNG").upper()  # PNG, JPEG or WEBP
+OCR_IMAGE_QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", "85"))  # JPEG/WEBP only
+OCR_IMAGE_GRAYSCALE = os.getenv("OCR_IMAGE_GRAYSCALE", "0") == "1"
+OCR_IMAGE_MAX_SIDE = int(os.getenv("OCR_IMAGE_MAX_SIDE", "0"))  # pixels, 0 = keep rendered size
+
+DEFAULT_ENCODING = {
+    "format": OCR_IMAGE_FORMAT,
+    "quality": OCR_IMAGE_QUALITY,
+    "grayscale": OCR_IMAGE_GRAYSCALE,
+    "max_side": OCR_IMAGE_MAX_SIDE
+}
+
+# One keep-alive connection pool shared by every OCR request in the process
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max(OCR_MAX_IN_FLIGHT, 1)))
+
+
+def prepare_image(image: Image.Image, encoding: Optional[Dict] = None) -> Image.Image:
+    """Apply the grayscale and resize steps of an encoding to a page"""
+    encoding = encoding or DEFAULT_ENCODING
+    prepared = image
+
+    if encoding.get("grayscale") and prepared.mode != "L":
+        prepared = prepared.convert("L")
+    elif encoding.get("format") == "JPEG" and prepared.mode not in ("RGB", "L"):
+        prepared = prepared.convert("RGB")
+
+    max_side = encoding.get("max_side") or 0
+    if max_side and max(prepared.size) > max_side:
+        ratio = max_side / max(prepared.size)
+        new_size = (max(1, round(prepared.width * ratio)), max(1, round(prepared.height * ratio)))
+        prepared = prepared.resize(new_size, Image.LANCZOS)
+
+    return prepared
+
+
+def encode_image(image: Image.Image, encoding: Optional[Dict] = None) -> str:
+    """Serialize a page image to the base64 string sent to the vision model"""
+    encoding = encoding or DEFAULT_ENCODING
+    prepared = prepare_image(image, encoding)
+
+    buffer = BytesIO()
+    if encoding["format"] in ("JPEG", "WEBP"):
+        prepared.save(buffer, format=encoding["format"], quality=encoding.get("quality", 85))
+    else:
+        prepared.save(buffer, format="PNG")
+    base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    buffer.close()
+
+    if prepared is not image:
+        prepared.close()
+    return base64_image
+
+
+def page_cache_key(image: Image.Image, encoding: Optional[Dict] = None) -> str:
+    """Cache key for a rendered page: hash of its pixels plus OCR model, prompt and encoding"""
+    pixels = hashlib.sha256(image.tobytes()).hexdigest()
+    return ResponseCache.make_key(
+        pixels=pixels,
+        size=image.size,
+        mode=image.mode,
+        model=OCR_MODEL,
+        prompt=OCR_PROMPT,
+        encoding=encoding or DEFAULT_ENCODING
+    )
+
+
+def ocr_page_cached(image: Image.Image) -> Dict:
+    """
+    OCR a page, skipping the vision model when the same page was seen before.
+
+    Returns:
+        dict: {"text": str, "cached": bool}
+    """
+    cache = get_ocr_cache()
+    cache_key = page_cache_key(image) if cache else None
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return {"text": cached, "cached": True}
+
+    text = ocr_page(image)
+    if cache_key and text:
+        cache.set(cache_key, text)
+    return {"text": text, "cached": False}
+
+
+def ocr_page(image: Image.Image, encoding: Optional[Dict] = None) -> str:
+    """
+    OCR a single page, retrying with exponential backoff.
+
+    Raises:
+        RuntimeError: If every attempt fails
+    """
+    return ocr_encoded(encode_image(image, encoding))
+
+
+def ocr_encoded(base64_image: str) -> str:
+    """
+    Send an already encoded page to the vision model, retrying with exponential backoff.
+
+    Raises:
+        RuntimeError: If every attempt fails
+    """
+    payload = {
+        "model": OCR_MODEL,
+        "prompt": OCR_PROMPT,
+        "images": [base64_image],
+        "stream": False,
+        "keep_alive": residency.keep_alive
+    }
+
+    last_error = None
+    for attempt in range(OCR_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(OCR_RETRY_BACKOFF * (2 ** (attempt - 1)))
+        try:
+            response = _session.post(
+                OLLAMA_API_URL,
+                json=payload,
+                timeout=(OCR_CONNECT_TIMEOUT, OCR_READ_TIMEOUT)
+            )
             if response.status_code == 200:
-                result = response.json()
-                extracted_text = result.get("response", "")
-                all_text += extracted_text + "\n\n"
-            else:
-                print(f"Error: OCR request failed with status code {response.status_code}")
-                print(f"Response: {response.text}")
-            
-            del base64_image
-        
-        return all_text.strip()
-    finally:
+                return response.json().get("response", "")
+            last_error = f"status code {response.status_code}: {response.text}"
+        except requests.RequestException as e:
+            last_error = str(e)
+        print(f"Error: OCR request failed (attempt {attempt + 1}/{OCR_MAX_RETRIES + 1}): {last_error}")
+
+    raise RuntimeError(f"OCR failed after {OCR_MAX_RETRIES + 1} attempts: {last_error}")
+
+
+class OcrPagesFailed(RuntimeError):
+    """Pages still failed after their retries, so the document's text would be incomplete"""
+
+    def __init__(self, failed: List[Dict]):
+        self.failed = failed
+        pages = ", ".join(str(page["page"]) for page in failed)
+        super().__init__(f"OCR failed for page(s) {pages}: {failed[0]['error']}")
+
+
+def raise_for_failed_pages(results: List[Dict]):
+    """Raise OcrPagesFailed if any ocr_pages result has status "failed" """
+    failed = [result for result in results if result["status"] == "failed"]
+    if failed:
+        raise OcrPagesFailed(failed)
+
+
+def ocr_pages(images: Iterable[Image.Image],
+              release_page: Optional[Callable[[Image.Image], None]] = None,
+              max_in_flight: int = OCR_MAX_IN_FLIGHT,
+              on_page_done: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    OCR pages concurrently with at most max_in_flight requests outstanding.
+    A page's number is taken from image.info["page_number"] when present,
+    otherwise from its position in images. on_page_done, if given, is called
+    with each page's result as soon as that page finishes.
+
+    Pages are pulled from images only when a slot is free, so a streaming
+    source is not drained faster than the model can keep up. A page that
+    still fails after its retries is reported as failed instead of aborting
+    the other pages; pass the results to raise_for_failed_pages before using
+    the text.
+
+    Returns:
+        list: One dict per page, in page order, with page number, text,
+              status ("ok" or "failed"), cached flag, error and seconds spent
+    """
+    slots = threading.BoundedSemaphore(max(max_in_flight, 1))
+    futures = []
+
+    def run(page_number: int, image: Image.Image) -> Dict:
+        started = time.perf_counter()
         try:
-            stop_ollama_model("granite3.2-vision:2b")
+            ocr = ocr_page_cached(image)
+            result = {"page": page_number, "text": ocr["text"], "status": "ok",
+                      "cached": ocr["cached"], "error": None}
         except Exception as e:
-            print(f"Warning: Failed to release Ollama model resources: {e}")
+            result = {"page": page_number, "text": "", "status": "failed",
+                      "cached": False, "error": str(e)}
         finally:
-            session.close()
\ No newline at end of file
+            if release_page is not None:
+                release_page(image)
+            slots.release()
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        if on_page_done is not None:
+            try:
+                on_page_done(result)
+            except Exception as e:
+                print(f"Page progress callback failed: {e}")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(max_in_flight, 1)) as executor:
+        pages = iter(images)
+        position = 0
+        while True:
+            # Wait for a free slot before taking (and, when streaming, rendering) the next page
+            slots.acquire()
+            image = next(pages, None)
+            if image is None:
+                slots.release()
+                break
+            position += 1
+            page_number = image.info.get("page_number", position)
+            futures.append(executor.submit(run, page_number, image))
+
+        results = sorted((future.result() for future in futures), key=lambda r: r["page"])
+
+    for result in results:
+        source = "cache" if result["cached"] else result["status"]
+        print(f"OCR page {result['page']}: {source} in {result['seconds']}s")
+    return results
+
+
+def image_to_text(images: Iterable[Image.Image],
+                  release_page: Optional[Callable[[Image.Image], None]] = None,
+                  max_in_flight: int = OCR_MAX_IN_FLIGHT) -> str:
+    """
+    OCR pages with the vision model and join their text in page order. images
+    may be any iterable, so pages can be streamed in as they are rendered;
+    release_page is called with each page once it is no longer needed.
+
+    Raises:
+        OcrPagesFailed: If any page could not be OCR'd
+    """
+    # The model stays loaded for the next document; the residency manager
+    # unloads it once it has been idle long enough
+    with residency.phase("ocr"):
+        pages = ocr_pages(images, release_page, max_in_flight)
+    raise_for_failed_pages(pages)
+    return "\n\n".join(page["text"] for page in pages if page["text"]).strip()
@@ -0,0 +1,149 @@
+"""
+answer_key.py - Precomputed artifacts for a teacher's answer key
+
+When a teacher sheet is processed, the key concepts, normalized keyword set and
+answer embedding of every model answer are derived once and stored with the
+sheet, so evaluations of each student can reuse them instead of re-deriving
+them per student. Artifacts are versioned by content hash: the whole set by a
+hash of the digital sheet, and each question by a hash of its model answer.
+"""
+
+import re
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from ollamaKeyFactor import query_gemma
+
+# Bump when the way artifacts are derived changes, so stale ones are rebuilt
+ARTIFACTS_FORMAT_VERSION = 1
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "then", "else", "of", "to", "in",
+    "on", "at", "by", "for", "with", "about", "as", "into", "through", "from",
+    "is", "are", "was", "were", "be", "been", "being", "it", "its", "this", "that",
+    "these", "those", "which", "who", "whom", "what", "when", "where", "why", "how",
+    "can", "could", "will", "would", "shall", "should", "may", "might", "must",
+    "do", "does", "did", "has", "have", "had", "not", "no", "so", "such", "than",
+    "too", "very", "also", "there", "their", "they", "them", "we", "our", "you",
+    "your", "he", "she", "his", "her", "i", "me", "my", "any", "all", "each",
+    "other", "some", "more", "most", "only", "own", "same", "both", "used", "use"
+}
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of a text, used to version artifacts"""
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+
+def normalize_keywords(text: str) -> List[str]:
+    """
+    Lowercase, tokenize and drop stopwords and very short tokens.
+
+    Returns:
+        list: Sorted unique keywords
+    """
+    tokens = re.findall(r"[a-z0-9]+", str(text).lower())
+    return sorted({t for t in tokens if len(t) > 2 and t not in STOPWORDS})
+
+
+def _parse_key_concepts(result: str) -> List[str]:
+    """Key concept phrases in a model response, or [] if it does not parse"""
+    try:
+        data = json.loads(result)
+        concepts = data.get("key_concepts", []) if isinstance(data, dict) else data
+        return [str(c).strip() for c in concepts if str(c).strip()]
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        return []
+
+
+def extract_key_concepts(model_answer: str) -> List[str]:
+    """
+    Ask Gemma for the key concepts of a model answer.
+
+    Returns:
+        list: Key concept phrases, or the normalized keywords if the model fails
+    """
+    prompt = f"""
+    Task: Extract the key concepts a student must mention to answer correctly.
+
+    Teacher's Answer: {model_answer}
+
+    Return only a JSON object of the form {{"key_concepts": ["concept 1", "concept 2", ...]}}.
+    """
+    system_prompt = "You are an educational assessment expert. Respond with JSON only."
+
+    result = query_gemma(prompt, system_prompt, response_format="json",
+                         validate=lambda response: bool(_parse_key_concepts(response)))
+    concepts = _parse_key_concepts(result)
+    if concepts:
+        return concepts
+
+    print(f"Could not parse key concepts response: {str(result)[:100]}")
+    return normalize_keywords(model_answer)
+
+
+def _encode_answers(answers: List[str]):
+    """
+    Embed all model answers in one batch; returns (embeddings, model name) or
+    (None, None). Only the embedding relevance backend reads the embeddings,
+    so with any other backend the model is not loaded; an embedding backend
+    enabled later encodes answers without a stored embedding on demand.
+    """
+    try:
+        from relevance_backend import RELEVANCE_BACKEND, get_relevance_backend
+        if RELEVANCE_BACKEND != "embedding":
+            return None, None
+        backend = get_relevance_backend("embedding")
+        return backend.encode(answers).tolist(), backend.model_name
+    except Exception as e:
+        print(f"Warning: Could not compute answer embeddings: {str(e)}")
+        return None, None
+
+
+def build_answer_key_artifacts(teacher_df: pd.DataFrame, digital_sheet: str) -> Dict:
+    """
+    Derive the per-question artifacts for a processed teacher sheet.
+
+    Args:
+        teacher_df: Parsed teacher sheet with question_no and answer columns
+        digital_sheet: The JSON stored as the sheet's digital_sheet
+
+    Returns:
+        dict: {"version", "format", "embedding_model", "questions": {question_no: {...}}}
+    """
+    answers = [str(a) for a in teacher_df['answer']]
+    embeddings, embedding_model = _encode_answers(answers)
+
+    questions = {}
+    for i, (q_no, answer) in enumerate(zip(teacher_df['question_no'], answers)):
+        questions[str(int(q_no))] = {
+            "answer_hash": content_hash(answer),
+            "key_concepts": extract_key_concepts(answer),
+            "keywords": normalize_keywords(answer),
+            "embedding": embeddings[i] if embeddings is not None else None
+        }
+
+    return {
+        "version": content_hash(digital_sheet),
+        "format": ARTIFACTS_FORMAT_VERSION,
+        "embedding_model": embedding_model,
+        "questions": questions
+    }
+
+
+def question_artifacts(artifacts: Optional[Dict], question_no: int, model_answer: str) -> Optional[Dict]:
+    """
+    Look up the artifacts of one question, ignoring them if they were built
+    for a different model answer or by an older artifacts format.
+    """
+    if not artifacts or artifacts.get("format") != ARTIFACTS_FORMAT_VERSION:
+        return None
+
+    entry = artifacts.get("questions", {}).get(str(int(question_no)))
+    if not entry or entry.get("answer_hash") != content_hash(model_answer):
+        return None
+
+    return dict(entry, embedding_model=artifacts.get("embedding_model"))
@@ -1,17 +1,31 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict, Any, Optional
 import os
+import math
+import time
+import asyncio
 import tempfile
 import pandas as pd
 import json
 import shutil
+import zipfile
 import traceback
+import threading
+import functools
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from db_manager import DBManager
-from evaluation_pipeline import evaluate_assessment
-from textToCsv import parse_qa_text_student,parse_qa_text_teacher
-from pdfToText import extract_text_from_pdf
+from async_evaluator import AsyncOllamaClient, evaluate_assessment_async, evaluate_class_async
+from response_cache import get_llm_cache, get_ocr_cache
+from model_residency import residency
+from job_queue import JobQueue, STATUS_SUCCEEDED, STATUS_FAILED
+from processing import (UPLOAD_DIR, BULK_UPLOAD_MAX_FILES, BULK_UPLOAD_MAX_FILE_MB, BULK_UPLOAD_MAX_TOTAL_MB,
+                        BULK_UPLOAD_MAX_ARCHIVE_MB, extract_pdf_archive)
+from loop_monitor import EventLoopLagMonitor
+from sheet_cache import sheet_cache
+from evaluation_pipeline import rescore_reports, rubric_only
 
 app = FastAPI(title="GradePro API", description="API for evaluating student answer sheets")
 
@@ -24,13 +38,100 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Define the storage directory for PDFs and CSV files
-UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
 # Initialize database connection
 db = DBManager()
 
+# PDF processing runs in worker processes (python worker.py) fed by this queue
+job_queue = JobQueue()
+
+# How often the job event stream checks for progress
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "0.5"))
+
+# Blocking work (MySQL, SQLite, file copies, sheet parsing) runs in this
+# executor so the event loop stays free to serve other requests
+API_BLOCKING_WORKERS = int(os.getenv("API_BLOCKING_WORKERS", "16"))
+blocking_executor = ThreadPoolExecutor(max_workers=API_BLOCKING_WORKERS, thread_name_prefix="api-blocking")
+
+# Measures how long the event loop is held up, exposed on /metrics
+lag_monitor = EventLoopLagMonitor()
+
+# Shared Ollama client so concurrent evaluations share one connection pool
+# and one concurrency limit
+ollama_client = None
+
+# run_blocking calls waiting for a thread and running on one, for /metrics
+# (the evaluators' asyncio.to_thread calls share the executor but are not counted)
+blocking_load_lock = threading.Lock()
+blocking_load = {"queued": 0, "running": 0}
+
+def _run_counted(call, started: list):
+    """Executor side of run_blocking: move the call from queued to running while it runs"""
+    with blocking_load_lock:
+        if not started[0]:
+            started[0] = True
+            blocking_load["queued"] -= 1
+        blocking_load["running"] += 1
+    try:
+        return call()
+    finally:
+        with blocking_load_lock:
+            blocking_load["running"] -= 1
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call in the blocking executor and await its result"""
+    loop = asyncio.get_running_loop()
+    started = [False]
+    with blocking_load_lock:
+        blocking_load["queued"] += 1
+    try:
+        return await loop.run_in_executor(blocking_executor, _run_counted,
+                                          functools.partial(func, *args, **kwargs), started)
+    finally:
+        # A call cancelled before a thread picked it up never runs
+        with blocking_load_lock:
+            if not started[0]:
+                started[0] = True
+                blocking_load["queued"] -= 1
+
+def copy_to_temp(source, suffix: str = None, max_bytes: int = None) -> Optional[str]:
+    """
+    Copy an uploaded file to a temporary file in chunks and return its path,
+    or None (leaving no file behind) if it is larger than max_bytes
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        if max_bytes is None:
+            shutil.copyfileobj(source, temp_file, 1024 * 1024)
+            return temp_file.name
+        written = 0
+        while True:
+            chunk = source.read(1024 * 1024)
+            if not chunk:
+                return temp_file.name
+            written += len(chunk)
+            if written > max_bytes:
+                break
+            temp_file.write(chunk)
+    os.unlink(temp_file.name)
+    return None
+
+@app.on_event("startup")
+async def startup():
+    global ollama_client
+    # asyncio.to_thread in the evaluators uses the same bounded executor
+    asyncio.get_running_loop().set_default_executor(blocking_executor)
+    lag_monitor.start()
+    ollama_client = AsyncOllamaClient()
+    # Load the OCR and grading models in the background so the first upload
+    # does not pay the cold start, and start unloading them once idle
+    threading.Thread(target=residency.start, daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await lag_monitor.stop()
+    if ollama_client is not None:
+        await ollama_client.close()
+    residency.stop()
+
 @app.get("/api/")
 async def root():
     """
@@ -44,7 +145,6 @@ async def root():
 
 @app.post("/api/upload/teacher-answer")
 async def upload_teacher_pdf(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...)
 ):
     """
@@ -68,27 +168,26 @@ async def upload_teacher_pdf(
         
         # Save the uploaded file using a temporary file first, then move it
         # This helps prevent issues with partial writes
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            # First write to temp file
-            shutil.copyfileobj(file.file, temp_file)
-            temp_path = temp_file.name
+        temp_path = await run_blocking(copy_to_temp, file.file)
         
         # Then move to destination
-        shutil.move(temp_path, file_path)
+        await run_blocking(shutil.move, temp_path, file_path)
         
         # 2. Store PDF in teacherSheet table
-        success = db.store_teacher_pdf(teacher_id, file_path)
+        success = await run_blocking(db.store_teacher_pdf, teacher_id, file_path)
         if not success:
             print(f"Warning: Could not store teacher PDF info in database for {teacher_id}")
         
-        # 3. Schedule PDF processing in the background to avoid blocking the API
-        background_tasks.add_task(process_teacher_pdf, teacher_id, file_path)
+        # 3. Queue PDF processing for the worker processes to avoid blocking the API
+        job_id = await run_blocking(job_queue.enqueue, "process_teacher_pdf",
+                                    {"teacher_id": teacher_id, "file_path": file_path})
         
         return JSONResponse(
             status_code=200,
             content={
                 "message": "Teacher PDF uploaded successfully, processing in background",
-                "teacher_id": teacher_id
+                "teacher_id": teacher_id,
+                "job_id": job_id
             }
         )
     except Exception as e:
@@ -103,59 +202,10 @@ async def upload_teacher_pdf(
         print(f"Error in upload_teacher_pdf: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
-async def process_teacher_pdf(teacher_id: str, file_path: str):
-    """Background task to process the teacher PDF"""
-    try:
-        # Extract text from PDF
-        extracted_text = extract_text_from_pdf(file_path)
-        
-        # Add diagnostic logging
-        print(f"Type of extracted text for teacher ID : {teacher_id}: {type(extracted_text)}")
-        
-        # Convert list to string if needed
-        if isinstance(extracted_text, list):
-            extracted_text = '\n'.join(map(str, extracted_text))
-        
-        # Parse extracted text into structured DataFrame
-        teacher_df = parse_qa_text_teacher(extracted_text)
-        
-        # Validate DataFrame
-        if teacher_df.empty:
-            print(f"Warning: Empty DataFrame after parsing teacher PDF for {teacher_id}")
-            return
-            
-        # If word_limit and total_marks columns don't exist, add default values
-        if 'total_marks' not in teacher_df.columns:
-            teacher_df['total_marks'] = 10  # Default marks per question
-        
-        if 'word_limit' not in teacher_df.columns:
-            teacher_df['word_limit'] = 100  # Default word limit per answer
-        
-        # Ensure question_no is treated as integer
-        if 'question_no' in teacher_df.columns:
-            teacher_df['question_no'] = teacher_df['question_no'].astype(int)
-        
-        # Convert DataFrame to JSON for storage
-        teacher_digital_sheet = teacher_df.to_json(orient="records")
-        
-        # Update database with digital sheet
-        success = db.update_teacher_digital_sheet(teacher_id, teacher_digital_sheet)
-        if not success:
-            print(f"Warning: Could not update digital sheet in database for teacher {teacher_id}")
-        
-        # Save DataFrame as CSV for evaluation purposes
-        csv_path = os.path.join(UPLOAD_DIR, f"{teacher_id}.csv")
-        teacher_df.to_csv(csv_path, index=False)
-        print(f"Processed teacher PDF for teacher ID : {teacher_id} successfully")
-    except Exception as e:
-        print(f"Error processing teacher PDF for {teacher_id}: {str(e)}")
-        print(f"Error occurred at line {e.__traceback__.tb_lineno}")
-        traceback.print_exc()  # Print full traceback for better debugging
-
 @app.post("/api/upload/student-answer")
 async def upload_student_pdf(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    teacher_id: Optional[str] = Form(None)
 ):
     """
     Upload a student's answer sheet PDF file:
@@ -163,6 +213,8 @@ async def upload_student_pdf(
     2. Store this PDF path in studentSheet table
     3. Convert PDF to text and parse into structured data using parse_qa_text_student
     4. Save the structured data to studentDigitalSheet in database
+    5. If teacher_id is given, evaluate the sheet against that teacher's answers
+    Follow the returned job_id with /jobs/{job_id} or /jobs/{job_id}/events
     """
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
@@ -177,27 +229,28 @@ async def upload_student_pdf(
         file_path = os.path.join(UPLOAD_DIR, file.filename)
         
         # Save the uploaded file using a temporary file first, then move it
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            # First write to temp file
-            shutil.copyfileobj(file.file, temp_file)
-            temp_path = temp_file.name
+        temp_path = await run_blocking(copy_to_temp, file.file)
         
         # Then move to destination
-        shutil.move(temp_path, file_path)
+        await run_blocking(shutil.move, temp_path, file_path)
         
         # 2. Store PDF in studentSheet table
-        success = db.store_student_pdf(student_id, file_path)
+        success = await run_blocking(db.store_student_pdf, student_id, file_path)
         if not success:
             print(f"Warning: Could not store student PDF info in database for {student_id}")
         
-        # 3. Schedule PDF processing in the background
-        background_tasks.add_task(process_student_pdf, student_id, file_path)
+        # 3. Queue PDF processing for the worker processes
+        payload = {"student_id": student_id, "file_path": file_path}
+        if teacher_id:
+            payload["teacher_id"] = teacher_id
+        job_id = await run_blocking(job_queue.enqueue, "process_student_pdf", payload)
         
         return JSONResponse(
             status_code=200,
             content={
                 "message": "Student PDF uploaded successfully, processing in background",
-                "student_id": student_id
+                "student_id": student_id,
+                "job_id": job_id
             }
         )
     except Exception as e:
@@ -212,77 +265,163 @@ async def upload_student_pdf(
         print(f"Error in upload_student_pdf: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
-async def process_student_pdf(student_id: str, file_path: str):
-    """Background task to process the student PDF"""
+@app.post("/api/upload/student-answers")
+async def upload_student_pdfs(
+    archive: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
+    teacher_id: Optional[str] = Form(None)
+):
+    """
+    Upload many students' answer sheets at once, either as a ZIP archive of
+    PDFs or as several PDF files in one multipart request. Each PDF's name
+    (without extension) is the student_id.
+    1. Stream each sheet to disk without holding the archive in memory
+    2. Register all sheets in studentSheet in one transaction
+    3. Queue processing (and evaluation, if teacher_id is given) for every sheet
+    Archive entries and uploaded files share the BULK_UPLOAD_* count and size limits.
+    """
+    if archive is None and not files:
+        raise HTTPException(status_code=400, detail="Upload a ZIP archive or one or more PDF files")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    max_file_bytes = int(BULK_UPLOAD_MAX_FILE_MB * 1024 * 1024)
+    max_total_bytes = int(BULK_UPLOAD_MAX_TOTAL_MB * 1024 * 1024)
+    sheets, skipped = [], []
+    temp_paths = []
+
     try:
-        # Extract text from PDF
-        extracted_text = extract_text_from_pdf(file_path)
-        
-        # Add diagnostic logging
-        print(f"Type of extracted text for student ID : {student_id}: {type(extracted_text)}")
-        
-        # Convert list to string if needed
-        if isinstance(extracted_text, list):
-            extracted_text = '\n'.join(map(str, extracted_text))
-        
-        # Parse extracted text into structured DataFrame
-        student_df = parse_qa_text_student(extracted_text)
-        
-        # Validate DataFrame
-        if student_df.empty:
-            print(f"Warning: Empty DataFrame after parsing student PDF for {student_id}")
-            return
-        
-        # Normalize column name if needed (question_no or answer_no)
-        if 'answer_no' in student_df.columns and 'question_no' not in student_df.columns:
-            student_df = student_df.rename(columns={'answer_no': 'question_no'})
-        
-        # Ensure question_no is treated as integer
-        if 'question_no' in student_df.columns:
-            student_df['question_no'] = student_df['question_no'].astype(int)
-        
-        # Convert DataFrame to JSON for storage
-        student_digital_sheet = student_df.to_json(orient="records")
-        
-        # Update database with digital sheet
-        success = db.update_student_digital_sheet(student_id, student_digital_sheet)
+        if archive is not None:
+            if not archive.filename.lower().endswith('.zip'):
+                raise HTTPException(status_code=400, detail="Archive must be a ZIP file")
+
+            # Copy the archive to disk in chunks, then extract entry by entry
+            temp_path = await run_blocking(copy_to_temp, archive.file, ".zip",
+                                           int(BULK_UPLOAD_MAX_ARCHIVE_MB * 1024 * 1024))
+            if temp_path is None:
+                raise HTTPException(status_code=413,
+                                    detail=f"Archive is larger than {BULK_UPLOAD_MAX_ARCHIVE_MB:g} MB")
+            temp_paths.append(temp_path)
+            try:
+                extracted = await run_blocking(extract_pdf_archive, temp_path, UPLOAD_DIR)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="Archive is not a valid ZIP file")
+            sheets.extend(extracted["sheets"])
+            skipped.extend(extracted["skipped"])
+
+        seen = {student_id for student_id, _ in sheets}
+        total_bytes = sum(os.path.getsize(file_path) for _, file_path in sheets)
+        for file in files or []:
+            filename = os.path.basename(file.filename or "")
+            student_id = os.path.splitext(filename)[0]
+            if not filename.lower().endswith('.pdf'):
+                skipped.append({"name": file.filename, "reason": "not a PDF"})
+                continue
+            if student_id in seen:
+                skipped.append({"name": file.filename, "reason": "duplicate student id"})
+                continue
+            if len(sheets) >= BULK_UPLOAD_MAX_FILES:
+                skipped.append({"name": file.filename, "reason": "too many files in upload"})
+                continue
+
+            # Stop copying at whichever limit is reached first
+            limit = min(max_file_bytes, max_total_bytes - total_bytes)
+            temp_path = await run_blocking(copy_to_temp, file.file, ".pdf", limit)
+            if temp_path is None:
+                reason = "file too large" if limit == max_file_bytes else "upload too large"
+                skipped.append({"name": file.filename, "reason": reason})
+                continue
+            temp_paths.append(temp_path)
+
+            file_path = os.path.join(UPLOAD_DIR, filename)
+            total_bytes += await run_blocking(os.path.getsize, temp_path)
+            await run_blocking(shutil.move, temp_path, file_path)
+            seen.add(student_id)
+            sheets.append((student_id, file_path))
+
+        if not sheets:
+            raise HTTPException(status_code=400, detail={"message": "No PDF answer sheets found", "skipped": skipped})
+
+        # Register every sheet in one transaction
+        success = await run_blocking(db.store_student_pdfs, sheets)
         if not success:
-            print(f"Warning: Could not update digital sheet in database for student {student_id}")
-        
-        # Save DataFrame as CSV for evaluation purposes
-        csv_path = os.path.join(UPLOAD_DIR, f"{student_id}.csv")
-        student_df.to_csv(csv_path, index=False)
-        print(f"PDF processed for student ID : {student_id} successfully")
+            print(f"Warning: Could not store {len(sheets)} student PDFs in database")
+
+        # Queue processing for all sheets at once
+        job_payloads = []
+        for student_id, file_path in sheets:
+            payload = {"student_id": student_id, "file_path": file_path}
+            if teacher_id:
+                payload["teacher_id"] = teacher_id
+            job_payloads.append(("process_student_pdf", payload))
+        job_ids = await run_blocking(job_queue.enqueue_many, job_payloads)
+
+        return JSONResponse(
+            status_code=200,
+            content={
+                "message": f"{len(sheets)} student PDFs uploaded successfully, processing in background",
+                "sheets": [
+                    {"student_id": student_id, "job_id": job_id}
+                    for (student_id, _), job_id in zip(sheets, job_ids)
+                ],
+                "skipped": skipped
+            }
+        )
+    except HTTPException as e:
+        raise e
     except Exception as e:
-        print(f"Error processing student PDF for {student_id}: {str(e)}")
-        print(f"Error occurred at line {e.__traceback__.tb_lineno}")
-        traceback.print_exc()  # Print full traceback for better debugging
+        print(f"Error in upload_student_pdfs: {str(e)}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error uploading files: {str(e)}")
+    finally:
+        # The archive, and any upload whose move failed
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
 
 @app.post("/evaluateStudentSheet")
 async def evaluate_student_sheet(
     student_id: str = Form(...),
-    teacher_id: str = Form(...)
+    teacher_id: str = Form(...),
+    reuse_ratings: bool = Form(True)
 ):
     """
     Evaluate a student's answer sheet against a teacher's model answers
     Uses the evaluate_assessment function from the evaluation_pipeline
+    If the sheet was evaluated before, questions whose answers are unchanged
+    keep their previous ratings (reported as reused_questions) unless
+    reuse_ratings is false. Marks use the rubric of the previous result, so
+    a regraded sheet keeps its credits and maximum marks.
     """
     try:
-        # Get paths to CSV files
-        teacher_csv = os.path.join(UPLOAD_DIR, f"{teacher_id}.csv")
-        student_csv = os.path.join(UPLOAD_DIR, f"{student_id}.csv")
+        # Get the parsed sheets, checked against the database copy
+        teacher_sheet = await run_blocking(sheet_cache.get, db, "teacher", teacher_id)
+        student_sheet = await run_blocking(sheet_cache.get, db, "student", student_id)
         
-        # Check if files exist
-        if not os.path.exists(teacher_csv):
+        # Check if sheets have been processed
+        if teacher_sheet is None:
             raise HTTPException(status_code=404, detail=f"Teacher sheet {teacher_id} not found or not processed yet")
-        if not os.path.exists(student_csv):
+        if student_sheet is None:
             raise HTTPException(status_code=404, detail=f"Student sheet {student_id} not found or not processed yet")
         
+        previous = await run_blocking(db.get_evaluation_results, student_id=student_id, teacher_id=teacher_id)
+        previous_result = previous[0]['result_json'] if previous else None
+        if not reuse_ratings:
+            previous_result = rubric_only(previous_result)
+        
         # Evaluate the assessment using the imported function
-        evaluation_result = evaluate_assessment(teacher_csv, student_csv)
+        evaluation_result = await evaluate_assessment_async(
+            teacher_sheet,
+            student_sheet,
+            client=ollama_client,
+            answer_key_artifacts=await run_blocking(db.get_teacher_artifacts, teacher_id),
+            previous_result=previous_result
+        )
         
         # Store the evaluation result in the database
-        success = db.store_evaluation_result(student_id, teacher_id, evaluation_result)
+        success = await run_blocking(db.store_evaluation_result, student_id, teacher_id, evaluation_result)
         if not success:
             print(f"Warning: Could not store evaluation result in database for {student_id}/{teacher_id}")
         
@@ -296,21 +435,238 @@ async def evaluate_student_sheet(
         traceback.print_exc()  # Print full traceback for better debugging
         raise HTTPException(status_code=500, detail=f"Evaluation error: {str(e)}")
 
+@app.post("/evaluateBatch")
+async def evaluate_batch(
+    teacher_id: str = Form(...),
+    student_ids: Optional[List[str]] = Form(None),
+    all_students: bool = Form(False),
+    reuse_ratings: bool = Form(True)
+):
+    """
+    Evaluate many students' answer sheets against one teacher's model answers.
+    Pass student_ids (repeated or comma-separated), or all_students=true to
+    grade every processed student sheet.
+
+    The answer key is loaded once and all student-question grading shares the
+    API's Ollama concurrency limit. Results are streamed as newline-delimited
+    JSON, one line per student as soon as it is graded, followed by a summary line.
+    Answers unchanged since a student's previous evaluation keep their ratings
+    unless reuse_ratings is false; each student keeps the rubric of their
+    previous result.
+    """
+    teacher_sheet = await run_blocking(sheet_cache.get, db, "teacher", teacher_id)
+    if teacher_sheet is None:
+        raise HTTPException(status_code=404, detail=f"Teacher sheet {teacher_id} not found or not processed yet")
+
+    if all_students:
+        ids = await run_blocking(db.get_processed_student_ids)
+    else:
+        ids = [sid.strip() for value in (student_ids or []) for sid in value.split(",") if sid.strip()]
+    if not ids:
+        raise HTTPException(status_code=400, detail="Provide student_ids or set all_students")
+
+    # Keep order, drop duplicates
+    ids = list(dict.fromkeys(ids))
+    found = await run_blocking(sheet_cache.get_many, db, "student", ids)
+    student_sheets = {sid: found.get(sid) for sid in ids}
+    answer_key_artifacts = await run_blocking(db.get_teacher_artifacts, teacher_id)
+    requested = set(ids)
+    previous_results = {
+        row['student_id']: row['result_json'] if reuse_ratings else rubric_only(row['result_json'])
+        for row in await run_blocking(db.get_evaluation_results, teacher_id=teacher_id)
+        if row['student_id'] in requested
+    }
+
+    async def stream():
+        started = time.time()
+        succeeded, failed, reused = 0, 0, 0
+        try:
+            async for student_id, evaluation_result in evaluate_class_async(
+                teacher_sheet,
+                student_sheets,
+                client=ollama_client,
+                answer_key_artifacts=answer_key_artifacts,
+                previous_results=previous_results
+            ):
+                if "error" in evaluation_result:
+                    failed += 1
+                    line = {"student_id": student_id, "status": "error", "error": evaluation_result["error"]}
+                else:
+                    succeeded += 1
+                    reused += evaluation_result.get("reused_questions", 0)
+                    success = await run_blocking(db.store_evaluation_result, student_id, teacher_id,
+                                                 evaluation_result)
+                    if not success:
+                        print(f"Warning: Could not store evaluation result in database for {student_id}/{teacher_id}")
+                    line = {
+                        "student_id": student_id,
+                        "status": "ok",
+                        "total_marks": evaluation_result["total_marks"],
+                        "result": evaluation_result
+                    }
+                yield json.dumps(line, default=str) + "\n"
+        except Exception as e:
+            print(f"Error in evaluate_batch: {str(e)}")
+            traceback.print_exc()
+            yield json.dumps({"status": "error", "error": f"Evaluation error: {str(e)}"}) + "\n"
+
+        yield json.dumps({"summary": {
+            "teacher_id": teacher_id,
+            "students": len(ids),
+            "succeeded": succeeded,
+            "failed": failed,
+            "reused_questions": reused,
+            "seconds": round(time.time() - started, 2)
+        }}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/regrade")
+async def regrade(
+    student_id: Optional[str] = Form(None),
+    teacher_id: Optional[str] = Form(None),
+    date_from: Optional[datetime] = Form(None),
+    date_to: Optional[datetime] = Form(None),
+    min_marks: Optional[float] = Form(None),
+    max_marks: Optional[float] = Form(None),
+    credit_list: Optional[str] = Form(None, description="Credits for keyword, content, grammar, length, "
+                                                        "e.g. 4,3,2,1; each result keeps its own if omitted"),
+    question_max_marks: Optional[str] = Form(None, description='JSON object of new maximum marks, e.g. {"3": 5}'),
+    dry_run: bool = Form(False)
+):
+    """
+    Recompute marks of stored evaluations with new credit weights and/or
+    maximum marks, from the ratings saved in each result, without calling
+    the model. Select one student, one teacher's exam, or any results
+    matching the date and total marks filters (as in /getAllResults).
+
+    All regraded results are written back in one transaction; with
+    dry_run=true nothing is written and the new totals are only returned.
+    The new credits and maximum marks are stored with each result and used
+    again when the sheet is re-evaluated.
+    """
+    filters = dict(student_id=student_id, teacher_id=teacher_id, date_from=date_from, date_to=date_to,
+                   min_marks=min_marks, max_marks=max_marks)
+    if all(value is None for value in filters.values()):
+        raise HTTPException(status_code=400, detail="Select results with student_id, teacher_id or a filter")
+
+    credits = None
+    if credit_list:
+        try:
+            credits = [float(credit) for credit in credit_list.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=422, detail="credit_list must be comma-separated numbers")
+        if (len(credits) != 4 or not all(math.isfinite(credit) and credit >= 0 for credit in credits)
+                or sum(credits) <= 0):
+            raise HTTPException(status_code=422, detail="credit_list needs four finite, non-negative credits with a positive sum")
+
+    try:
+        new_max_marks = {int(q_no): float(marks) for q_no, marks in json.loads(question_max_marks).items()} \
+            if question_max_marks else None
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=422, detail="question_max_marks must be a JSON object of question_no: marks")
+    if new_max_marks and not all(math.isfinite(marks) and marks >= 0 for marks in new_max_marks.values()):
+        raise HTTPException(status_code=422, detail="question_max_marks must be finite, non-negative numbers")
+
+    try:
+        started = time.time()
+        stored = await run_blocking(db.get_evaluation_results, **filters)
+        rescored = await run_blocking(rescore_reports, [row['result_json'] for row in stored], credits, new_max_marks)
+
+        updated = 0
+        if not dry_run:
+            updated = await run_blocking(db.update_evaluation_marks, [
+                {"student_id": row['student_id'], "teacher_id": row['teacher_id'],
+                 "revision": row['revision'], "result": result}
+                for row, result in zip(stored, rescored)
+            ])
+            if updated < 0:
+                raise HTTPException(status_code=500, detail="Could not store regraded results")
+
+        return {
+            "matched": len(stored),
+            "updated": updated,
+            "dry_run": dry_run,
+            "credit_list": credits,
+            "seconds": round(time.time() - started, 3),
+            "results": [
+                {
+                    "student_id": row['student_id'],
+                    "teacher_id": row['teacher_id'],
+                    "previous_total": float(row['total_marks']),
+                    "total_marks": result['total_marks'],
+                    "rubric": result['rubric']
+                }
+                for row, result in zip(stored, rescored)
+            ]
+        }
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Error in regrade: {str(e)}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Regrade error: {str(e)}")
+
 @app.get("/getAllResults")
-async def get_all_results():
+async def get_all_results(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    teacher_id: Optional[str] = Query(None),
+    date_from: Optional[datetime] = Query(None),
+    date_to: Optional[datetime] = Query(None),
+    min_marks: Optional[float] = Query(None),
+    max_marks: Optional[float] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated columns, e.g. student_id,total_marks")
+):
     """
-    Get all evaluation results from the database
-    Returns a list of all results with student_id, teacher_id, total_marks, etc.
+    Get evaluation results from the database, newest first, one page at a time
+    Returns results with student_id, teacher_id, total_marks, etc. and a
+    next_cursor to pass back for the following page (null on the last page).
+    Filter by teacher, evaluation date and total marks; leave result_json out
+    of fields to get a lightweight listing.
     """
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    if field_list:
+        unknown = [field for field in field_list if field not in DBManager.RESULT_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400,
+                                detail=f"Unknown fields {unknown}, expected any of {list(DBManager.RESULT_FIELDS)}")
+    
     try:
-        results = db.get_all_evaluation_results()
-        return {"results": results}
+        page = await run_blocking(
+            db.get_evaluation_results_page,
+            limit=limit,
+            cursor=cursor,
+            teacher_id=teacher_id,
+            date_from=date_from,
+            date_to=date_to,
+            min_marks=min_marks,
+            max_marks=max_marks,
+            fields=field_list
+        )
+        return page
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error in get_all_results: {str(e)}")
         print(f"Error occurred at line {e.__traceback__.tb_lineno}")
         traceback.print_exc()  # Print full traceback for better debugging
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@app.get("/analytics/questions/{teacher_id}")
+async def question_analytics(teacher_id: str):
+    """
+    Per-question statistics for a teacher's exam: how many students were
+    graded, average/min/max marks and the average of each criterion rating
+    """
+    try:
+        questions = await run_blocking(db.get_question_statistics, teacher_id)
+        return {"teacher_id": teacher_id, "questions": questions}
+    except Exception as e:
+        print(f"Error in question_analytics: {str(e)}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
 @app.get("/getResult/{student_id}")
 async def get_result(student_id: str):
     """
@@ -318,7 +674,7 @@ async def get_result(student_id: str):
     Returns detailed information about the student's performance
     """
     try:
-        result = db.get_evaluation_result(student_id)
+        result = await run_blocking(db.get_evaluation_result, student_id)
         if not result:
             raise HTTPException(status_code=404, detail=f"No result found for student {student_id}")
         return result
@@ -331,6 +687,89 @@ async def get_result(student_id: str):
         traceback.print_exc()  # Print full traceback for better debugging
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of a background job: queued/running/succeeded/failed, the stage it
+    is in (render, ocr, parse, store, evaluate), page progress, time spent per
+    stage, and the error or result once it has finished
+    """
+    job = await run_blocking(job_queue.status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-Sent Events stream of a job's status. A "progress" event is sent
+    whenever the job changes, and a final "done" event once it has succeeded
+    or failed, after which the stream closes.
+    """
+    if await run_blocking(job_queue.status, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def stream():
+        last_update = None
+        while True:
+            job = await run_blocking(job_queue.status, job_id)
+            if job is None:
+                return
+            finished = job["status"] in (STATUS_SUCCEEDED, STATUS_FAILED)
+            if job["updated_at"] != last_update or finished:
+                last_update = job["updated_at"]
+                event = "done" if finished else "progress"
+                yield f"event: {event}\ndata: {json.dumps(job)}\n\n"
+            if finished:
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters and size of the persistent model response and page OCR
+    caches and of this process's parsed sheet cache
+    """
+    def collect():
+        llm_cache = get_llm_cache()
+        ocr_cache = get_ocr_cache()
+        return {
+            "llm": llm_cache.stats() if llm_cache else {"enabled": False},
+            "ocr": ocr_cache.stats() if ocr_cache else {"enabled": False},
+            "sheets": sheet_cache.stats()
+        }
+
+    return await run_blocking(collect)
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Event-loop lag, blocking executor load, job queue depth and Ollama
+    concurrency, for spotting where requests are waiting
+    """
+    with blocking_load_lock:
+        load = dict(blocking_load)
+    return {
+        "event_loop_lag": lag_monitor.stats(),
+        "blocking_executor": dict(load, max_workers=API_BLOCKING_WORKERS),
+        "ollama": {"max_concurrency": ollama_client.max_concurrency if ollama_client else None},
+        "jobs": await run_blocking(job_queue.counts)
+    }
+
+@app.get("/models/status")
+async def models_status():
+    """
+    Models currently kept resident and how many jobs are using each
+    """
+    # status() queries the shared usage table in jobs.db, which workers keep busy
+    return {"models": await run_blocking(residency.status)}
+
 @app.get("/healthcheck")
 async def health_check():
     """
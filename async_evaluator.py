@@ -0,0 +1,312 @@
+"""
+async_evaluator.py - Concurrent evaluation engine for GraderPro
+
+Grades every question (and, in per-criterion mode, every criterion) of an
+answer sheet concurrently against Ollama. Requests go through one pooled
+keep-alive HTTP client and a semaphore that bounds how many are in flight,
+so the server's parallel slots (OLLAMA_NUM_PARALLEL) are used without
+overloading it.
+
+evaluate_class_async grades many student sheets against one answer key:
+the key is loaded once and every student-question task is scheduled through
+the same client, with each student's report yielded as soon as it is done.
+"""
+
+import os
+import asyncio
+from typing import Any, AsyncIterator, Dict, Tuple
+import httpx
+
+from ollamaKeyFactor import (
+    OLLAMA_API_URL,
+    GEMMA_MODEL,
+    CRITERIA_FIELDS,
+    build_payload,
+    payload_cache_key,
+    build_prompt,
+    parse_percentage,
+    parse_criteria_response,
+    is_percentage_response,
+    is_criteria_response,
+    word_count_rating
+)
+from response_cache import get_llm_cache
+from model_residency import residency
+from evaluation_pipeline import (
+    GRADING_MODES,
+    DEFAULT_GRADING_MODE,
+    load_questions,
+    load_answer_key,
+    attach_student_answers,
+    build_report,
+    key_concepts,
+    precompute_content_ratings,
+    reusable_ratings,
+    resolve_rubric,
+    merge_ratings
+)
+
+# Maximum number of concurrent requests sent to Ollama
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+
+
+class AsyncOllamaClient:
+    """Pooled, concurrency-limited async client for Ollama's generate endpoint"""
+
+    def __init__(self,
+                 max_concurrency: int = OLLAMA_MAX_CONCURRENCY,
+                 connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout: float = OLLAMA_READ_TIMEOUT,
+                 api_url: str = OLLAMA_API_URL):
+        self.api_url = api_url
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency
+            )
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Close the underlying connection pool"""
+        await self._client.aclose()
+
+    async def query(self, prompt, system_prompt=None, response_format=None, validate=None) -> str:
+        """
+        Query the grading model, waiting for a free slot if the limit is reached.
+        Responses that validate rejects are returned but not cached.
+
+        Returns:
+            str: The model's response text, or "" on any error
+        """
+        payload = build_payload(prompt, system_prompt, response_format)
+
+        # The cache is SQLite on local disk; keep its I/O off the event loop
+        cache = get_llm_cache()
+        cache_key = payload_cache_key(payload) if cache else None
+        if cache_key:
+            cached = await asyncio.to_thread(cache.get, cache_key)
+            if cached is not None:
+                return cached
+
+        async with self._semaphore:
+            try:
+                response = await self._client.post(self.api_url, json=payload)
+                if response.status_code == 200:
+                    result = response.json().get("response", "")
+                    if cache_key and result and (validate is None or validate(result)):
+                        await asyncio.to_thread(cache.set, cache_key, result)
+                    return result
+                print(f"Error response from Ollama API: {response.text}")
+                return ""
+            except httpx.TimeoutException:
+                print(f"Timeout querying Ollama API at {self.api_url}")
+                return ""
+            except Exception as e:
+                print(f"Exception in async Ollama query: {str(e)}")
+                return ""
+
+    async def rate_criterion(self, criterion, student_answer, teacher_answer="", minimum_words=0,
+                             key_concepts=None) -> float:
+        """Rate a single criterion, mirroring the functions in ollamaKeyFactor"""
+        prompt, system_prompt = build_prompt(criterion, student_answer, teacher_answer, minimum_words,
+                                             key_concepts)
+        rating = parse_percentage(await self.query(prompt, system_prompt, validate=is_percentage_response))
+        if rating is not None:
+            return rating
+        if criterion == "length":
+            return word_count_rating(student_answer, minimum_words)
+        return 0.0
+
+    async def rate_answer(self, student_answer, teacher_answer, minimum_words=0,
+                          grading_mode="combined", known_ratings=None, key_concepts=None) -> dict:
+        """
+        Rate one answer on every criterion.
+
+        In "combined" mode one structured call is made and only invalid criteria
+        are re-queried; in "per_criterion" mode all four calls run concurrently.
+        Criteria present in known_ratings are not asked of the model again.
+        """
+        if grading_mode == "combined":
+            prompt, system_prompt = build_prompt("combined", student_answer, teacher_answer, minimum_words,
+                                                 key_concepts)
+            ratings = parse_criteria_response(await self.query(prompt, system_prompt, response_format="json",
+                                                               validate=is_criteria_response))
+        else:
+            ratings = {key: None for key in CRITERIA_FIELDS}
+
+        if known_ratings:
+            ratings.update({key: value for key, value in known_ratings.items() if value is not None})
+        missing = [key for key, rating in ratings.items() if rating is None]
+
+        if missing:
+            values = await asyncio.gather(*[
+                self.rate_criterion(key, student_answer, teacher_answer, minimum_words, key_concepts)
+                for key in missing
+            ])
+            ratings.update(zip(missing, values))
+
+        return ratings
+
+
+async def evaluate_assessment_async(teacher_sheet,
+                                    student_sheet,
+                                    default_word_limit: int = 100,
+                                    credit_list: list = None,
+                                    grading_mode: str = DEFAULT_GRADING_MODE,
+                                    client: AsyncOllamaClient = None,
+                                    relevance_backend: str = None,
+                                    answer_key_artifacts: dict = None,
+                                    previous_result: dict = None) -> dict:
+    """
+    Async counterpart of evaluation_pipeline.evaluate_assessment.
+
+    All questions are graded concurrently; the result has the same shape as the
+    synchronous version. Pass a shared client to bound concurrency across sheets,
+    and the sheet's previous_result to reuse ratings of unchanged answers and
+    keep its rubric (unless credit_list is given).
+    """
+    if grading_mode not in GRADING_MODES:
+        raise ValueError(f"Unknown grading mode '{grading_mode}', expected one of {GRADING_MODES}")
+
+    # Joining the sheets (and reading them, if given as CSV paths) is blocking
+    questions = await asyncio.to_thread(load_questions, teacher_sheet, student_sheet, default_word_limit,
+                                        answer_key_artifacts)
+    reused = await asyncio.to_thread(reusable_ratings, questions, previous_result, grading_mode, relevance_backend)
+    pending = [q for q, ratings in zip(questions, reused) if ratings is None]
+
+    # Embedding-based relevance is CPU bound, keep it off the event loop
+    content_ratings = await asyncio.to_thread(precompute_content_ratings, pending, relevance_backend)
+
+    owns_client = client is None
+    if owns_client:
+        client = AsyncOllamaClient()
+
+    try:
+        # Nothing to load the model for when every answer is unchanged
+        async with residency.use_async(*([GEMMA_MODEL] if pending else [])):
+            new_ratings = await asyncio.gather(*[
+                client.rate_answer(q['student_answer'], q['teacher_answer'], q['word_limit'], grading_mode,
+                                   {'content': content}, key_concepts(q))
+                for q, content in zip(pending, content_ratings)
+            ])
+    finally:
+        if owns_client:
+            await client.close()
+
+    report = build_report(questions, merge_ratings(reused, new_ratings),
+                          resolve_rubric(previous_result, credit_list))
+    report['reused_questions'] = len(questions) - len(pending)
+    return report
+
+
+async def evaluate_class_async(teacher_sheet,
+                               student_sheets: Dict[str, Any],
+                               default_word_limit: int = 100,
+                               credit_list: list = None,
+                               grading_mode: str = DEFAULT_GRADING_MODE,
+                               client: AsyncOllamaClient = None,
+                               relevance_backend: str = None,
+                               answer_key_artifacts: dict = None,
+                               previous_results: Dict[str, dict] = None) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Grade many student sheets against one teacher sheet.
+
+    The answer key is loaded once, content relevance is scored for the whole
+    class in one batch, and every student-question task is scheduled at once
+    through the client, whose semaphore bounds the requests in flight.
+
+    Args:
+        teacher_sheet: The teacher's parsed sheet, as a DataFrame or CSV path
+        student_sheets (dict): student_id -> the student's parsed sheet, as a
+            DataFrame or CSV path, or None if the sheet has not been processed
+        previous_results (dict, optional): student_id -> the student's previous
+            result against this teacher sheet; ratings of unchanged answers are
+            reused and its rubric is kept unless credit_list is given
+
+    Yields:
+        tuple: (student_id, report) as each student finishes, in completion
+               order. A student whose sheet could not be graded yields
+               {"error": message} instead of a report.
+    """
+    if grading_mode not in GRADING_MODES:
+        raise ValueError(f"Unknown grading mode '{grading_mode}', expected one of {GRADING_MODES}")
+
+    answer_key = await asyncio.to_thread(load_answer_key, teacher_sheet, default_word_limit,
+                                         answer_key_artifacts)
+
+    previous_results = previous_results or {}
+    sheets, reused, pending = {}, {}, {}
+    for student_id, student_sheet in student_sheets.items():
+        if student_sheet is None:
+            yield student_id, {"error": f"Student sheet {student_id} not found or not processed yet"}
+            continue
+        try:
+            questions = await asyncio.to_thread(attach_student_answers, answer_key, student_sheet)
+            reused[student_id] = await asyncio.to_thread(reusable_ratings, questions,
+                                                         previous_results.get(student_id), grading_mode,
+                                                         relevance_backend)
+        except Exception as e:
+            yield student_id, {"error": f"Could not load student sheet: {e}"}
+            continue
+        sheets[student_id] = questions
+        pending[student_id] = [q for q, ratings in zip(questions, reused[student_id]) if ratings is None]
+
+    if not sheets:
+        return
+
+    # Score relevance for every new or changed answer of the class in one batch, off the event loop
+    all_questions = [q for questions in pending.values() for q in questions]
+    all_content = await asyncio.to_thread(precompute_content_ratings, all_questions, relevance_backend)
+    content_ratings = {}
+    offset = 0
+    for student_id, questions in pending.items():
+        content_ratings[student_id] = all_content[offset:offset + len(questions)]
+        offset += len(questions)
+
+    owns_client = client is None
+    if owns_client:
+        client = AsyncOllamaClient()
+
+    async def grade_student(student_id: str) -> Tuple[str, dict]:
+        questions = sheets[student_id]
+        try:
+            new_ratings = await asyncio.gather(*[
+                client.rate_answer(q['student_answer'], q['teacher_answer'], q['word_limit'], grading_mode,
+                                   {'content': content}, key_concepts(q))
+                for q, content in zip(pending[student_id], content_ratings[student_id])
+            ])
+            report = build_report(questions, merge_ratings(reused[student_id], new_ratings),
+                                  resolve_rubric(previous_results.get(student_id), credit_list))
+            report['reused_questions'] = len(questions) - len(pending[student_id])
+            return student_id, report
+        except Exception as e:
+            return student_id, {"error": f"Evaluation error: {e}"}
+
+    tasks = [asyncio.create_task(grade_student(student_id)) for student_id in sheets]
+    try:
+        async with residency.use_async(*([GEMMA_MODEL] if all_questions else [])):
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+    finally:
+        # Stop outstanding grading if the consumer goes away early
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if owns_client:
+            await client.close()
+
+
+def evaluate_assessment_concurrent(teacher_sheet, student_sheet, **kwargs) -> dict:
+    """Blocking wrapper around evaluate_assessment_async for synchronous callers"""
+    return asyncio.run(evaluate_assessment_async(teacher_sheet, student_sheet, **kwargs))
@@ -0,0 +1,121 @@
+"""
+benchmark_ocr_encoding.py - Compare page encodings for the OCR vision model
+
+Renders the pages of every PDF in a sample directory once, then OCRs them
+with each encoding setting and reports payload size, encode time, OCR
+latency and text accuracy. Accuracy is measured against a ground-truth
+<name>.txt next to each PDF when present, otherwise against the output of
+the baseline encoding (full-size colour PNG, the original behaviour).
+
+Usage:
+    python benchmark_ocr_encoding.py --samples Sample --max-pages 3
+"""
+
+import os
+import time
+import argparse
+import difflib
+from typing import Dict, List
+
+from pdfToText import iter_pdf_pages, PDF_RENDER_SCALE
+from TrOcr import encode_image, ocr_encoded
+
+ENCODINGS = {
+    "png-color-full": {"format": "PNG", "quality": 0, "grayscale": False, "max_side": 0},
+    "png-gray-full": {"format": "PNG", "quality": 0, "grayscale": True, "max_side": 0},
+    "png-gray-1536": {"format": "PNG", "quality": 0, "grayscale": True, "max_side": 1536},
+    "jpeg85-gray-1536": {"format": "JPEG", "quality": 85, "grayscale": True, "max_side": 1536},
+    "webp80-gray-1536": {"format": "WEBP", "quality": 80, "grayscale": True, "max_side": 1536},
+    "jpeg70-gray-1024": {"format": "JPEG", "quality": 70, "grayscale": True, "max_side": 1024}
+}
+BASELINE = "png-color-full"
+
+
+def similarity(a: str, b: str) -> float:
+    """Character-level similarity in [0, 1], whitespace-normalised"""
+    return difflib.SequenceMatcher(None, " ".join(a.split()), " ".join(b.split())).ratio()
+
+
+def load_samples(sample_dir: str, max_pages: int, scale: float) -> List[Dict]:
+    samples = []
+    for name in sorted(os.listdir(sample_dir)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        pdf_path = os.path.join(sample_dir, name)
+        truth_path = os.path.splitext(pdf_path)[0] + ".txt"
+        truth = None
+        if os.path.exists(truth_path):
+            with open(truth_path, "r", encoding="utf-8") as f:
+                truth = f.read()
+
+        pages = []
+        for page_number, image in enumerate(iter_pdf_pages(pdf_path, scale), start=1):
+            if max_pages and page_number > max_pages:
+                image.close()
+                break
+            pages.append(image)
+        samples.append({"name": name, "pages": pages, "truth": truth})
+    return samples
+
+
+def run_encoding(samples: List[Dict], encoding: Dict) -> Dict:
+    payload_bytes, encode_seconds, ocr_seconds = [], [], []
+    outputs = {}
+    for sample in samples:
+        texts = []
+        for image in sample["pages"]:
+            started = time.perf_counter()
+            base64_image = encode_image(image, encoding)
+            encode_seconds.append(time.perf_counter() - started)
+            payload_bytes.append(len(base64_image))
+
+            started = time.perf_counter()
+            texts.append(ocr_encoded(base64_image))
+            ocr_seconds.append(time.perf_counter() - started)
+        outputs[sample["name"]] = "\n\n".join(texts)
+
+    count = max(len(payload_bytes), 1)
+    return {
+        "payload_kb": sum(payload_bytes) / count / 1024,
+        "encode_ms": sum(encode_seconds) / count * 1000,
+        "ocr_s": sum(ocr_seconds) / count,
+        "outputs": outputs
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default="Sample", help="Directory of sample PDFs (and optional .txt ground truth)")
+    parser.add_argument("--max-pages", type=int, default=3, help="Pages per PDF to benchmark (0 = all)")
+    parser.add_argument("--scale", type=float, default=PDF_RENDER_SCALE, help="PDF render scale")
+    parser.add_argument("--encodings", nargs="*", default=list(ENCODINGS), choices=list(ENCODINGS))
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples, args.max_pages, args.scale)
+    if not samples:
+        print(f"No PDFs found in {args.samples}")
+        return
+
+    names = [BASELINE] + [name for name in args.encodings if name != BASELINE]
+    results = {name: run_encoding(samples, ENCODINGS[name]) for name in names}
+
+    for name, result in results.items():
+        scores = []
+        for sample in samples:
+            reference = sample["truth"] if sample["truth"] is not None else results[BASELINE]["outputs"][sample["name"]]
+            scores.append(similarity(result["outputs"][sample["name"]], reference))
+        result["accuracy"] = sum(scores) / len(scores)
+
+    baseline = results[BASELINE]
+    print(f"{'encoding':<20}{'payload KB':>12}{'encode ms':>11}{'OCR s':>9}{'accuracy':>10}{'delta':>9}")
+    for name, result in results.items():
+        print(f"{name:<20}{result['payload_kb']:>12.1f}{result['encode_ms']:>11.1f}{result['ocr_s']:>9.2f}"
+              f"{result['accuracy']:>10.3f}{result['accuracy'] - baseline['accuracy']:>+9.3f}")
+
+    for sample in samples:
+        for image in sample["pages"]:
+            image.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 # grade_list must be rated in [0,10]
 
+import numpy as np
+
 def calculate_cgpa(grade_list, credits_list):
     """
     Calculate CGPA for a single question.
@@ -38,6 +40,34 @@ def calculate_marks_obtained(rating_list, credit_list, total_marks):
     return round(marks_obtained, 0)
 
 
+def calculate_marks_batch(ratings, credit_list, max_marks):
+    """
+    Vectorized calculate_marks_obtained for many answers at once.
+
+    Performs the same floating-point operations in the same order as
+    calculate_marks_obtained, and numpy rounds half to even like round(), so
+    every mark is identical to the per-question result.
+
+    :param ratings: Array of shape (students, questions, criteria) rated in [0,10].
+    :param credit_list: Credits for each key-factor, in criteria order.
+    :param max_marks: Total marks per question, shape (questions,) or (students, questions).
+    :return: (marks of shape (students, questions), totals of shape (students,))
+    """
+    ratings = np.asarray(ratings, dtype=float)
+    total_credits = sum(credit_list)
+
+    weighted_cgpas = np.zeros(ratings.shape[:-1])
+    for criterion, credit in zip(range(ratings.shape[-1]), credit_list):
+        weighted_cgpas = weighted_cgpas + ratings[..., criterion] * credit
+
+    cgpa = weighted_cgpas / total_credits
+
+    percentage = cgpa * 9.5
+
+    marks_obtained = np.round((percentage / 100) * np.asarray(max_marks, dtype=float), 0)
+    return marks_obtained, marks_obtained.sum(axis=-1)
+
+
 
 
 # Example Usage
@@ -1,7 +1,14 @@
 import os
 import json
+import base64
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+from contextlib import contextmanager
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
 from typing import Dict, List, Any, Optional
 import pandas as pd
 from dotenv import load_dotenv
@@ -12,326 +19,792 @@ try:
 except ImportError:
     pass  # dotenv not installed, using environment variables directly
 
+# Connection pool settings; mysql.connector caps a pool at 32 connections
+DB_POOL_NAME = os.getenv("DB_POOL_NAME", "graderpro_pool")
+DB_POOL_SIZE = min(int(os.getenv("DB_POOL_SIZE", "5")), pooling.CNX_POOL_MAXSIZE)
+DB_POOL_RESET_SESSION = os.getenv("DB_POOL_RESET_SESSION", "true").lower() == "true"
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+
+# Embedded database used when MySQL is unavailable, and the directory the
+# old one-JSON-file-per-record fallback wrote to (imported on first use)
+FALLBACK_DATA_DIR = os.path.join(os.getcwd(), "data_storage")
+FALLBACK_DB_PATH = os.getenv("FALLBACK_DB_PATH", os.path.join(FALLBACK_DATA_DIR, "graderpro.db"))
+
+# Errors raised by either database driver
+DB_ERRORS = (Error, sqlite3.Error)
+
+# MySQL errors raised when another process added the same column or index
+# first; schema setup treats them as success
+ER_DUP_FIELDNAME = 1060
+ER_DUP_KEYNAME = 1061
+
+# Sheet kind -> (table, id column) for the digital sheet lookups
+SHEET_TABLES = {
+    "teacher": ("teacherSheet", "teacher_id"),
+    "student": ("studentSheet", "student_id")
+}
+
+def sheet_checksum(digital_sheet: str) -> str:
+    """SHA-256 of a digital sheet, stored with it so cached copies can be validated"""
+    return hashlib.sha256(str(digital_sheet).encode("utf-8")).hexdigest()
+
+class _SQLiteCursor:
+    """
+    Gives a sqlite3 cursor the parts of the mysql.connector cursor interface
+    DBManager uses: %s placeholders, dictionary rows and rowcount
+    """
+    
+    def __init__(self, cursor: sqlite3.Cursor, dictionary: bool = False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+    
+    @staticmethod
+    def _adapt(params):
+        # Store datetimes in the same text format as CURRENT_TIMESTAMP so they compare correctly
+        return tuple(
+            value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime) else value
+            for value in params
+        )
+    
+    def _row(self, row):
+        if row is None:
+            return None
+        return dict(row) if self._dictionary else tuple(row)
+    
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace("%s", "?"), self._adapt(params))
+    
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(query.replace("%s", "?"), [self._adapt(params) for params in seq_of_params])
+    
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+    
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+    
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+    
+    def close(self):
+        self._cursor.close()
+
 class DBManager:
-    """Database manager for GradePro application"""
+    """
+    Database manager for GradePro application.
+    
+    Every operation borrows its own connection from a bounded pool and
+    returns it when done, so one DBManager can be shared by concurrent
+    request handlers and worker threads. When MySQL is unavailable the same
+    schema and queries run on an embedded SQLite database in WAL mode.
+    """
+    
+    # Columns of evaluationResults that a results listing can project
+    RESULT_FIELDS = ("student_id", "teacher_id", "total_marks", "result_json", "evaluated_at")
     
     def __init__(self):
-        """Initialize database connection"""
-        self.connection = None
+        """Initialize database connection pool"""
+        self.pool = None
+        self._pool_slots = None
+        self._pool_lock = threading.Lock()
+        self.dialect = "mysql"
+        self._sqlite_local = threading.local()
         self._connect_to_database()
     
     def _connect_to_database(self):
-        """Establish connection to MySQL database"""
+        """
+        Create the MySQL connection pool and the schema. Only a failure to
+        reach MySQL switches to the SQLite fallback; schema errors are raised,
+        so one process never ends up on a different database than the others.
+        """
         try:
             # Get database configuration from environment variables or use defaults
             host = os.getenv("DB_HOST", "localhost")
+            port = int(os.getenv("DB_PORT", "3306"))
             user = os.getenv("DB_USER", "root")
             password = os.getenv("DB_PASSWORD", "12345")
             database = os.getenv("DB_NAME", "GraderPro_db")
             
-            # Create connection
-            self.connection = mysql.connector.connect(
+            # Create database if it doesn't exist
+            connection = mysql.connector.connect(
                 host=host,
+                port=port,
                 user=user,
                 password=password
             )
-            
-            # Create database if it doesn't exist
-            cursor = self.connection.cursor()
+            cursor = connection.cursor()
             cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database}")
-            cursor.execute(f"USE {database}")
             cursor.close()
+            connection.close()
             
-            print(f"Connected to MySQL database: {database}")
-            
-            # Create tables
-            self._create_tables_if_not_exist()
+            # Create connection pool
+            self.pool = pooling.MySQLConnectionPool(
+                pool_name=DB_POOL_NAME,
+                pool_size=DB_POOL_SIZE,
+                pool_reset_session=DB_POOL_RESET_SESSION,
+                host=host,
+                port=port,
+                user=user,
+                password=password,
+                database=database
+            )
+            # The pool raises instead of waiting when it is exhausted; this
+            # semaphore makes callers wait for a free connection instead
+            self._pool_slots = threading.BoundedSemaphore(DB_POOL_SIZE)
             
+            print(f"Connected to MySQL database: {database} (pool of {DB_POOL_SIZE} connections)")
+        
         except Error as e:
             print(f"Error connecting to MySQL database: {e}")
-            # Create a fallback SQLite database or file-based storage for development/testing
+            # Create a fallback SQLite database for development/testing
             self._setup_fallback_storage()
+            return
+        
+        # Create tables
+        self._create_tables_if_not_exist()
     
     def _setup_fallback_storage(self):
         """Setup fallback storage when database connection fails"""
-        # This is a simple file-based storage mechanism
-        # Each "table" will be a directory, and each "record" will be a JSON file
+        # An embedded SQLite database with the same tables and indexes as MySQL
         self.fallback_mode = True
-        self.data_dir = os.path.join(os.getcwd(), "data_storage")
+        self.pool = None
+        self.dialect = "sqlite"
+        self.data_dir = FALLBACK_DATA_DIR
+        os.makedirs(os.path.dirname(os.path.abspath(FALLBACK_DB_PATH)), exist_ok=True)
         
-        # Create data storage directories
-        for table in ["teacherSheet", "studentSheet", "evaluationResults"]:
-            table_dir = os.path.join(self.data_dir, table)
-            os.makedirs(table_dir, exist_ok=True)
+        self._create_tables_if_not_exist()
         
-        print("Using file-based storage as fallback")
+        print(f"Using embedded SQLite database as fallback: {FALLBACK_DB_PATH}")
+    
+    def _sqlite_connection(self) -> sqlite3.Connection:
+        """One SQLite connection per thread; sqlite connections must not be shared"""
+        connection = getattr(self._sqlite_local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(FALLBACK_DB_PATH, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=30000")
+            self._sqlite_local.connection = connection
+        return connection
+    
+    @contextmanager
+    def _connection(self):
+        """
+        Borrow a connection from the pool for one operation.
+        
+        Waits up to DB_POOL_TIMEOUT for a free connection and pings it before
+        use, reconnecting if the server dropped it while it sat in the pool.
+        The connection goes back to the pool when the block exits. In
+        fallback mode this is the calling thread's SQLite connection.
+        """
+        if self.dialect == "sqlite":
+            yield self._sqlite_connection()
+            return
+        
+        if not self._pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise PoolError(msg=f"No database connection free after {DB_POOL_TIMEOUT}s")
+        
+        connection = None
+        try:
+            connection = self.pool.get_connection()
+            connection.ping(reconnect=True, attempts=2, delay=1)
+            yield connection
+        finally:
+            if connection is not None:
+                connection.close()  # returns it to the pool
+            self._pool_slots.release()
+    
+    @contextmanager
+    def _cursor(self, dictionary=False, write=True):
+        """
+        Cursor on a pooled connection that commits when the block succeeds
+        and rolls back if it raises.
+        
+        On SQLite a write transaction takes the write lock up front (BEGIN
+        IMMEDIATE), waiting out busy_timeout if another process holds it; a
+        deferred transaction that reads and then writes would instead fail
+        at once with SQLITE_BUSY. Pass write=False for read-only blocks.
+        """
+        with self._connection() as connection:
+            if self.dialect == "sqlite":
+                connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+                cursor = _SQLiteCursor(connection.cursor(), dictionary)
+            else:
+                cursor = connection.cursor(dictionary=dictionary)
+            try:
+                yield cursor
+                connection.commit()
+            except Exception:
+                try:
+                    connection.rollback()
+                except DB_ERRORS:
+                    pass
+                raise
+            finally:
+                cursor.close()
+    
+    def _upsert_sql(self, table: str, columns: List[str], key_columns: List[str],
+                    update_columns: List[str], extra_updates: str = "") -> str:
+        """
+        INSERT that updates update_columns when a row with the same unique
+        key_columns already exists, in the current dialect
+        """
+        placeholders = ", ".join("%s" for _ in columns)
+        insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        if self.dialect == "sqlite":
+            updates = [f"{column} = excluded.{column}" for column in update_columns]
+            conflict = f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET"
+        else:
+            updates = [f"{column} = VALUES({column})" for column in update_columns]
+            conflict = "ON DUPLICATE KEY UPDATE"
+        if extra_updates:
+            updates.append(extra_updates)
+        return f"{insert} {conflict} {', '.join(updates)}"
+    
+    def _insert_ignore_sql(self) -> str:
+        """INSERT that skips rows violating a unique key, in the current dialect"""
+        return "INSERT OR IGNORE" if self.dialect == "sqlite" else "INSERT IGNORE"
     
     def _create_tables_if_not_exist(self):
         """Create necessary tables if they don't exist"""
-        if not hasattr(self, 'connection') or self.connection is None:
+        if self.pool is None and self.dialect != "sqlite":
             return
         
-        cursor = self.connection.cursor()
+        with self._cursor() as cursor:
+            self._create_tables(cursor)
+    
+    def _create_tables(self, cursor):
+        """Run the schema statements on a cursor"""
+        # The same schema serves both engines; only these column types differ
+        if self.dialect == "sqlite":
+            id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+            json_type = "TEXT"
+        else:
+            id_column = "id INT AUTO_INCREMENT PRIMARY KEY"
+            json_type = "JSON"
         
         # Create teacher sheets table
-        cursor.execute("""
+        cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS teacherSheet (
-            id INT AUTO_INCREMENT PRIMARY KEY,
+            {id_column},
             teacher_id VARCHAR(255) UNIQUE NOT NULL,
             pdf_path VARCHAR(255) NOT NULL,
-            digital_sheet JSON,
+            digital_sheet {json_type},
+            answer_key_artifacts {json_type},
+            artifacts_version VARCHAR(64),
+            sheet_checksum VARCHAR(64),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """)
         
+        # Tables created before answer-key artifacts existed need the new columns
+        self._ensure_column(cursor, "teacherSheet", "answer_key_artifacts", json_type)
+        self._ensure_column(cursor, "teacherSheet", "artifacts_version", "VARCHAR(64)")
+        
         # Create student sheets table
-        cursor.execute("""
+        cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS studentSheet (
-            id INT AUTO_INCREMENT PRIMARY KEY,
+            {id_column},
             student_id VARCHAR(255) UNIQUE NOT NULL,
             pdf_path VARCHAR(255) NOT NULL,
-            digital_sheet JSON,
+            digital_sheet {json_type},
+            sheet_checksum VARCHAR(64),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """)
         
+        # Checksums of the digital sheets, compared by the in-process sheet cache
+        self._ensure_column(cursor, "teacherSheet", "sheet_checksum", "VARCHAR(64)")
+        self._ensure_column(cursor, "studentSheet", "sheet_checksum", "VARCHAR(64)")
+        
         # Create evaluation results table
-        cursor.execute("""
+        cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS evaluationResults (
-            id INT AUTO_INCREMENT PRIMARY KEY,
+            {id_column},
             student_id VARCHAR(255) NOT NULL,
             teacher_id VARCHAR(255) NOT NULL,
             total_marks DECIMAL(5,2) NOT NULL,
-            result_json JSON NOT NULL,
+            result_json {json_type} NOT NULL,
             evaluated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE KEY unique_evaluation (student_id, teacher_id)
+            revision INT NOT NULL DEFAULT 0,
+            CONSTRAINT unique_evaluation UNIQUE (student_id, teacher_id)
         )
         """)
         
-        self.connection.commit()
-        cursor.close()
+        # Bumped on every write; guards regrades against concurrent re-evaluation
+        self._ensure_column(cursor, "evaluationResults", "revision", "INT NOT NULL DEFAULT 0")
+        
+        # Indexes backing the keyset-paginated, filtered results listing
+        self._ensure_index(cursor, "evaluationResults", "idx_results_evaluated", "(evaluated_at, id)")
+        self._ensure_index(cursor, "evaluationResults", "idx_results_teacher_evaluated",
+                           "(teacher_id, evaluated_at, id)")
+        self._ensure_index(cursor, "evaluationResults", "idx_results_total_marks", "(total_marks)")
+        
+        # Per-question scores and ratings, written alongside each result so
+        # analytics can aggregate in SQL instead of parsing result_json
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS evaluationQuestionResults (
+            {id_column},
+            student_id VARCHAR(255) NOT NULL,
+            teacher_id VARCHAR(255) NOT NULL,
+            question_no INT NOT NULL,
+            max_marks DECIMAL(6,2),
+            marks_obtained DECIMAL(6,2),
+            keyword_rating DECIMAL(5,2),
+            content_rating DECIMAL(5,2),
+            grammar_rating DECIMAL(5,2),
+            length_rating DECIMAL(5,2),
+            evaluated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            CONSTRAINT unique_question_result UNIQUE (student_id, teacher_id, question_no)
+        )
+        """)
+        self._ensure_index(cursor, "evaluationQuestionResults", "idx_question_results_teacher",
+                           "(teacher_id, question_no)")
+        
+        # One-time data migrations that have been applied
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        
+        if self.dialect == "sqlite":
+            self._import_file_storage(cursor)
+        self._backfill_sheet_checksums(cursor)
+        self._backfill_question_results(cursor)
     
-    def _check_connection(self):
-        """Check and reconnect to database if connection is lost"""
-        if hasattr(self, 'fallback_mode') and self.fallback_mode:
-            return False
-            
-        try:
-            if not hasattr(self, 'connection') or self.connection is None:
-                self._connect_to_database()
-                return True
-                
-            if not self.connection.is_connected():
-                self.connection.reconnect()
-                return True
-                
-            return True
-        except Error as e:
-            print(f"Error reconnecting to MySQL: {e}")
-            self._setup_fallback_storage()
-            return False
+    def _migration_applied(self, cursor, migration: str) -> bool:
+        cursor.execute("SELECT COUNT(*) FROM schema_migrations WHERE name = %s", (migration,))
+        return cursor.fetchone()[0] > 0
     
-    # File-based storage methods for fallback mode
-    def _store_file_data(self, table, id_key, id_value, data):
-        """Store data in file system when in fallback mode"""
-        if not hasattr(self, 'fallback_mode') or not self.fallback_mode:
-            return False
-            
-        table_dir = os.path.join(self.data_dir, table)
-        file_path = os.path.join(table_dir, f"{id_value}.json")
+    def _record_migration(self, cursor, migration: str):
+        """Mark a migration applied; another process starting at the same time may already have"""
+        cursor.execute(f"{self._insert_ignore_sql()} INTO schema_migrations (name) VALUES (%s)", (migration,))
+    
+    def _import_file_storage(self, cursor):
+        """
+        Import the records of the old one-JSON-file-per-record fallback from
+        data_storage/ into the embedded database, once. The files are left in place.
+        """
+        migration = "import_json_file_storage"
+        if self._migration_applied(cursor, migration):
+            return
+        
+        def read_records(table):
+            table_dir = os.path.join(self.data_dir, table)
+            if not os.path.isdir(table_dir):
+                return []
+            records = []
+            for filename in sorted(os.listdir(table_dir)):
+                if filename.endswith('.json'):
+                    with open(os.path.join(table_dir, filename), 'r') as f:
+                        records.append(json.load(f))
+            return records
+        
+        def timestamp(value):
+            return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S") if value else None
+        
+        def as_json(value):
+            return json.dumps(value) if isinstance(value, (dict, list)) else value
+        
+        teachers = [
+            (r['teacher_id'], r['pdf_path'], as_json(r.get('digital_sheet')),
+             as_json(r.get('answer_key_artifacts')), r.get('artifacts_version'), timestamp(r.get('created_at')))
+            for r in read_records('teacherSheet')
+        ]
+        students = [
+            (r['student_id'], r['pdf_path'], as_json(r.get('digital_sheet')), timestamp(r.get('created_at')))
+            for r in read_records('studentSheet')
+        ]
+        results = [
+            (r['student_id'], r['teacher_id'], r.get('total_marks', 0), as_json(r.get('result_json')),
+             timestamp(r.get('evaluated_at')))
+            for r in read_records('evaluationResults')
+        ]
         
-        with open(file_path, 'w') as f:
-            json.dump(data, f)
+        insert = self._insert_ignore_sql()
+        if teachers:
+            cursor.executemany(f"""
+            {insert} INTO teacherSheet
+                (teacher_id, pdf_path, digital_sheet, answer_key_artifacts, artifacts_version, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """, teachers)
+        if students:
+            cursor.executemany(f"""
+            {insert} INTO studentSheet (student_id, pdf_path, digital_sheet, created_at)
+            VALUES (%s, %s, %s, %s)
+            """, students)
+        if results:
+            cursor.executemany(f"""
+            {insert} INTO evaluationResults (student_id, teacher_id, total_marks, result_json, evaluated_at)
+            VALUES (%s, %s, %s, %s, %s)
+            """, results)
         
-        return True
+        self._record_migration(cursor, migration)
+        if teachers or students or results:
+            print(f"Imported {len(teachers)} teacher sheets, {len(students)} student sheets and "
+                  f"{len(results)} evaluation results from {self.data_dir}")
     
-    def _get_file_data(self, table, id_key, id_value):
-        """Get data from file system when in fallback mode"""
-        if not hasattr(self, 'fallback_mode') or not self.fallback_mode:
-            return None
-            
-        table_dir = os.path.join(self.data_dir, table)
-        file_path = os.path.join(table_dir, f"{id_value}.json")
+    def _backfill_sheet_checksums(self, cursor):
+        """Checksum digital sheets stored before the sheet_checksum column existed"""
+        migration = "backfill_sheet_checksums"
+        if self._migration_applied(cursor, migration):
+            return
         
-        if not os.path.exists(file_path):
-            return None
-            
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        for table, _ in SHEET_TABLES.values():
+            cursor.execute(f"SELECT id, digital_sheet FROM {table} WHERE digital_sheet IS NOT NULL")
+            rows = [(sheet_checksum(digital_sheet), row_id) for row_id, digital_sheet in cursor.fetchall()]
+            if rows:
+                cursor.executemany(f"UPDATE {table} SET sheet_checksum = %s WHERE id = %s", rows)
+        self._record_migration(cursor, migration)
     
-    def _get_all_file_data(self, table):
-        """Get all data from file system for a table when in fallback mode"""
-        if not hasattr(self, 'fallback_mode') or not self.fallback_mode:
-            return []
-            
-        table_dir = os.path.join(self.data_dir, table)
-        result = []
+    def _backfill_question_results(self, cursor):
+        """Fill evaluationQuestionResults from result blobs stored before the table existed"""
+        migration = "backfill_evaluation_question_results"
+        if self._migration_applied(cursor, migration):
+            return
         
-        for filename in os.listdir(table_dir):
-            if filename.endswith('.json'):
-                file_path = os.path.join(table_dir, filename)
-                with open(file_path, 'r') as f:
-                    result.append(json.load(f))
+        cursor.execute("SELECT student_id, teacher_id, result_json, evaluated_at FROM evaluationResults")
+        rows = []
+        for student_id, teacher_id, result_json, evaluated_at in cursor.fetchall():
+            result = json.loads(result_json) if isinstance(result_json, (str, bytes)) else result_json
+            rows.extend(
+                row + (evaluated_at,)
+                for row in self._question_rows(student_id, teacher_id, result)
+            )
         
-        return result
+        if rows:
+            cursor.executemany(f"""
+            {self._insert_ignore_sql()} INTO evaluationQuestionResults
+                (student_id, teacher_id, question_no, max_marks, marks_obtained,
+                 keyword_rating, content_rating, grammar_rating, length_rating, evaluated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, rows)
+        self._record_migration(cursor, migration)
+        print(f"Backfilled {len(rows)} per-question results from existing evaluations")
     
-    # Database operations with fallback
+    @staticmethod
+    def _question_rows(student_id: str, teacher_id: str, result: Dict) -> List[tuple]:
+        """
+        Flatten an evaluation result into evaluationQuestionResults rows, one
+        per question number. An answer key that repeats a question number
+        yields several results for it; the first one is kept, as it is when
+        student answers are matched to questions.
+        """
+        rows = {}
+        for question in (result or {}).get('question_results', []):
+            question_no = int(question['question_no'])
+            if question_no in rows:
+                continue
+            ratings = question.get('ratings') or {}
+            rows[question_no] = (
+                student_id,
+                teacher_id,
+                question_no,
+                question.get('max_marks'),
+                question.get('marks_obtained'),
+                ratings.get('keyword'),
+                ratings.get('content'),
+                ratings.get('grammar'),
+                ratings.get('length')
+            )
+        return list(rows.values())
+    
+    def _ensure_column(self, cursor, table, column, definition):
+        """Add a column to an existing table if it is missing"""
+        if self.dialect == "sqlite":
+            cursor.execute(f"PRAGMA table_info({table})")
+            exists = any(row[1] == column for row in cursor.fetchall())
+        else:
+            cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+            """, (table, column))
+            exists = cursor.fetchone()[0] > 0
+        if exists:
+            return
+        try:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        except sqlite3.OperationalError as e:
+            if "duplicate column" not in str(e):
+                raise
+        except Error as e:
+            if e.errno != ER_DUP_FIELDNAME:
+                raise
+    
+    def _ensure_index(self, cursor, table, index, columns):
+        """Create an index on an existing table if it is missing"""
+        if self.dialect == "sqlite":
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} {columns}")
+            return
+        
+        cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """, (table, index))
+        if cursor.fetchone()[0] > 0:
+            return
+        try:
+            cursor.execute(f"CREATE INDEX {index} ON {table} {columns}")
+        except Error as e:
+            if e.errno != ER_DUP_KEYNAME:
+                raise
+    
+    def _check_connection(self):
+        """Check that a database is available, creating the MySQL pool if needed"""
+        if hasattr(self, 'fallback_mode') and self.fallback_mode:
+            return True
+        
+        # Connections are health-checked when borrowed, only the pool itself is checked here
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None and not getattr(self, 'fallback_mode', False):
+                    self._connect_to_database()
+        
+        return self.pool is not None or getattr(self, 'fallback_mode', False)
+    
+    # Database operations
     def store_teacher_pdf(self, teacher_id: str, pdf_path: str) -> bool:
-        """Store teacher PDF path in database or file system"""
-        # Try database first
-        if self._check_connection():
-            cursor = self.connection.cursor()
-            
-            try:
-                query = """
-                INSERT INTO teacherSheet (teacher_id, pdf_path)
-                VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE pdf_path = %s
-                """
-                cursor.execute(query, (teacher_id, pdf_path, pdf_path))
-                self.connection.commit()
-                cursor.close()
-                return True
-            except Error as e:
-                print(f"Error storing teacher PDF in database: {e}")
-                cursor.close()
+        """Store teacher PDF path in database"""
+        if not self._check_connection():
+            return False
         
-        # Fallback to file storage
-        return self._store_file_data('teacherSheet', 'teacher_id', teacher_id, {
-            'teacher_id': teacher_id,
-            'pdf_path': pdf_path,
-            'created_at': pd.Timestamp.now().isoformat()
-        })
+        try:
+            with self._cursor() as cursor:
+                query = self._upsert_sql("teacherSheet", ["teacher_id", "pdf_path"], ["teacher_id"], ["pdf_path"])
+                cursor.execute(query, (teacher_id, pdf_path))
+                return True
+        except DB_ERRORS as e:
+            print(f"Error storing teacher PDF in database: {e}")
+            return False
     
     def update_teacher_digital_sheet(self, teacher_id: str, digital_sheet: str) -> bool:
-        """Update teacher's digital sheet in database or file system"""
-        # Try database first
-        if self._check_connection():
-            cursor = self.connection.cursor()
-            
-            try:
+        """Update teacher's digital sheet in database"""
+        if not self._check_connection():
+            return False
+        
+        try:
+            with self._cursor() as cursor:
                 query = """
                 UPDATE teacherSheet
-                SET digital_sheet = %s
+                SET digital_sheet = %s, sheet_checksum = %s
                 WHERE teacher_id = %s
                 """
-                cursor.execute(query, (digital_sheet, teacher_id))
-                self.connection.commit()
-                cursor.close()
+                cursor.execute(query, (digital_sheet, sheet_checksum(digital_sheet), teacher_id))
                 return cursor.rowcount > 0
-            except Error as e:
-                print(f"Error updating teacher digital sheet in database: {e}")
-                cursor.close()
+        except DB_ERRORS as e:
+            print(f"Error updating teacher digital sheet in database: {e}")
+            return False
+    
+    def update_teacher_artifacts(self, teacher_id: str, artifacts: Dict) -> bool:
+        """Store precomputed answer-key artifacts for a teacher sheet"""
+        artifacts_json = json.dumps(artifacts)
+        version = artifacts.get('version')
+        
+        if not self._check_connection():
+            return False
         
-        # Fallback to file storage
-        data = self._get_file_data('teacherSheet', 'teacher_id', teacher_id)
-        if data:
-            data['digital_sheet'] = digital_sheet
-            return self._store_file_data('teacherSheet', 'teacher_id', teacher_id, data)
-        return False
+        try:
+            with self._cursor() as cursor:
+                query = """
+                UPDATE teacherSheet
+                SET answer_key_artifacts = %s, artifacts_version = %s
+                WHERE teacher_id = %s
+                """
+                cursor.execute(query, (artifacts_json, version, teacher_id))
+                return cursor.rowcount > 0
+        except DB_ERRORS as e:
+            print(f"Error updating teacher answer-key artifacts in database: {e}")
+            return False
     
-    def store_student_pdf(self, student_id: str, pdf_path: str) -> bool:
-        """Store student PDF path in database or file system"""
-        # Try database first
-        if self._check_connection():
-            cursor = self.connection.cursor()
-            
-            try:
+    def get_teacher_artifacts(self, teacher_id: str) -> Optional[Dict]:
+        """Get precomputed answer-key artifacts for a teacher sheet"""
+        if not self._check_connection():
+            return None
+        
+        try:
+            with self._cursor(dictionary=True, write=False) as cursor:
                 query = """
-                INSERT INTO studentSheet (student_id, pdf_path)
-                VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE pdf_path = %s
+                SELECT answer_key_artifacts
+                FROM teacherSheet
+                WHERE teacher_id = %s
                 """
-                cursor.execute(query, (student_id, pdf_path, pdf_path))
-                self.connection.commit()
-                cursor.close()
-                return True
-            except Error as e:
-                print(f"Error storing student PDF in database: {e}")
-                cursor.close()
+                cursor.execute(query, (teacher_id,))
+                row = cursor.fetchone()
+            
+            if not row or not row['answer_key_artifacts']:
+                return None
+            artifacts = row['answer_key_artifacts']
+            return json.loads(artifacts) if isinstance(artifacts, str) else artifacts
+        except DB_ERRORS as e:
+            print(f"Error getting teacher answer-key artifacts from database: {e}")
+            return None
+    
+    def store_student_pdf(self, student_id: str, pdf_path: str) -> bool:
+        """Store student PDF path in database"""
+        return self.store_student_pdfs([(student_id, pdf_path)])
+    
+    def store_student_pdfs(self, sheets: List[tuple]) -> bool:
+        """Store many (student_id, pdf_path) pairs in one transaction"""
+        if not sheets:
+            return True
+        if not self._check_connection():
+            return False
         
-        # Fallback to file storage
-        return self._store_file_data('studentSheet', 'student_id', student_id, {
-            'student_id': student_id,
-            'pdf_path': pdf_path,
-            'created_at': pd.Timestamp.now().isoformat()
-        })
+        try:
+            with self._cursor() as cursor:
+                query = self._upsert_sql("studentSheet", ["student_id", "pdf_path"], ["student_id"], ["pdf_path"])
+                cursor.executemany(query, sheets)
+                return True
+        except DB_ERRORS as e:
+            print(f"Error storing student PDFs in database: {e}")
+            return False
     
     def update_student_digital_sheet(self, student_id: str, digital_sheet: str) -> bool:
-        """Update student's digital sheet in database or file system"""
-        # Try database first
-        if self._check_connection():
-            cursor = self.connection.cursor()
-            
-            try:
+        """Update student's digital sheet in database"""
+        if not self._check_connection():
+            return False
+        
+        try:
+            with self._cursor() as cursor:
                 query = """
                 UPDATE studentSheet
-                SET digital_sheet = %s
+                SET digital_sheet = %s, sheet_checksum = %s
                 WHERE student_id = %s
                 """
-                cursor.execute(query, (digital_sheet, student_id))
-                self.connection.commit()
-                cursor.close()
+                cursor.execute(query, (digital_sheet, sheet_checksum(digital_sheet), student_id))
                 return cursor.rowcount > 0
-            except Error as e:
-                print(f"Error updating student digital sheet in database: {e}")
-                cursor.close()
+        except DB_ERRORS as e:
+            print(f"Error updating student digital sheet in database: {e}")
+            return False
+    
+    def get_sheet_checksums(self, kind: str, sheet_ids: List[str]) -> Dict[str, str]:
+        """
+        Get the checksums of digitized sheets without loading the sheets.
+        
+        Args:
+            kind (str): "teacher" or "student"
+            sheet_ids (list): Teacher or student ids
         
-        # Fallback to file storage
-        data = self._get_file_data('studentSheet', 'student_id', student_id)
-        if data:
-            data['digital_sheet'] = digital_sheet
-            return self._store_file_data('studentSheet', 'student_id', student_id, data)
-        return False
+        Returns:
+            dict: sheet id -> checksum, for the ids that have a digital sheet
+        """
+        return {
+            sheet_id: checksum
+            for sheet_id, (checksum, _) in self._get_sheets(kind, sheet_ids, with_sheet=False).items()
+        }
+    
+    def get_digital_sheets(self, kind: str, sheet_ids: List[str]) -> Dict[str, tuple]:
+        """
+        Get digitized sheets with their checksums.
+        
+        Args:
+            kind (str): "teacher" or "student"
+            sheet_ids (list): Teacher or student ids
+        
+        Returns:
+            dict: sheet id -> (checksum, digital_sheet JSON), for the ids that have a digital sheet
+        """
+        return self._get_sheets(kind, sheet_ids, with_sheet=True)
+    
+    def _get_sheets(self, kind: str, sheet_ids: List[str], with_sheet: bool) -> Dict[str, tuple]:
+        table, id_column = SHEET_TABLES[kind]
+        if not sheet_ids or not self._check_connection():
+            return {}
+        
+        try:
+            with self._cursor(write=False) as cursor:
+                query = f"""
+                SELECT {id_column}, sheet_checksum, {'digital_sheet' if with_sheet else 'NULL'}
+                FROM {table}
+                WHERE digital_sheet IS NOT NULL AND {id_column} IN ({', '.join('%s' for _ in sheet_ids)})
+                """
+                cursor.execute(query, tuple(sheet_ids))
+                rows = cursor.fetchall()
+            
+            sheets = {}
+            for sheet_id, checksum, digital_sheet in rows:
+                if isinstance(digital_sheet, bytes):
+                    digital_sheet = digital_sheet.decode("utf-8")
+                elif with_sheet and not isinstance(digital_sheet, str):
+                    digital_sheet = json.dumps(digital_sheet)
+                sheets[sheet_id] = (checksum, digital_sheet)
+            return sheets
+        except DB_ERRORS as e:
+            print(f"Error getting {kind} sheets from database: {e}")
+            return {}
+    
+    def get_processed_student_ids(self) -> List[str]:
+        """Get the ids of all students whose sheet has been digitized"""
+        if not self._check_connection():
+            return []
+        
+        try:
+            with self._cursor(write=False) as cursor:
+                query = """
+                SELECT student_id
+                FROM studentSheet
+                WHERE digital_sheet IS NOT NULL
+                ORDER BY student_id
+                """
+                cursor.execute(query)
+                return [row[0] for row in cursor.fetchall()]
+        except DB_ERRORS as e:
+            print(f"Error getting processed students from database: {e}")
+            return []
     
     def store_evaluation_result(self, student_id: str, teacher_id: str, result: Dict) -> bool:
-        """Store evaluation result in database or file system"""
+        """Store evaluation result in database"""
         # Convert the result dict to JSON string if needed
         result_json = json.dumps(result) if isinstance(result, dict) else result
         total_marks = result.get('total_marks', 0) if isinstance(result, dict) else 0
         
-        # Try database first
-        if self._check_connection():
-            cursor = self.connection.cursor()
-            
-            try:
-                query = """
-                INSERT INTO evaluationResults (student_id, teacher_id, total_marks, result_json)
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE 
-                    total_marks = %s,
-                    result_json = %s,
-                    evaluated_at = CURRENT_TIMESTAMP
-                """
-                cursor.execute(query, (
-                    student_id, teacher_id, total_marks, result_json,
-                    total_marks, result_json
-                ))
-                self.connection.commit()
-                cursor.close()
-                return True
-            except Error as e:
-                print(f"Error storing evaluation result in database: {e}")
-                cursor.close()
+        if not self._check_connection():
+            return False
         
-        # Fallback to file storage
-        return self._store_file_data('evaluationResults', 'student_id', f"{student_id}_{teacher_id}", {
-            'student_id': student_id,
-            'teacher_id': teacher_id,
-            'total_marks': total_marks,
-            'result_json': result,
-            'evaluated_at': pd.Timestamp.now().isoformat()
-        })
+        try:
+            with self._cursor() as cursor:
+                query = self._upsert_sql(
+                    "evaluationResults",
+                    ["student_id", "teacher_id", "total_marks", "result_json"],
+                    ["student_id", "teacher_id"],
+                    ["total_marks", "result_json"],
+                    "evaluated_at = CURRENT_TIMESTAMP, revision = revision + 1"
+                )
+                cursor.execute(query, (student_id, teacher_id, total_marks, result_json))
+                
+                # Replace the per-question rows in the same transaction
+                cursor.execute("""
+                DELETE FROM evaluationQuestionResults
+                WHERE student_id = %s AND teacher_id = %s
+                """, (student_id, teacher_id))
+                question_rows = self._question_rows(
+                    student_id, teacher_id, result if isinstance(result, dict) else json.loads(result)
+                )
+                if question_rows:
+                    cursor.executemany("""
+                    INSERT INTO evaluationQuestionResults
+                        (student_id, teacher_id, question_no, max_marks, marks_obtained,
+                         keyword_rating, content_rating, grammar_rating, length_rating)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """, question_rows)
+                return True
+        except DB_ERRORS as e:
+            print(f"Error storing evaluation result in database: {e}")
+            return False
     
     def get_all_evaluation_results(self) -> List[Dict]:
-        """Get all evaluation results from database or file system"""
-        # Try database first
-        if self._check_connection():
-            cursor = self.connection.cursor(dictionary=True)
-            
-            try:
+        """Get all evaluation results from database"""
+        if not self._check_connection():
+            return []
+        
+        try:
+            with self._cursor(dictionary=True, write=False) as cursor:
                 query = """
-                SELECT 
+                SELECT
                     student_id,
                     teacher_id,
                     total_marks,
@@ -342,34 +815,277 @@ class DBManager:
                 """
                 cursor.execute(query)
                 results = cursor.fetchall()
-                cursor.close()
-                
-                # Parse JSON strings to dictionaries
-                for result in results:
-                    if 'result_json' in result and result['result_json']:
-                        if isinstance(result['result_json'], str):
-                            result['result_json'] = json.loads(result['result_json'])
+            
+            # Parse JSON strings to dictionaries
+            for result in results:
+                if 'result_json' in result and result['result_json']:
+                    if isinstance(result['result_json'], str):
+                        result['result_json'] = json.loads(result['result_json'])
+            
+            return results
+        except DB_ERRORS as e:
+            print(f"Error getting evaluation results from database: {e}")
+            return []
+    
+    @staticmethod
+    def encode_results_cursor(evaluated_at, tiebreak) -> str:
+        """Opaque keyset cursor pointing just after the given result"""
+        raw = json.dumps([str(evaluated_at), tiebreak])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+    
+    @staticmethod
+    def decode_results_cursor(cursor: str) -> tuple:
+        """Inverse of encode_results_cursor; raises ValueError on a malformed cursor"""
+        try:
+            evaluated_at, tiebreak = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            return evaluated_at, tiebreak
+        except Exception:
+            raise ValueError("Invalid cursor")
+    
+    def get_evaluation_results_page(self,
+                                    limit: int = 100,
+                                    cursor: Optional[str] = None,
+                                    teacher_id: Optional[str] = None,
+                                    date_from: Optional[datetime] = None,
+                                    date_to: Optional[datetime] = None,
+                                    min_marks: Optional[float] = None,
+                                    max_marks: Optional[float] = None,
+                                    fields: Optional[List[str]] = None) -> Dict:
+        """
+        Get one page of evaluation results, newest first.
+        
+        Pages are addressed with a keyset cursor on (evaluated_at, id), so
+        every page costs the same regardless of how deep it is.
+        
+        Args:
+            limit (int): Maximum number of results in the page
+            cursor (str, optional): next_cursor from the previous page
+            teacher_id (str, optional): Only results for this teacher
+            date_from, date_to (datetime, optional): evaluated_at range, inclusive
+            min_marks, max_marks (float, optional): total_marks range, inclusive
+            fields (list, optional): Columns to return, from RESULT_FIELDS;
+                omit "result_json" to skip the full result documents
+        
+        Returns:
+            dict: {"results": [...], "next_cursor": str or None}
+        """
+        fields = [field for field in (fields or self.RESULT_FIELDS) if field in self.RESULT_FIELDS]
+        if not fields:
+            raise ValueError(f"fields must include at least one of {list(self.RESULT_FIELDS)}")
+        after = self.decode_results_cursor(cursor) if cursor else None
+        
+        if not self._check_connection():
+            return {"results": [], "next_cursor": None}
+        
+        conditions, params = self._result_filters(teacher_id=teacher_id, date_from=date_from, date_to=date_to,
+                                                  min_marks=min_marks, max_marks=max_marks)
+        if after is not None:
+            conditions.append("(evaluated_at < %s OR (evaluated_at = %s AND id < %s))")
+            params.extend([after[0], after[0], after[1]])
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            with self._cursor(dictionary=True, write=False) as db_cursor:
+                query = f"""
+                SELECT id, evaluated_at AS sort_key, {', '.join(fields)}
+                FROM evaluationResults
+                {where}
+                ORDER BY evaluated_at DESC, id DESC
+                LIMIT %s
+                """
+                # One extra row tells whether there is a next page
+                db_cursor.execute(query, (*params, limit + 1))
+                rows = db_cursor.fetchall()
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = self.encode_results_cursor(rows[-1]['sort_key'], rows[-1]['id'])
+            
+            for row in rows:
+                row.pop('id', None)
+                row.pop('sort_key', None)
+                if isinstance(row.get('result_json'), str):
+                    row['result_json'] = json.loads(row['result_json'])
+            
+            return {"results": rows, "next_cursor": next_cursor}
+        except DB_ERRORS as e:
+            print(f"Error getting evaluation results page from database: {e}")
+            return {"results": [], "next_cursor": None}
+    
+    @staticmethod
+    def _result_filters(student_id: Optional[str] = None,
+                        teacher_id: Optional[str] = None,
+                        date_from: Optional[datetime] = None,
+                        date_to: Optional[datetime] = None,
+                        min_marks: Optional[float] = None,
+                        max_marks: Optional[float] = None) -> tuple:
+        """WHERE conditions and parameters selecting evaluationResults rows"""
+        conditions, params = [], []
+        if student_id is not None:
+            conditions.append("student_id = %s")
+            params.append(student_id)
+        if teacher_id is not None:
+            conditions.append("teacher_id = %s")
+            params.append(teacher_id)
+        if date_from is not None:
+            conditions.append("evaluated_at >= %s")
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append("evaluated_at <= %s")
+            params.append(date_to)
+        if min_marks is not None:
+            conditions.append("total_marks >= %s")
+            params.append(min_marks)
+        if max_marks is not None:
+            conditions.append("total_marks <= %s")
+            params.append(max_marks)
+        return conditions, params
+    
+    def get_evaluation_results(self,
+                               student_id: Optional[str] = None,
+                               teacher_id: Optional[str] = None,
+                               date_from: Optional[datetime] = None,
+                               date_to: Optional[datetime] = None,
+                               min_marks: Optional[float] = None,
+                               max_marks: Optional[float] = None) -> List[Dict]:
+        """
+        Get every evaluation result matching the filters, with parsed result_json.
+        
+        Returns:
+            list: Dicts with student_id, teacher_id, total_marks, result_json,
+                evaluated_at and revision
+        """
+        if not self._check_connection():
+            return []
+        
+        conditions, params = self._result_filters(student_id, teacher_id, date_from, date_to, min_marks, max_marks)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            with self._cursor(dictionary=True, write=False) as cursor:
+                query = f"""
+                SELECT student_id, teacher_id, total_marks, result_json, evaluated_at, revision
+                FROM evaluationResults
+                {where}
+                ORDER BY teacher_id, student_id
+                """
+                cursor.execute(query, tuple(params))
+                results = cursor.fetchall()
+            
+            for result in results:
+                if isinstance(result['result_json'], str):
+                    result['result_json'] = json.loads(result['result_json'])
+            return results
+        except DB_ERRORS as e:
+            print(f"Error getting evaluation results from database: {e}")
+            return []
+    
+    def update_evaluation_marks(self, updates: List[Dict]) -> int:
+        """
+        Write regraded results back in one transaction.
+        
+        Only marks change: each result keeps its evaluated_at, and a result
+        that was written since it was read (its revision no longer matches)
+        is left alone rather than overwritten with stale ratings. Timestamps
+        have one-second resolution, so they cannot tell two writes apart.
+        
+        Args:
+            updates (list): Dicts with student_id, teacher_id, revision as
+                read, and the regraded result
+        
+        Returns:
+            int: Number of results updated, or -1 if the transaction failed
+        """
+        if not updates:
+            return 0
+        if not self._check_connection():
+            return -1
+        
+        try:
+            with self._cursor() as cursor:
+                updated = 0
+                question_rows = []
+                for update in updates:
+                    result = update['result']
+                    # Setting evaluated_at to itself stops MySQL auto-updating it
+                    cursor.execute("""
+                    UPDATE evaluationResults
+                    SET total_marks = %s, result_json = %s, evaluated_at = evaluated_at,
+                        revision = revision + 1
+                    WHERE student_id = %s AND teacher_id = %s AND revision = %s
+                    """, (result['total_marks'], json.dumps(result), update['student_id'],
+                          update['teacher_id'], update['revision']))
+                    if cursor.rowcount > 0:
+                        updated += 1
+                        question_rows.extend(
+                            (question['max_marks'], question['marks_obtained'],
+                             update['student_id'], update['teacher_id'], int(question['question_no']))
+                            for question in result.get('question_results', [])
+                        )
                 
-                return results
-            except Error as e:
-                print(f"Error getting evaluation results from database: {e}")
-                cursor.close()
+                if question_rows:
+                    cursor.executemany("""
+                    UPDATE evaluationQuestionResults
+                    SET max_marks = %s, marks_obtained = %s
+                    WHERE student_id = %s AND teacher_id = %s AND question_no = %s
+                    """, question_rows)
+                return updated
+        except DB_ERRORS as e:
+            print(f"Error updating regraded evaluation results in database: {e}")
+            return -1
+    
+    def get_question_statistics(self, teacher_id: str) -> List[Dict]:
+        """
+        Aggregate per-question results for one teacher's exam.
         
-        # Fallback to file storage
-        results = self._get_all_file_data('evaluationResults')
-        # Sort by evaluated_at (descending)
-        results.sort(key=lambda x: x.get('evaluated_at', ''), reverse=True)
-        return results
+        Returns:
+            list: One dict per question with the number of students graded and
+                  the average, minimum and maximum marks and average ratings
+        """
+        if not self._check_connection():
+            return []
+        
+        try:
+            with self._cursor(dictionary=True, write=False) as cursor:
+                query = """
+                SELECT
+                    question_no,
+                    COUNT(*) AS students,
+                    MAX(max_marks) AS max_marks,
+                    AVG(marks_obtained) AS avg_marks,
+                    MIN(marks_obtained) AS min_marks,
+                    MAX(marks_obtained) AS top_marks,
+                    AVG(keyword_rating) AS avg_keyword,
+                    AVG(content_rating) AS avg_content,
+                    AVG(grammar_rating) AS avg_grammar,
+                    AVG(length_rating) AS avg_length
+                FROM evaluationQuestionResults
+                WHERE teacher_id = %s
+                GROUP BY question_no
+                ORDER BY question_no
+                """
+                cursor.execute(query, (teacher_id,))
+                rows = cursor.fetchall()
+            
+            # DECIMAL aggregates come back as Decimal
+            return [
+                {key: round(float(value), 2) if value is not None and key not in ('question_no', 'students')
+                 else value for key, value in row.items()}
+                for row in rows
+            ]
+        except DB_ERRORS as e:
+            print(f"Error getting question statistics from database: {e}")
+            return []
     
     def get_evaluation_result(self, student_id: str) -> Optional[Dict]:
-        """Get evaluation result for a specific student from database or file system"""
-        # Try database first
-        if self._check_connection():
-            cursor = self.connection.cursor(dictionary=True)
-            
-            try:
+        """Get evaluation result for a specific student from database"""
+        if not self._check_connection():
+            return None
+        
+        try:
+            with self._cursor(dictionary=True, write=False) as cursor:
                 query = """
-                SELECT 
+                SELECT
                     student_id,
                     teacher_id,
                     total_marks,
@@ -381,39 +1097,26 @@ class DBManager:
                 """
                 cursor.execute(query, (student_id,))
                 results = cursor.fetchall()
-                cursor.close()
-                
-                if not results:
-                    return None
-                
-                # Parse JSON strings to dictionaries
-                for result in results:
-                    if 'result_json' in result and result['result_json']:
-                        if isinstance(result['result_json'], str):
-                            result['result_json'] = json.loads(result['result_json'])
-                
-                return results[0] if len(results) == 1 else results
-            except Error as e:
-                print(f"Error getting evaluation result from database: {e}")
-                cursor.close()
-        
-        # Fallback to file storage
-        all_results = self._get_all_file_data('evaluationResults')
-        student_results = [r for r in all_results if r.get('student_id') == student_id]
-        
-        if not student_results:
-            return None
             
-        # Sort by evaluated_at (descending)
-        student_results.sort(key=lambda x: x.get('evaluated_at', ''), reverse=True)
-        return student_results[0] if len(student_results) == 1 else student_results
+            if not results:
+                return None
+            
+            # Parse JSON strings to dictionaries
+            for result in results:
+                if 'result_json' in result and result['result_json']:
+                    if isinstance(result['result_json'], str):
+                        result['result_json'] = json.loads(result['result_json'])
+            
+            return results[0] if len(results) == 1 else results
+        except DB_ERRORS as e:
+            print(f"Error getting evaluation result from database: {e}")
+            return None
     
     def __del__(self):
-        """Close database connection when object is destroyed"""
-        if hasattr(self, 'connection') and self.connection is not None:
+        """Close pooled database connections when object is destroyed"""
+        if getattr(self, 'pool', None) is not None:
             try:
-                if self.connection.is_connected():
-                    self.connection.close()
-                    print("Database connection closed.")
+                self.pool._remove_connections()
+                print("Database connection pool closed.")
             except:
-                pass  # Ignore errors during cleanup
\ No newline at end of file
+                pass  # Ignore errors during cleanup
@@ -2,71 +2,345 @@ import sys
 sys.path.append('/mnt/data')  # Ensure local modules are importable
 
 import pandas as pd
+import numpy as np
 import json
+import hashlib
 from ollamaKeyFactor import (
+    GEMMA_MODEL,
     keyword_matching,
     content_relevance,
     grammatical_accuracy,
-    word_length_assessment
+    word_length_assessment,
+    assess_all_criteria
 )
-from calculateMarks import calculate_marks_obtained
+from calculateMarks import calculate_marks_batch
+from relevance_backend import get_relevance_backend
+from answer_key import question_artifacts
+from model_residency import residency
 import tempfile
 import os
 
-# Define evaluation function (from our pipeline)
-def evaluate_assessment(teacher_csv_path: str,
-                        student_csv_path: str,
-                        default_word_limit: int = 100,
-                        credit_list: list = [4, 3, 2, 1]) -> dict:
-    df_teacher = pd.read_csv(teacher_csv_path)
-    df_student = pd.read_csv(student_csv_path)
+# "combined" grades all criteria of a question in one model call,
+# "per_criterion" keeps the original one-call-per-criterion behaviour
+GRADING_MODES = ("combined", "per_criterion")
+DEFAULT_GRADING_MODE = os.getenv("GRADING_MODE", "combined")
 
-    # Normalize student question column
-    if 'answer_no' in df_student.columns:
-        df_student = df_student.rename(columns={'answer_no': 'question_no'})
+# Criteria in the order their credits appear in credit_list
+RATING_CRITERIA = ('keyword', 'content', 'grammar', 'length')
 
-    df_teacher['question_no'] = df_teacher['question_no'].astype(int)
-    df_student['question_no'] = df_student['question_no'].astype(int)
+# Credits per criterion when neither the caller nor a stored rubric gives them
+DEFAULT_CREDIT_LIST = [4, 3, 2, 1]
 
-    results = []
-    total_marks = 0.0
+# Bump when prompts or rating logic change, so stored ratings are not reused
+PROMPT_VERSION = "1"
+
+def rate_answer(student_answer: str,
+                model_answer: str,
+                word_limit: int,
+                grading_mode: str = DEFAULT_GRADING_MODE,
+                content_rating: float = None,
+                key_concepts: list = None) -> dict:
+    """
+    Rate one answer on every criterion using the requested grading mode.
+    A precomputed content_rating replaces the model's relevance judgement and
+    precomputed key_concepts spare the model from extracting them again.
+    """
+    known_ratings = {'content': content_rating} if content_rating is not None else {}
+
+    if grading_mode == "combined":
+        return assess_all_criteria(student_answer, model_answer, word_limit, known_ratings, key_concepts)
+
+    return {
+        'keyword': keyword_matching(student_answer, model_answer, key_concepts),
+        'content': (content_rating if content_rating is not None
+                    else content_relevance(student_answer, model_answer)),
+        'grammar': grammatical_accuracy(student_answer),
+        'length': word_length_assessment(student_answer, word_limit)
+    }
+
+def key_concepts(question: dict) -> list:
+    """Precomputed key concepts of a loaded question, or None"""
+    artifacts = question.get('artifacts')
+    return artifacts.get('key_concepts') if artifacts else None
+
+def precompute_content_ratings(questions: list, relevance_backend: str = None) -> list:
+    """
+    Score content relevance for all questions in one batch when a non-LLM
+    backend is configured. Returns None per question for the LLM backend, so
+    relevance is then judged by the grading model itself.
+    """
+    backend = get_relevance_backend(relevance_backend)
+    if backend.name == "llm" or not questions:
+        return [None] * len(questions)
+
+    # Reuse answer embeddings stored with the answer key when they come from the same model
+    teacher_embeddings = [
+        q['artifacts']['embedding']
+        if q.get('artifacts') and q['artifacts'].get('embedding_model') == backend.model_name
+        else None
+        for q in questions
+    ]
+
+    return backend.score([q['student_answer'] for q in questions],
+                         [q['teacher_answer'] for q in questions],
+                         teacher_embeddings)
 
+def sheet_frame(sheet) -> pd.DataFrame:
+    """A parsed sheet as a DataFrame; sheets may be passed in memory or as a CSV path"""
+    if isinstance(sheet, pd.DataFrame):
+        return sheet
+    return pd.read_csv(sheet)
+
+def load_answer_key(teacher_sheet,
+                    default_word_limit: int = 100,
+                    answer_key_artifacts: dict = None) -> list:
+    """
+    Load the teacher sheet (DataFrame or CSV path) as one entry per question,
+    attaching the precomputed answer-key artifacts that are still valid. Load
+    it once and reuse it for every student sheet graded against it.
+    """
+    df_teacher = sheet_frame(teacher_sheet)
+
+    answer_key = []
     for _, trow in df_teacher.iterrows():
         q_no = int(trow['question_no'])
-        question = trow['question']
-        model_answer = trow['answer']
-        max_marks = float(trow.get('total_marks', 10))
-        word_limit = int(trow.get('word_limit', default_word_limit))
+        answer_key.append({
+            'question_no': q_no,
+            'question': trow['question'],
+            'teacher_answer': trow['answer'],
+            'max_marks': float(trow.get('total_marks', 10)),
+            'word_limit': int(trow.get('word_limit', default_word_limit)),
+            'artifacts': question_artifacts(answer_key_artifacts, q_no, trow['answer'])
+        })
+
+    return answer_key
+
+def attach_student_answers(answer_key: list, student_sheet) -> list:
+    """
+    Join a student sheet (DataFrame or CSV path) onto a loaded answer key,
+    one entry per teacher question
+    """
+    df_student = sheet_frame(student_sheet)
+
+    # Normalize student question column; rename and astype return copies,
+    # so a cached sheet is never modified
+    if 'answer_no' in df_student.columns:
+        df_student = df_student.rename(columns={'answer_no': 'question_no'})
+
+    df_student = df_student.astype({'question_no': int})
+
+    # Index the answers once; the first answer wins if a question number repeats
+    answers = {}
+    for q_no, answer in zip(df_student['question_no'], df_student['answer']):
+        answers.setdefault(int(q_no), answer)
+
+    questions = []
+    for entry in answer_key:
+        questions.append(dict(entry, student_answer=answers.get(entry['question_no'], '')))
 
-        match = df_student[df_student['question_no'] == q_no]
-        student_answer = match.iloc[0]['answer'] if not match.empty else ''
+    return questions
 
-        ratings = {
-            'keyword': keyword_matching(student_answer, model_answer),
-            'content': content_relevance(student_answer, model_answer),
-            'grammar': grammatical_accuracy(student_answer),
-            'length': word_length_assessment(student_answer, word_limit)
-        }
+def load_questions(teacher_sheet,
+                   student_sheet,
+                   default_word_limit: int = 100,
+                   answer_key_artifacts: dict = None) -> list:
+    """
+    Join the teacher and student sheets into one entry per teacher question,
+    attaching the precomputed answer-key artifacts that are still valid
+    """
+    answer_key = load_answer_key(teacher_sheet, default_word_limit, answer_key_artifacts)
+    return attach_student_answers(answer_key, student_sheet)
 
-        cgpa_scores = [ratings['keyword']/10,
-                       ratings['content']/10,
-                       ratings['grammar']/10,
-                       ratings['length']/10]
+def ratings_array(class_ratings: list) -> np.ndarray:
+    """
+    Stack per-question rating dicts (0-100) of many students into a
+    (students, questions, criteria) array rated in [0,10]. Students with
+    fewer questions are padded with zero ratings.
+    """
+    n_questions = max((len(student_ratings) for student_ratings in class_ratings), default=0)
+    array = np.zeros((len(class_ratings), n_questions, len(RATING_CRITERIA)))
+    for s, student_ratings in enumerate(class_ratings):
+        for q, ratings in enumerate(student_ratings):
+            array[s, q] = [ratings[criterion] for criterion in RATING_CRITERIA]
+    return array / 10
 
-        marks = calculate_marks_obtained(cgpa_scores, credit_list, max_marks)
-        total_marks += marks
+def rating_key(question: dict, grading_mode: str = DEFAULT_GRADING_MODE, relevance_backend: str = None) -> str:
+    """
+    Hash of everything that determines a question's ratings: both answers,
+    the word limit, the key concepts, the model, grading mode, relevance
+    backend and PROMPT_VERSION
+    """
+    backend = get_relevance_backend(relevance_backend)
+    material = json.dumps([
+        PROMPT_VERSION,
+        GEMMA_MODEL,
+        grading_mode,
+        backend.name,
+        getattr(backend, 'model_name', None),
+        str(question['teacher_answer']),
+        str(question['student_answer']),
+        int(question['word_limit']),
+        key_concepts(question)
+    ])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
 
+def reusable_ratings(questions: list, previous_result: dict = None,
+                     grading_mode: str = DEFAULT_GRADING_MODE, relevance_backend: str = None) -> list:
+    """
+    Set each question's rating_key and look up ratings from a previous
+    evaluation of the same sheet whose key is unchanged.
+
+    Returns:
+        list: The previous ratings per question, or None where the question
+              is new or changed and has to be rated again
+    """
+    previous = {}
+    for result in (previous_result or {}).get('question_results', []):
+        if result.get('rating_key') and result.get('ratings'):
+            previous[result['rating_key']] = result['ratings']
+
+    reused = []
+    for q in questions:
+        q['rating_key'] = rating_key(q, grading_mode, relevance_backend)
+        reused.append(previous.get(q['rating_key']))
+    return reused
+
+def resolve_rubric(stored_result: dict = None, credit_list: list = None, max_marks: dict = None) -> dict:
+    """
+    The rubric to mark a result with. A result records the rubric it was
+    marked with, so a regraded sheet keeps its credits and maximum marks
+    when it is evaluated again.
+
+    Args:
+        stored_result (dict, optional): A previous result, whose rubric is the base
+        credit_list (list, optional): Credits per criterion, replacing the
+            stored ones; DEFAULT_CREDIT_LIST if neither is given
+        max_marks (dict, optional): question_no -> maximum marks, added to
+            the stored overrides
+
+    Returns:
+        dict: {"credit_list": list, "max_marks": {question_no: marks}}
+    """
+    stored = (stored_result or {}).get('rubric') or {}
+    overrides = {int(q_no): float(marks) for q_no, marks in (stored.get('max_marks') or {}).items()}
+    overrides.update({int(q_no): float(marks) for q_no, marks in (max_marks or {}).items()})
+    return {
+        'credit_list': list(credit_list or stored.get('credit_list') or DEFAULT_CREDIT_LIST),
+        'max_marks': overrides
+    }
+
+def rubric_only(result: dict = None) -> dict:
+    """A stored result without its ratings, to grade every answer afresh under the same rubric"""
+    return {'rubric': result['rubric']} if result and result.get('rubric') else None
+
+def merge_ratings(reused: list, new_ratings: list) -> list:
+    """Fill the gaps left by reusable_ratings with newly rated questions, in order"""
+    new_ratings = iter(new_ratings)
+    return [ratings if ratings is not None else next(new_ratings) for ratings in reused]
+
+def build_report(questions: list, all_ratings: list, rubric: dict = None) -> dict:
+    """Turn per-question ratings into marks under a rubric (see resolve_rubric) and the final evaluation report"""
+    rubric = rubric or resolve_rubric()
+    question_max = [rubric['max_marks'].get(q['question_no'], q['max_marks']) for q in questions]
+    marks, totals = calculate_marks_batch(ratings_array([all_ratings]), rubric['credit_list'], question_max)
+
+    results = []
+    for q, ratings, max_marks, question_marks in zip(questions, all_ratings, question_max, marks[0]):
         results.append({
-            'question_no': q_no,
-            'question': question,
-            'teacher_answer' : model_answer,
-            'student_answer' : student_answer,
+            'question_no': q['question_no'],
+            'question': q['question'],
+            'teacher_answer' : q['teacher_answer'],
+            'student_answer' : q['student_answer'],
             'max_marks': max_marks,
-            'marks_obtained': marks,
-            'ratings': ratings
+            'marks_obtained': float(question_marks),
+            'ratings': ratings,
+            'rating_key': q.get('rating_key')
         })
 
-    return {'total_marks': round(total_marks, 2), 'question_results': results}
+    return {'total_marks': round(float(totals[0]), 2), 'question_results': results, 'rubric': rubric}
+
+def rescore_reports(reports: list, credit_list: list = None, max_marks: dict = None) -> list:
+    """
+    Recompute marks of many evaluation reports from their stored ratings in
+    one vectorized pass, without querying the model.
+
+    Args:
+        reports (list): Evaluation reports as returned by build_report
+        credit_list (list, optional): Credits per criterion, in RATING_CRITERIA
+            order; each report keeps its stored credits if not given
+        max_marks (dict, optional): question_no -> new maximum marks; other
+            questions keep their stored maximum
+
+    Returns:
+        list: New reports, in the same order, with updated marks, totals and rubric
+    """
+    rubrics = [resolve_rubric(report, credit_list, max_marks) for report in reports]
+    class_results = [report.get('question_results', []) for report in reports]
+    class_ratings = [[question['ratings'] for question in results] for results in class_results]
+
+    ratings = ratings_array(class_ratings)
+    question_max = np.zeros(ratings.shape[:2])
+    for s, results in enumerate(class_results):
+        question_max[s, :len(results)] = [
+            float(rubrics[s]['max_marks'].get(int(question['question_no']), question['max_marks']))
+            for question in results
+        ]
+
+    # One pass per distinct credit list; reports keeping their own credits may differ
+    marks, totals = np.zeros(question_max.shape), np.zeros(len(reports))
+    groups = {}
+    for s, rubric in enumerate(rubrics):
+        groups.setdefault(tuple(rubric['credit_list']), []).append(s)
+    for credits, rows in groups.items():
+        marks[rows], totals[rows] = calculate_marks_batch(ratings[rows], list(credits), question_max[rows])
+
+    rescored = []
+    for s, (report, results) in enumerate(zip(reports, class_results)):
+        question_results = [
+            dict(question, max_marks=float(question_max[s, q]), marks_obtained=float(marks[s, q]))
+            for q, question in enumerate(results)
+        ]
+        rescored.append(dict(report, total_marks=round(float(totals[s]), 2), question_results=question_results,
+                             rubric=rubrics[s]))
+    return rescored
+
+# Define evaluation function (from our pipeline)
+def evaluate_assessment(teacher_sheet,
+                        student_sheet,
+                        default_word_limit: int = 100,
+                        credit_list: list = None,
+                        grading_mode: str = DEFAULT_GRADING_MODE,
+                        relevance_backend: str = None,
+                        answer_key_artifacts: dict = None,
+                        previous_result: dict = None) -> dict:
+    """
+    Grade a student sheet against a teacher sheet. Pass the sheet's
+    previous_result to reuse the ratings of questions whose answers haven't
+    changed; only new or changed answers are sent to the model. The
+    previous result's rubric is kept unless credit_list is given.
+    """
+    if grading_mode not in GRADING_MODES:
+        raise ValueError(f"Unknown grading mode '{grading_mode}', expected one of {GRADING_MODES}")
+
+    questions = load_questions(teacher_sheet, student_sheet, default_word_limit, answer_key_artifacts)
+    reused = reusable_ratings(questions, previous_result, grading_mode, relevance_backend)
+    pending = [q for q, ratings in zip(questions, reused) if ratings is None]
+    content_ratings = precompute_content_ratings(pending, relevance_backend)
+
+    # Nothing to load the model for when every answer is unchanged
+    new_ratings = []
+    if pending:
+        with residency.phase("grade"):
+            new_ratings = [
+                rate_answer(q['student_answer'], q['teacher_answer'], q['word_limit'], grading_mode, content,
+                            key_concepts(q))
+                for q, content in zip(pending, content_ratings)
+            ]
+
+    report = build_report(questions, merge_ratings(reused, new_ratings),
+                          resolve_rubric(previous_result, credit_list))
+    report['reused_questions'] = len(questions) - len(pending)
+    return report
 
 # Sample data
 # teacher_df = pd.DataFrame({
@@ -0,0 +1,381 @@
+"""
+job_queue.py - Durable local job queue for GraderPro
+
+Jobs are rows in an embedded SQLite database (WAL mode), so they survive API
+and worker restarts without an external broker. Workers claim jobs under a
+lease that they keep renewing while the job runs; a job whose lease expires
+(because its worker crashed) is put back in the queue. Failed jobs are
+retried with exponential backoff until max_attempts is reached.
+
+An upload job moves through the worker stages (ocr, parse, grade) under one
+job id: the handler of each stage returns NextStage and the job is requeued
+as the next stage's kind, to be claimed by that stage's workers.
+
+While a job runs, its handler reports which stage it is in (render, ocr,
+parse, store, evaluate) and how far along it is; the time spent in each stage
+is accumulated in stage_timings so slow stages show up per job.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(os.getcwd(), "data_storage", "jobs.db"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "10"))  # seconds, doubled per attempt
+JOB_RETRY_BACKOFF_MAX = float(os.getenv("JOB_RETRY_BACKOFF_MAX", "600"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+# Job kinds handled by each worker stage; concurrency is configured per stage
+JOB_STAGES = {
+    "ocr": ["process_teacher_pdf", "process_student_pdf"],
+    "parse": ["parse_teacher_sheet", "parse_student_sheet"],
+    "grade": ["evaluate_student_sheet"]
+}
+# Workers of the "ingest" stage run every kind, as before the stages were split
+JOB_STAGES["ingest"] = [kind for kinds in list(JOB_STAGES.values()) for kind in kinds]
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+
+class NextStage:
+    """Returned by a job handler to hand the job on to another kind, and so another stage"""
+
+    def __init__(self, kind: str, payload: Dict[str, Any]):
+        self.kind = kind
+        self.payload = payload
+
+
+class JobQueue:
+    """SQLite-backed job queue with leases, retries and crash recovery"""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after REAL NOT NULL,
+            locked_by TEXT,
+            lease_expires REAL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """)
+        # Progress columns were added after the first release of the table
+        self._ensure_column(conn, "stage", "TEXT")
+        self._ensure_column(conn, "stage_started_at", "REAL")
+        self._ensure_column(conn, "progress_current", "INTEGER")
+        self._ensure_column(conn, "progress_total", "INTEGER")
+        self._ensure_column(conn, "stage_timings", "TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, kind, run_after)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs (status, lease_expires)")
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite connections must not be shared"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _ensure_column(conn: sqlite3.Connection, column: str, definition: str):
+        """Add a column to the jobs table if it doesn't exist yet"""
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"]) if job["payload"] else {}
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["stage_timings"] = json.loads(job["stage_timings"]) if job.get("stage_timings") else {}
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        """Add a job and return its id"""
+        return self.enqueue_many([(kind, payload)], max_attempts)[0]
+
+    def enqueue_many(self, jobs: Iterable, max_attempts: int = JOB_MAX_ATTEMPTS) -> List[str]:
+        """Add several (kind, payload) jobs in one transaction and return their ids"""
+        now = time.time()
+        rows = [
+            (uuid.uuid4().hex, kind, json.dumps(payload), STATUS_QUEUED, max_attempts, now, now, now)
+            for kind, payload in jobs
+        ]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("""
+            INSERT INTO jobs (id, kind, payload, status, max_attempts, run_after, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [row[0] for row in rows]
+
+    def claim(self, kinds: Iterable[str], worker_id: str,
+              lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        """
+        Atomically take the oldest runnable job of the given kinds.
+
+        Jobs whose lease has expired are requeued first, which recovers work
+        from workers that crashed mid-job.
+        """
+        kinds = list(kinds)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+            UPDATE jobs SET status = ?, locked_by = NULL, lease_expires = NULL, updated_at = ?
+            WHERE status = ? AND lease_expires < ? AND attempts < max_attempts
+            """, (STATUS_QUEUED, now, STATUS_RUNNING, now))
+            conn.execute("""
+            UPDATE jobs SET status = ?, error = 'Worker lease expired', locked_by = NULL,
+                lease_expires = NULL, updated_at = ?, finished_at = ?
+            WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts
+            """, (STATUS_FAILED, now, now, STATUS_RUNNING, now))
+
+            placeholders = ", ".join("?" for _ in kinds)
+            row = conn.execute(f"""
+            SELECT id FROM jobs
+            WHERE status = ? AND kind IN ({placeholders}) AND run_after <= ?
+            ORDER BY run_after, created_at
+            LIMIT 1
+            """, (STATUS_QUEUED, *kinds, now)).fetchone()
+
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            # Stage timings accumulate over retries and over the stages a job passes through
+            conn.execute("""
+            UPDATE jobs SET status = ?, attempts = attempts + 1, locked_by = ?, lease_expires = ?,
+                started_at = COALESCE(started_at, ?), updated_at = ?, stage = NULL, stage_started_at = NULL,
+                progress_current = NULL, progress_total = NULL
+            WHERE id = ?
+            """, (STATUS_RUNNING, worker_id, now + lease_seconds, now, now, row["id"]))
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+            return self._to_dict(job)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Extend the lease of a running job; False if the worker no longer owns it"""
+        now = time.time()
+        cursor = self._conn().execute("""
+        UPDATE jobs SET lease_expires = ?, updated_at = ?
+        WHERE id = ? AND locked_by = ? AND status = ?
+        """, (now + lease_seconds, now, job_id, worker_id, STATUS_RUNNING))
+        return cursor.rowcount > 0
+
+    def _close_stage(self, conn: sqlite3.Connection, job_id: str, now: float) -> Dict[str, float]:
+        """Add the time spent in the current stage to the job's stage timings"""
+        row = conn.execute("SELECT stage, stage_started_at, stage_timings FROM jobs WHERE id = ?",
+                           (job_id,)).fetchone()
+        timings = json.loads(row["stage_timings"]) if row and row["stage_timings"] else {}
+        if row and row["stage"] and row["stage_started_at"]:
+            elapsed = now - row["stage_started_at"]
+            timings[row["stage"]] = round(timings.get(row["stage"], 0.0) + elapsed, 3)
+        return timings
+
+    def set_progress(self, job_id: str, stage: str,
+                     current: Optional[int] = None, total: Optional[int] = None):
+        """
+        Record the stage a running job is in and its progress within that stage.
+
+        Args:
+            job_id (str): The job to update
+            stage (str): Stage name, e.g. "render", "ocr", "parse", "store", "evaluate"
+            current (int, optional): Units of work done in this stage, e.g. pages OCR'd
+            total (int, optional): Units of work in this stage, if known
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT stage FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return
+
+            if row["stage"] == stage:
+                conn.execute("""
+                UPDATE jobs SET progress_current = ?, progress_total = ?, updated_at = ?
+                WHERE id = ?
+                """, (current, total, now, job_id))
+            else:
+                timings = self._close_stage(conn, job_id, now)
+                conn.execute("""
+                UPDATE jobs SET stage = ?, stage_started_at = ?, progress_current = ?, progress_total = ?,
+                    stage_timings = ?, updated_at = ?
+                WHERE id = ?
+                """, (stage, now, current, total, json.dumps(timings), now, job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def advance(self, job_id: str, worker_id: str, kind: str, payload: Dict[str, Any]) -> bool:
+        """
+        Requeue a running job as the next stage's kind with a new payload.
+        Attempts start again from zero for the new stage.
+
+        Returns:
+            bool: False if the worker no longer owns the job
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            timings = self._close_stage(conn, job_id, now)
+            cursor = conn.execute("""
+            UPDATE jobs SET kind = ?, payload = ?, status = ?, attempts = 0, run_after = ?, error = NULL,
+                locked_by = NULL, lease_expires = NULL, stage_started_at = NULL, stage_timings = ?, updated_at = ?
+            WHERE id = ? AND locked_by = ? AND status = ?
+            """, (kind, json.dumps(payload), STATUS_QUEUED, now, json.dumps(timings), now,
+                  job_id, worker_id, STATUS_RUNNING))
+            conn.execute("COMMIT")
+            return cursor.rowcount > 0
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, job_id: str, worker_id: str, result: Any = None) -> bool:
+        """
+        Record a job's result.
+
+        Returns:
+            bool: False if the worker no longer owns the job
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            timings = self._close_stage(conn, job_id, now)
+            cursor = conn.execute("""
+            UPDATE jobs SET status = ?, result = ?, error = NULL, locked_by = NULL, lease_expires = NULL,
+                stage_started_at = NULL, stage_timings = ?, updated_at = ?, finished_at = ?
+            WHERE id = ? AND locked_by = ? AND status = ?
+            """, (STATUS_SUCCEEDED, json.dumps(result), json.dumps(timings), now, now,
+                  job_id, worker_id, STATUS_RUNNING))
+            conn.execute("COMMIT")
+            return cursor.rowcount > 0
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """
+        Record a failure and schedule a retry with backoff if attempts remain.
+
+        Returns:
+            bool: False if the worker no longer owns the job
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("""
+            SELECT attempts, max_attempts FROM jobs WHERE id = ? AND locked_by = ? AND status = ?
+            """, (job_id, worker_id, STATUS_RUNNING)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return False
+
+            # The stage is kept so the error can be attributed to it
+            timings = json.dumps(self._close_stage(conn, job_id, now))
+            if row["attempts"] < row["max_attempts"]:
+                delay = min(JOB_RETRY_BACKOFF * (2 ** (row["attempts"] - 1)), JOB_RETRY_BACKOFF_MAX)
+                conn.execute("""
+                UPDATE jobs SET status = ?, error = ?, run_after = ?, locked_by = NULL,
+                    lease_expires = NULL, stage_started_at = NULL, stage_timings = ?, updated_at = ?
+                WHERE id = ?
+                """, (STATUS_QUEUED, error, now + delay, timings, now, job_id))
+            else:
+                conn.execute("""
+                UPDATE jobs SET status = ?, error = ?, locked_by = NULL, lease_expires = NULL,
+                    stage_started_at = NULL, stage_timings = ?, updated_at = ?, finished_at = ?
+                WHERE id = ?
+                """, (STATUS_FAILED, error, timings, now, now, job_id))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Client-facing view of a job: state, current stage and progress,
+        time spent per stage, error and result.
+
+        Returns:
+            dict: Job status, or None if the job doesn't exist
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        now = time.time()
+        timings = dict(job["stage_timings"])
+        if job["status"] == STATUS_RUNNING and job["stage"] and job["stage_started_at"]:
+            # Include the time spent so far in the stage that is still running
+            timings[job["stage"]] = round(timings.get(job["stage"], 0.0) + now - job["stage_started_at"], 3)
+
+        return {
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "stage": job["stage"],
+            "progress": {"current": job["progress_current"], "total": job["progress_total"]},
+            "stage_timings": timings,
+            "attempts": job["attempts"],
+            "max_attempts": job["max_attempts"],
+            "error": job["error"],
+            "result": job["result"],
+            "queued_seconds": round((job["started_at"] or now) - job["created_at"], 3),
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "updated_at": job["updated_at"]
+        }
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
@@ -0,0 +1,89 @@
+"""
+loop_monitor.py - Event-loop lag measurement for the GraderPro API
+
+A background task sleeps for a fixed interval and records how much later
+than requested it woke up. That delay is the time the event loop was busy
+running something else, so sustained lag means blocking work is running on
+the loop and every request is waiting behind it.
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Optional
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # seconds between samples
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "600"))  # samples kept for percentiles
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "200"))
+
+
+class EventLoopLagMonitor:
+    """Samples event-loop lag and keeps recent and lifetime statistics"""
+
+    def __init__(self,
+                 interval: float = LOOP_LAG_INTERVAL,
+                 window: int = LOOP_LAG_WINDOW,
+                 warn_ms: float = LOOP_LAG_WARN_MS):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self._samples = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.sample_count = 0
+        self.slow_count = 0
+
+    def start(self):
+        """Start sampling on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max((time.perf_counter() - started - self.interval) * 1000, 0.0)
+
+            self._samples.append(lag_ms)
+            self.last_ms = lag_ms
+            self.max_ms = max(self.max_ms, lag_ms)
+            self.sample_count += 1
+            if lag_ms >= self.warn_ms:
+                self.slow_count += 1
+                print(f"Event loop blocked for {lag_ms:.0f} ms")
+
+    def stats(self) -> Dict:
+        """
+        Lag statistics in milliseconds.
+
+        Returns:
+            dict: last, max since start, and mean/p50/p99 over the recent window,
+                  plus how many samples exceeded the warning threshold
+        """
+        samples = sorted(self._samples)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return samples[min(int(p * len(samples)), len(samples) - 1)]
+
+        return {
+            "last_ms": round(self.last_ms, 2),
+            "max_ms": round(self.max_ms, 2),
+            "mean_ms": round(sum(samples) / len(samples), 2) if samples else 0.0,
+            "p50_ms": round(percentile(0.50), 2),
+            "p99_ms": round(percentile(0.99), 2),
+            "samples": self.sample_count,
+            "slow_samples": self.slow_count,
+            "warn_ms": self.warn_ms
+        }
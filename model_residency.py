@@ -0,0 +1,292 @@
+"""
+model_residency.py - Keeps Ollama models loaded while they are in use
+
+Instead of stopping the vision model after every document (which makes the
+next upload pay a full cold load), jobs acquire the models they need and the
+manager reference-counts them. Models are loaded and kept resident through
+Ollama's keep_alive parameter and unloaded (keep_alive=0) only after they
+have been idle for a configurable period, or when a phase switch asks for
+the memory back. No ollama subprocesses are spawned.
+
+The API and every worker process run their own manager. Each one publishes
+its active job count and last use per model to a shared model_usage table
+(in the job queue database) and refreshes a heartbeat on it, and a model is
+only unloaded when no live process is using it and it has been idle in all
+of them. Rows of processes that stopped heartbeating are ignored.
+"""
+
+import os
+import time
+import socket
+import asyncio
+import sqlite3
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+from job_queue import JOB_DB_PATH
+
+OLLAMA_API_URL = "http://localhost:11434/api/generate"
+
+OCR_MODEL = "granite3.2-vision:2b"
+GRADER_MODEL = "gemma3:4b"
+
+# Models needed by each processing phase
+PHASE_MODELS = {
+    "ocr": [OCR_MODEL],
+    "parse": [GRADER_MODEL],
+    "grade": [GRADER_MODEL]
+}
+
+# Seconds a model may stay loaded with no active jobs before it is unloaded
+MODEL_IDLE_UNLOAD_SECONDS = float(os.getenv("MODEL_IDLE_UNLOAD_SECONDS", "600"))
+# Models to load when the service starts, comma separated
+MODEL_PRELOAD = [m.strip() for m in os.getenv("MODEL_PRELOAD", f"{OCR_MODEL},{GRADER_MODEL}").split(",") if m.strip()]
+# When set, switching phases unloads idle models the new phase does not need
+# (useful on GPUs that cannot hold both models at once)
+MODEL_EXCLUSIVE_PHASES = os.getenv("MODEL_EXCLUSIVE_PHASES", "0") == "1"
+# Where processes share model usage, and how long a process may go without
+# a heartbeat before its usage is disregarded (it has exited or crashed)
+MODEL_USAGE_DB_PATH = os.getenv("MODEL_USAGE_DB_PATH", JOB_DB_PATH)
+MODEL_USAGE_STALE_SECONDS = float(os.getenv("MODEL_USAGE_STALE_SECONDS", "180"))
+
+
+class ModelResidencyManager:
+    """Reference-counts active jobs per model and unloads models once idle"""
+
+    def __init__(self,
+                 idle_unload_seconds: float = MODEL_IDLE_UNLOAD_SECONDS,
+                 exclusive_phases: bool = MODEL_EXCLUSIVE_PHASES,
+                 api_url: str = OLLAMA_API_URL,
+                 usage_path: str = MODEL_USAGE_DB_PATH,
+                 usage_stale_seconds: float = MODEL_USAGE_STALE_SECONDS):
+        self.idle_unload_seconds = idle_unload_seconds
+        self.exclusive_phases = exclusive_phases
+        self.api_url = api_url
+        self.usage_path = usage_path
+        self.usage_stale_seconds = usage_stale_seconds
+        self._usage_conn = None
+        self._usage_pid = None
+        self._lock = threading.Lock()
+        self._refcounts: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
+        self._loaded = set()
+        self._session = requests.Session()
+        self._stop = threading.Event()
+        self._reaper = None
+
+    @property
+    def keep_alive(self) -> str:
+        """keep_alive value to send with requests so Ollama does not unload on its own first"""
+        return f"{int(self.idle_unload_seconds) + 60}s"
+
+    @property
+    def owner(self) -> str:
+        """This process's key in the shared usage table (computed late, workers are forked)"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _usage_db(self) -> sqlite3.Connection:
+        """Connection to the shared usage table; callers hold self._lock"""
+        if self._usage_conn is None or self._usage_pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.usage_path)), exist_ok=True)
+            conn = sqlite3.connect(self.usage_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS model_usage (
+                model TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                active INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                heartbeat REAL NOT NULL,
+                PRIMARY KEY (model, owner)
+            )
+            """)
+            self._usage_conn = conn
+            self._usage_pid = os.getpid()
+        return self._usage_conn
+
+    def _publish(self, model: str):
+        """Share this process's use of a model; callers hold self._lock"""
+        now = time.time()
+        try:
+            self._usage_db().execute("""
+            INSERT INTO model_usage (model, owner, active, last_used, heartbeat) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (model, owner) DO UPDATE SET
+                active = excluded.active, last_used = excluded.last_used, heartbeat = excluded.heartbeat
+            """, (model, self.owner, self._refcounts.get(model, 0), self._last_used.get(model, now), now))
+        except sqlite3.Error as e:
+            print(f"Warning: Could not record usage of {model}: {e}")
+
+    def _heartbeat(self):
+        """Mark this process's usage rows as still live"""
+        with self._lock:
+            try:
+                self._usage_db().execute("UPDATE model_usage SET heartbeat = ? WHERE owner = ?",
+                                         (time.time(), self.owner))
+            except sqlite3.Error as e:
+                print(f"Warning: Could not refresh model usage heartbeat: {e}")
+
+    def _shared_usage(self, model: str) -> Dict:
+        """Active jobs and last use of a model over all live processes; callers hold self._lock"""
+        now = time.time()
+        row = self._usage_db().execute("""
+        SELECT COALESCE(SUM(active), 0), MAX(last_used) FROM model_usage
+        WHERE model = ? AND heartbeat >= ?
+        """, (model, now - self.usage_stale_seconds)).fetchone()
+        return {"active_jobs": row[0], "last_used": row[1] or 0}
+
+    def _set_keep_alive(self, model: str, keep_alive) -> bool:
+        """Load (keep_alive > 0) or unload (keep_alive = 0) a model with an empty generate call"""
+        try:
+            response = self._session.post(
+                self.api_url,
+                json={"model": model, "keep_alive": keep_alive},
+                timeout=(10, 600)
+            )
+            return response.status_code == 200
+        except requests.RequestException as e:
+            print(f"Warning: Could not set keep_alive={keep_alive} for {model}: {e}")
+            return False
+
+    def preload(self, models: Optional[Iterable[str]] = None):
+        """Load models ahead of the first request"""
+        for model in (models if models is not None else MODEL_PRELOAD):
+            if self._set_keep_alive(model, self.keep_alive):
+                with self._lock:
+                    self._loaded.add(model)
+                    self._last_used.setdefault(model, time.time())
+                    self._publish(model)
+                print(f"Preloaded model {model}")
+
+    def acquire(self, model: str):
+        with self._lock:
+            self._refcounts[model] = self._refcounts.get(model, 0) + 1
+            self._last_used[model] = time.time()
+            self._loaded.add(model)
+            self._publish(model)
+
+    def release(self, model: str):
+        with self._lock:
+            self._refcounts[model] = max(self._refcounts.get(model, 0) - 1, 0)
+            self._last_used[model] = time.time()
+            self._publish(model)
+
+    @contextmanager
+    def use(self, *models: str):
+        """Hold models resident for the duration of a job"""
+        for model in models:
+            self.acquire(model)
+        try:
+            yield
+        finally:
+            for model in models:
+                self.release(model)
+
+    @asynccontextmanager
+    async def use_async(self, *models: str):
+        """use() for coroutines; the shared usage table is written from a thread, off the event loop"""
+        for model in models:
+            await asyncio.to_thread(self.acquire, model)
+        try:
+            yield
+        finally:
+            for model in models:
+                await asyncio.to_thread(self.release, model)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Enter a processing phase, holding its models and optionally unloading the others"""
+        models = PHASE_MODELS.get(name, [])
+        if self.exclusive_phases:
+            self.unload_idle(exclude=models, min_idle_seconds=0)
+        with self.use(*models):
+            yield
+
+    def unload(self, model: str) -> bool:
+        """Unload a model now if no job in any process is using it"""
+        with self._lock:
+            if self._refcounts.get(model, 0) > 0:
+                return False
+            try:
+                if self._shared_usage(model)["active_jobs"] > 0:
+                    return False
+            except sqlite3.Error as e:
+                print(f"Warning: Could not check shared usage of {model}, keeping it loaded: {e}")
+                return False
+        unloaded = self._set_keep_alive(model, 0)
+        if unloaded:
+            with self._lock:
+                self._loaded.discard(model)
+            print(f"Unloaded idle model {model}")
+        return unloaded
+
+    def unload_idle(self, exclude: Iterable[str] = (), min_idle_seconds: Optional[float] = None) -> List[str]:
+        """Unload every loaded model that no process has used for min_idle_seconds"""
+        if min_idle_seconds is None:
+            min_idle_seconds = self.idle_unload_seconds
+        now = time.time()
+        with self._lock:
+            candidates = [
+                model for model in self._loaded
+                if model not in exclude
+                and self._refcounts.get(model, 0) == 0
+                and now - self._last_used.get(model, 0) >= min_idle_seconds
+            ]
+            try:
+                candidates = [
+                    model for model in candidates
+                    if now - self._shared_usage(model)["last_used"] >= min_idle_seconds
+                ]
+            except sqlite3.Error as e:
+                print(f"Warning: Could not check shared model usage, keeping models loaded: {e}")
+                return []
+        return [model for model in candidates if self.unload(model)]
+
+    def _reap(self):
+        interval = max(min(self.idle_unload_seconds / 4, 60), 1)
+        while not self._stop.wait(interval):
+            self._heartbeat()
+            self.unload_idle()
+
+    def start(self, preload: bool = True, models: Optional[Iterable[str]] = None):
+        """
+        Preload models (MODEL_PRELOAD unless models is given) and start the
+        idle-unload thread, which also keeps this process's usage heartbeat
+        alive. Every process that uses models must call this.
+        """
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, daemon=True)
+            self._reaper.start()
+        if preload:
+            self.preload(models)
+
+    def stop(self):
+        """Stop the idle-unload thread and withdraw this process's usage"""
+        self._stop.set()
+        with self._lock:
+            try:
+                self._usage_db().execute("DELETE FROM model_usage WHERE owner = ?", (self.owner,))
+            except sqlite3.Error as e:
+                print(f"Warning: Could not clear model usage: {e}")
+
+    def status(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            status = {}
+            for model in sorted(self._loaded):
+                status[model] = {
+                    "active_jobs": self._refcounts.get(model, 0),
+                    "idle_seconds": round(now - self._last_used.get(model, now), 1)
+                }
+                try:
+                    shared = self._shared_usage(model)
+                    status[model]["active_jobs_all_processes"] = shared["active_jobs"]
+                    status[model]["idle_seconds_all_processes"] = round(now - (shared["last_used"] or now), 1)
+                except sqlite3.Error:
+                    pass
+            return status
+
+
+residency = ModelResidencyManager()
@@ -5,44 +5,127 @@ This module provides functions to evaluate student answers against teacher answe
 using the Gemma 3:4B model exclusively for improved semantic understanding.
 """
 
+import os
 import re
 import requests
 import json
 
+from response_cache import get_llm_cache, llm_cache_key, is_deterministic
+from model_residency import residency
+
 # Ollama API configuration
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
 GEMMA_MODEL = "gemma3:4b"
 
-def query_gemma(prompt, system_prompt=None):
+# Seconds to wait for the connection and for the model's response
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+
+# Sampling options sent with every grading request. Temperature 0 and a fixed
+# seed make the output deterministic, which also lets responses be cached.
+GEMMA_OPTIONS = {
+    "temperature": float(os.getenv("GEMMA_TEMPERATURE", "0")),
+    "seed": int(os.getenv("GEMMA_SEED", "42"))
+}
+
+# Maps the rating keys used by the evaluation pipeline to the field names the
+# model is asked to return when all criteria are graded in a single call
+CRITERIA_FIELDS = {
+    "keyword": "keyword_matching",
+    "content": "content_relevance",
+    "grammar": "grammatical_accuracy",
+    "length": "word_length"
+}
+
+# Shared keep-alive session so consecutive calls reuse the same connection
+_session = requests.Session()
+
+def build_payload(prompt, system_prompt=None, response_format=None):
+    """
+    Build the request body for Ollama's generate endpoint.
+
+    Args:
+        prompt (str): The prompt to send to the model
+        system_prompt (str, optional): System instructions for the model
+        response_format (str, optional): Ollama output format, e.g. "json"
+
+    Returns:
+        dict: JSON payload for the request
+    """
+    payload = {
+        "model": GEMMA_MODEL,
+        "prompt": prompt,
+        "stream": False,
+        "options": dict(GEMMA_OPTIONS),
+        "keep_alive": residency.keep_alive
+    }
+
+    if system_prompt:
+        payload["system"] = system_prompt
+
+    if response_format:
+        payload["format"] = response_format
+
+    return payload
+
+def payload_cache_key(payload):
+    """
+    Cache key for a generate payload, or None if the request is not cacheable.
+
+    Args:
+        payload (dict): Payload built by build_payload
+
+    Returns:
+        str or None: Content hash of model, prompts, options and format
+    """
+    if not is_deterministic(payload.get("options")):
+        return None
+    return llm_cache_key(
+        payload["model"],
+        payload["prompt"],
+        payload.get("system"),
+        payload.get("options"),
+        format=payload.get("format")
+    )
+
+def query_gemma(prompt, system_prompt=None, response_format=None, validate=None):
     """
     Query the Gemma 3:4B model through Ollama's API.
-    
+
     Args:
         prompt (str): The prompt to send to the model
         system_prompt (str, optional): System instructions for the model
-        
+        response_format (str, optional): Ollama output format, e.g. "json"
+        validate (callable, optional): Returns True if a response is usable;
+            responses it rejects are returned but not cached
+
     Returns:
         str: The model's response text
     """
     try:
         print(f"Attempting to connect to Ollama API at {OLLAMA_API_URL}")
-        headers = {"Content-Type": "application/json"}
-        payload = {
-            "model": GEMMA_MODEL,
-            "prompt": prompt,
-            "stream": False
-        }
-        
-        if system_prompt:
-            payload["system"] = system_prompt
-        
-        print("Sending request to Ollama API...")    
-        response = requests.post(OLLAMA_API_URL, headers=headers, data=json.dumps(payload))
-        
+        payload = build_payload(prompt, system_prompt, response_format)
+
+        cache = get_llm_cache()
+        cache_key = payload_cache_key(payload) if cache else None
+        if cache_key:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        print("Sending request to Ollama API...")
+        response = _session.post(
+            OLLAMA_API_URL,
+            json=payload,
+            timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+        )
+
         print(f"Ollama API Response Status: {response.status_code}")
         if response.status_code == 200:
             result = response.json().get("response", "")
             print(f"Ollama API Response: {result[:50]}...")  # Print first 50 chars
+            if cache_key and result and (validate is None or validate(result)):
+                cache.set(cache_key, result)
             return result
         else:
             print(f"Error response from Ollama API: {response.text}")
@@ -51,39 +134,176 @@ def query_gemma(prompt, system_prompt=None):
         print(f"Exception in querying Gemma model: {str(e)}")
         return ""
 
-def keyword_matching(student_answer, teacher_answer):
+def build_prompt(criterion, student_answer, teacher_answer="", minimum_words=0, key_concepts=None):
     """
-    Identify the presence/absence of teacher-specified keywords in the student's answer
-    using Gemma model.
-    
+    Build the prompt and system prompt used to grade one criterion.
+
     Args:
+        criterion (str): One of 'keyword', 'content', 'grammar', 'length' or 'combined'
         student_answer (str): The student's answer text
-        teacher_answer (str): The teacher's answer text containing expected keywords
-        
+        teacher_answer (str, optional): The teacher's answer text
+        minimum_words (int, optional): Minimum required word count
+        key_concepts (list, optional): Key concepts precomputed from the teacher's
+            answer; when given the model does not have to extract them itself
+
     Returns:
-        float: Percentage rating (0-100) of keyword matching
+        tuple: (prompt, system_prompt)
     """
-    try:
+    if criterion == "keyword" and key_concepts:
+        prompt = f"""
+        Task: Analyze how many key concepts from the teacher's answer appear in the student's answer.
+
+        Key Concepts: {"; ".join(key_concepts)}
+        Student's Answer: {student_answer}
+
+        Analyze the student's answer to see what percentage of these key concepts are present, including synonyms and related terms.
+
+        Return only a numeric percentage between 0 and 100.
+        """
+        system_prompt = "You are an educational assessment expert. Analyze precisely and numerically."
+    elif criterion == "keyword":
         prompt = f"""
         Task: Analyze how many key concepts from the teacher's answer appear in the student's answer.
-        
+
         Teacher's Answer: {teacher_answer}
         Student's Answer: {student_answer}
-        
+
         Extract the key concepts from the teacher's answer. Then analyze the student's answer to see what percentage of these key concepts are present, including synonyms and related terms.
-        
+
         Return only a numeric percentage between 0 and 100.
         """
-        
         system_prompt = "You are an educational assessment expert. Analyze precisely and numerically."
-        
-        gemma_result = query_gemma(prompt, system_prompt)
-        if gemma_result:
-            # Extract numeric percentage from the result
-            match = re.search(r'(\d+(?:\.\d+)?)', gemma_result)
-            if match:
-                return min(100.0, float(match.group(1)))
-        return 0.0
+    elif criterion == "content":
+        prompt = f"""
+        Task: Measure the semantic similarity between a teacher's answer and a student's answer.
+
+        Teacher's Answer: {teacher_answer}
+        Student's Answer: {student_answer}
+
+        Analyze how well the student's answer captures the meaning and content of the teacher's answer.
+        Consider semantic relevance beyond just keywords.
+
+        Return only a numeric percentage between 0 and 100.
+        """
+        system_prompt = "You are an educational assessment expert. Analyze precisely and numerically."
+    elif criterion == "grammar":
+        prompt = f"""
+        Task: Evaluate the grammatical correctness of a student's answer.
+
+        Student's Answer: {student_answer}
+
+        Analyze the text for grammatical errors, including:
+        - Subject-verb agreement
+        - Verb tense consistency
+        - Proper use of articles
+        - Sentence structure
+        - Punctuation
+
+        Return only a numeric percentage between 0 and 100 representing grammatical accuracy.
+        """
+        system_prompt = "You are a grammar expert. Analyze precisely and numerically."
+    elif criterion == "length":
+        prompt = f"""
+        Task: Evaluate if a student's answer meets the required word count.
+
+        Student's Answer: {student_answer}
+        Minimum required words: {minimum_words}
+
+        1. Count the number of words in the student's answer
+        2. Calculate what percentage of the minimum word count requirement was met
+        3. If the word count meets or exceeds the minimum, return 100%
+        4. If the word count is less than the minimum, calculate the percentage as: (student_words / minimum_words) * 100
+
+        Return only a numeric percentage between 0 and 100.
+        """
+        system_prompt = "You are an educational assessment expert. Analyze precisely and calculate numerically."
+    elif criterion == "combined":
+        if key_concepts:
+            keyword_instruction = f"Give the percentage of these key concepts from the teacher's answer present in the student's answer, including synonyms and related terms: {'; '.join(key_concepts)}."
+        else:
+            keyword_instruction = "Extract the key concepts from the teacher's answer and give the percentage of them present in the student's answer, including synonyms and related terms."
+        prompt = f"""
+        Task: Grade a student's answer against a teacher's answer on four criteria.
+
+        Teacher's Answer: {teacher_answer}
+        Student's Answer: {student_answer}
+        Minimum required words: {minimum_words}
+
+        Criteria:
+        - keyword_matching: {keyword_instruction}
+        - content_relevance: How well the student's answer captures the meaning and content of the teacher's answer, considering semantic relevance beyond just keywords.
+        - grammatical_accuracy: Grammatical correctness of the student's answer (subject-verb agreement, verb tense consistency, articles, sentence structure, punctuation).
+        - word_length: 100 if the student's answer meets or exceeds the minimum word count, otherwise (student_words / minimum_words) * 100.
+
+        Return only a JSON object with numeric percentages between 0 and 100, for example:
+        {{"keyword_matching": 70, "content_relevance": 80, "grammatical_accuracy": 90, "word_length": 100}}
+        """
+        system_prompt = "You are an educational assessment expert. Analyze precisely and numerically. Respond with JSON only."
+    else:
+        raise ValueError(f"Unknown criterion '{criterion}'")
+
+    return prompt, system_prompt
+
+def parse_percentage(gemma_result):
+    """
+    Extract the first number from a model response as a percentage.
+
+    Args:
+        gemma_result (str): Raw model response
+
+    Returns:
+        float or None: Percentage capped at 100, or None if no number was found
+    """
+    if gemma_result:
+        match = re.search(r'(\d+(?:\.\d+)?)', gemma_result)
+        if match:
+            return min(100.0, float(match.group(1)))
+    return None
+
+def is_percentage_response(gemma_result):
+    """Whether a single-criterion response holds a usable percentage"""
+    return parse_percentage(gemma_result) is not None
+
+def word_count_rating(student_answer, minimum_words):
+    """
+    Rate the word count of an answer directly, without the model.
+
+    Args:
+        student_answer (str): The student's answer text
+        minimum_words (int): The minimum required number of words
+
+    Returns:
+        float: Percentage rating (0-100) based on word count comparison
+    """
+    if minimum_words <= 0:
+        return 100.0
+
+    student_words = len(student_answer.split())
+    if student_words >= minimum_words:
+        return 100.0
+    else:
+        percentage = (student_words / minimum_words) * 100
+        return max(0.0, percentage)
+
+def keyword_matching(student_answer, teacher_answer, key_concepts=None):
+    """
+    Identify the presence/absence of teacher-specified keywords in the student's answer
+    using Gemma model.
+
+    Args:
+        student_answer (str): The student's answer text
+        teacher_answer (str): The teacher's answer text containing expected keywords
+        key_concepts (list, optional): Precomputed key concepts of the teacher's answer
+
+    Returns:
+        float: Percentage rating (0-100) of keyword matching
+    """
+    try:
+        prompt, system_prompt = build_prompt("keyword", student_answer, teacher_answer,
+                                             key_concepts=key_concepts)
+
+        rating = parse_percentage(query_gemma(prompt, system_prompt, validate=is_percentage_response))
+        return rating if rating is not None else 0.0
     except Exception as e:
         print(f"Error in keyword_matching: {str(e)}")
         return 0.0
@@ -92,36 +312,19 @@ def content_relevance(student_answer, teacher_answer):
     """
     Measure the relevance of the student's answer to the teacher's answer
     using Gemma model.
-    
+
     Args:
         student_answer (str): The student's answer text
         teacher_answer (str): The teacher's answer text
-        
+
     Returns:
         float: Percentage rating (0-100) of content relevance
     """
     try:
-        prompt = f"""
-        Task: Measure the semantic similarity between a teacher's answer and a student's answer.
-        
-        Teacher's Answer: {teacher_answer}
-        Student's Answer: {student_answer}
-        
-        Analyze how well the student's answer captures the meaning and content of the teacher's answer.
-        Consider semantic relevance beyond just keywords.
-        
-        Return only a numeric percentage between 0 and 100.
-        """
-        
-        system_prompt = "You are an educational assessment expert. Analyze precisely and numerically."
-        
-        gemma_result = query_gemma(prompt, system_prompt)
-        if gemma_result:
-            # Extract numeric percentage from the result
-            match = re.search(r'(\d+(?:\.\d+)?)', gemma_result)
-            if match:
-                return min(100.0, float(match.group(1)))
-        return 0.0
+        prompt, system_prompt = build_prompt("content", student_answer, teacher_answer)
+
+        rating = parse_percentage(query_gemma(prompt, system_prompt, validate=is_percentage_response))
+        return rating if rating is not None else 0.0
     except Exception as e:
         print(f"Error in content_relevance: {str(e)}")
         return 0.0
@@ -129,38 +332,18 @@ def content_relevance(student_answer, teacher_answer):
 def grammatical_accuracy(student_answer):
     """
     Evaluate the grammatical correctness of the student's answer using Gemma model.
-    
+
     Args:
         student_answer (str): The student's answer text
-        
+
     Returns:
         float: Percentage rating (0-100) of grammatical accuracy
     """
     try:
-        prompt = f"""
-        Task: Evaluate the grammatical correctness of a student's answer.
-        
-        Student's Answer: {student_answer}
-        
-        Analyze the text for grammatical errors, including:
-        - Subject-verb agreement
-        - Verb tense consistency
-        - Proper use of articles
-        - Sentence structure
-        - Punctuation
-        
-        Return only a numeric percentage between 0 and 100 representing grammatical accuracy.
-        """
-        
-        system_prompt = "You are a grammar expert. Analyze precisely and numerically."
-        
-        gemma_result = query_gemma(prompt, system_prompt)
-        if gemma_result:
-            # Extract numeric percentage from the result
-            match = re.search(r'(\d+(?:\.\d+)?)', gemma_result)
-            if match:
-                return min(100.0, float(match.group(1)))
-        return 0.0
+        prompt, system_prompt = build_prompt("grammar", student_answer)
+
+        rating = parse_percentage(query_gemma(prompt, system_prompt, validate=is_percentage_response))
+        return rating if rating is not None else 0.0
     except Exception as e:
         print(f"Error in grammatical_accuracy: {str(e)}")
         return 0.0
@@ -168,61 +351,149 @@ def grammatical_accuracy(student_answer):
 def word_length_assessment(student_answer, minimum_words):
     """
     Evaluate if the student's answer meets the required minimum word count using Gemma model.
-    
+
     Args:
         student_answer (str): The student's answer text
         minimum_words (int): The minimum required number of words
-        
+
     Returns:
         float: Percentage rating (0-100) based on word count comparison
     """
     try:
-        prompt = f"""
-        Task: Evaluate if a student's answer meets the required word count.
-        
-        Student's Answer: {student_answer}
-        Minimum required words: {minimum_words}
-        
-        1. Count the number of words in the student's answer
-        2. Calculate what percentage of the minimum word count requirement was met
-        3. If the word count meets or exceeds the minimum, return 100%
-        4. If the word count is less than the minimum, calculate the percentage as: (student_words / minimum_words) * 100
-        
-        Return only a numeric percentage between 0 and 100.
-        """
-        
-        system_prompt = "You are an educational assessment expert. Analyze precisely and calculate numerically."
-        
-        gemma_result = query_gemma(prompt, system_prompt)
-        if gemma_result:
-            # Extract numeric percentage from the result
-            match = re.search(r'(\d+(?:\.\d+)?)', gemma_result)
-            if match:
-                return min(100.0, float(match.group(1)))
-        
+        prompt, system_prompt = build_prompt("length", student_answer, minimum_words=minimum_words)
+
+        rating = parse_percentage(query_gemma(prompt, system_prompt, validate=is_percentage_response))
+        if rating is not None:
+            return rating
+
         # Simple fallback calculation if Gemma fails - just counting words directly
-        if minimum_words <= 0:
-            return 100.0
-        
-        student_words = len(student_answer.split())
-        if student_words >= minimum_words:
-            return 100.0
-        else:
-            percentage = (student_words / minimum_words) * 100
-            return max(0.0, percentage)
+        return word_count_rating(student_answer, minimum_words)
     except Exception as e:
         print(f"Error in word_length_assessment: {str(e)}")
         return 0.0
 
+def _validate_rating(value):
+    """
+    Convert a single criterion value returned by the model into a rating.
+
+    Args:
+        value: Raw value from the model's JSON (number or string like "85%")
+
+    Returns:
+        float or None: Rating clamped to 0-100, or None if the value is unusable
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        rating = float(value)
+    elif isinstance(value, str):
+        match = re.search(r'(-?\d+(?:\.\d+)?)', value)
+        if not match:
+            return None
+        rating = float(match.group(1))
+    else:
+        return None
+
+    if rating != rating:  # NaN
+        return None
+    return max(0.0, min(100.0, rating))
+
+def parse_criteria_response(response_text):
+    """
+    Parse the structured JSON returned by a multi-criterion grading call.
+
+    Args:
+        response_text (str): Raw model response, expected to hold a JSON object
+
+    Returns:
+        dict: Rating per criterion key ('keyword', 'content', 'grammar', 'length').
+              Criteria that are missing or invalid are set to None.
+    """
+    ratings = {key: None for key in CRITERIA_FIELDS}
+    if not response_text:
+        return ratings
+
+    # The model may still wrap the object in a markdown code block
+    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if not json_match:
+        return ratings
+
+    try:
+        data = json.loads(json_match.group(0))
+    except json.JSONDecodeError:
+        print(f"Could not parse multi-criterion response: {response_text[:100]}")
+        return ratings
+
+    if not isinstance(data, dict):
+        return ratings
+
+    for key, field in CRITERIA_FIELDS.items():
+        # Accept either the descriptive field name or the short rating key
+        value = data.get(field, data.get(key))
+        ratings[key] = _validate_rating(value)
+
+    return ratings
+
+def is_criteria_response(response_text):
+    """Whether a multi-criterion response parses to a rating for every criterion"""
+    return all(rating is not None for rating in parse_criteria_response(response_text).values())
+
+def assess_all_criteria(student_answer, teacher_answer, minimum_words=0, known_ratings=None,
+                        key_concepts=None):
+    """
+    Evaluate a student answer on all four criteria with a single Gemma call.
+
+    The model is asked for one JSON object holding every rating. Any criterion
+    that is missing or invalid in the response is re-evaluated with its
+    dedicated per-criterion function.
+
+    Args:
+        student_answer (str): The student's answer text
+        teacher_answer (str): The teacher's answer text
+        minimum_words (int, optional): Minimum required word count
+        known_ratings (dict, optional): Ratings already computed elsewhere
+            (e.g. content relevance from embeddings); these override the model
+        key_concepts (list, optional): Precomputed key concepts of the teacher's answer
+
+    Returns:
+        dict: Percentage rating (0-100) for 'keyword', 'content', 'grammar' and 'length'
+    """
+    try:
+        prompt, system_prompt = build_prompt("combined", student_answer, teacher_answer, minimum_words,
+                                             key_concepts)
+        gemma_result = query_gemma(prompt, system_prompt, response_format="json",
+                                   validate=is_criteria_response)
+        ratings = parse_criteria_response(gemma_result)
+    except Exception as e:
+        print(f"Error in assess_all_criteria: {str(e)}")
+        ratings = {key: None for key in CRITERIA_FIELDS}
+
+    if known_ratings:
+        ratings.update({key: value for key, value in known_ratings.items() if value is not None})
+
+    # Fall back to the per-criterion calls for anything the model got wrong
+    fallbacks = {
+        "keyword": lambda: keyword_matching(student_answer, teacher_answer, key_concepts),
+        "content": lambda: content_relevance(student_answer, teacher_answer),
+        "grammar": lambda: grammatical_accuracy(student_answer),
+        "length": lambda: word_length_assessment(student_answer, minimum_words)
+    }
+    for key, rating in ratings.items():
+        if rating is None:
+            print(f"Multi-criterion response missing '{key}', falling back to single-criterion call")
+            ratings[key] = fallbacks[key]()
+
+    return ratings
+
 def assess_answer(student_answer, teacher_answer, minimum_words=0):
     """
     Comprehensive assessment function that evaluates a student answer on multiple dimensions.
-    
+
     Args:
         student_answer (str): The student's answer text
         teacher_answer (str): The teacher's answer text
         minimum_words (int, optional): Minimum required word count
-        
+
     Returns:
         dict: Dictionary containing scores for each assessment dimension and an overall score
     """
@@ -231,7 +502,7 @@ def assess_answer(student_answer, teacher_answer, minimum_words=0):
     relevance_score = content_relevance(student_answer, teacher_answer)
     grammar_score = grammatical_accuracy(student_answer)
     length_score = word_length_assessment(student_answer, minimum_words)
-    
+
     # Calculate weighted overall score (adjust weights as needed)
     overall_score = (
         keyword_score * 0.3 +
@@ -239,7 +510,7 @@ def assess_answer(student_answer, teacher_answer, minimum_words=0):
         grammar_score * 0.2 +
         length_score * 0.1
     )
-    
+
     return {
         "keyword_matching": round(keyword_score, 2),
         "content_relevance": round(relevance_score, 2),
@@ -253,7 +524,7 @@ def assess_answer(student_answer, teacher_answer, minimum_words=0):
 #     teacher_ans = "Photosynthesis is a process used by plants to convert light energy into chemical energy that can later be released to fuel the organism's activities."
 #     student_ans = "Plants make their food using sunlight. They transform the sun's energy into glucose."
 #     min_words = 10
-    
+
 #     # Demonstrate comprehensive assessment
 #     print("\nComprehensive Assessment:")
 #     results = assess_answer(student_ans, teacher_ans, min_words)
@@ -1,39 +1,399 @@
-from typing import List
+import os
+import time
+import queue
+import threading
+import unicodedata
+from typing import Callable, Dict, Iterator, List, Optional
+import numpy as np
 import pypdfium2 as pdfium
 from PIL import Image
 
-from TrOcr import image_to_text
+from TrOcr import ocr_pages, raise_for_failed_pages
+from model_residency import residency
 
-def pdf_to_image(pdf_path: str) -> List[Image.Image]:
+PDF_RENDER_SCALE = float(os.getenv("PDF_RENDER_SCALE", "1.5"))
+
+# Upper bound on rendered-but-not-yet-OCR'd pages held in memory
+OCR_MEMORY_BUDGET_MB = float(os.getenv("OCR_MEMORY_BUDGET_MB", "200"))
+OCR_MAX_QUEUED_PAGES = int(os.getenv("OCR_MAX_QUEUED_PAGES", "4"))
+
+# A page's embedded text layer is used instead of OCR when it has at least
+# this many non-whitespace characters and this share of them are real glyphs
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER_ENABLED", "1") == "1"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "40"))
+TEXT_LAYER_MIN_GLYPH_COVERAGE = float(os.getenv("TEXT_LAYER_MIN_GLYPH_COVERAGE", "0.9"))
+
+# Pages whose ink density (after ignoring printed rules) is below the
+# threshold are recorded as empty and never sent to the vision model
+BLANK_PAGE_DETECTION = os.getenv("BLANK_PAGE_DETECTION", "1") == "1"
+BLANK_PAGE_INK_DENSITY = float(os.getenv("BLANK_PAGE_INK_DENSITY", "0.0003"))
+BLANK_PAGE_MAX_STD = float(os.getenv("BLANK_PAGE_MAX_STD", "0.08"))
+BLANK_PAGE_SAMPLE_SIZE = 256  # longest side of the downsampled bitmap
+INK_LEVEL = 0.55  # grey level (0 = black, 1 = white) below which a pixel counts as ink
+RULE_FRACTION = 0.5  # rows/columns with more ink than this are ruled lines or margins
+
+_DONE = object()
+
+
+def pdf_to_image(pdf_path: str, scale: float = PDF_RENDER_SCALE) -> List[Image.Image]:
     pdf = pdfium.PdfDocument(pdf_path)
     page_count = len(pdf)
     images = []
-    
+
     try:
         for page_number in range(page_count):
             page = pdf[page_number]
-            bitmap = page.render(scale=1.5)
+            bitmap = page.render(scale=scale)
             pil_image = bitmap.to_pil()
             images.append(pil_image)
             bitmap.close()
             page.close()
-        
+
         return images
     finally:
         pdf.close()
 
 
-def extract_text_from_pdf(pdf_path: str) -> str:
+def iter_pdf_pages(pdf_path: str, scale: float = PDF_RENDER_SCALE) -> Iterator[Image.Image]:
+    """Render pages lazily, one at a time, instead of the whole document up front"""
+    pdf = pdfium.PdfDocument(pdf_path)
+
+    try:
+        for page_number in range(len(pdf)):
+            page = pdf[page_number]
+            bitmap = page.render(scale=scale)
+            pil_image = bitmap.to_pil()
+            bitmap.close()
+            page.close()
+            yield pil_image
+    finally:
+        pdf.close()
+
+
+def text_layer_quality(text: str) -> Dict:
+    """
+    Judge whether a page's embedded text layer can replace OCR.
+
+    Glyph coverage is the share of non-whitespace characters that are real
+    glyphs, i.e. not replacement, private-use, control or unassigned code
+    points, which is what broken font encodings produce.
+
+    Returns:
+        dict: {"chars": int, "glyph_coverage": float, "usable": bool}
+    """
+    chars = [c for c in text if not c.isspace()]
+    if not chars:
+        return {"chars": 0, "glyph_coverage": 0.0, "usable": False}
+
+    bad_categories = {"Co", "Cc", "Cn", "Cs"}
+    glyphs = sum(1 for c in chars if c != "\ufffd" and unicodedata.category(c) not in bad_categories)
+    coverage = glyphs / len(chars)
+    return {
+        "chars": len(chars),
+        "glyph_coverage": round(coverage, 3),
+        "usable": len(chars) >= TEXT_LAYER_MIN_CHARS and coverage >= TEXT_LAYER_MIN_GLYPH_COVERAGE
+    }
+
+
+def classify_page(image: Image.Image) -> Dict:
+    """
+    Decide whether a rendered page is blank from a small grayscale copy.
+
+    The copy keeps the darkest pixel of each block rather than the average,
+    so thin pen or pencil strokes stay dark instead of blurring into light
+    grey and a page with a short handwritten answer is never taken as blank.
+
+    Rows and columns that are mostly ink are treated as printed rules or
+    margin lines and ignored, so ruled-but-empty booklet pages count as
+    blank. The page is blank when the remaining ink density and the pixel
+    variance are both below their thresholds. If every row or column is
+    mostly ink (a dark or grey scan) the whole page is measured instead,
+    so such a page is never skipped as blank.
+
+    Returns:
+        dict: {"blank": bool, "ink_density": float, "std": float}
+    """
+    gray = image.convert("L")
+    pixels = np.array(gray)
+    if gray is not image:
+        gray.close()
+
+    # Block-min downsample to at most BLANK_PAGE_SAMPLE_SIZE on the longest side
+    factor = max(1, -(-max(pixels.shape) // BLANK_PAGE_SAMPLE_SIZE))
+    if factor > 1:
+        height, width = pixels.shape
+        pixels = np.pad(pixels, ((0, -height % factor), (0, -width % factor)), constant_values=255)
+        pixels = pixels.reshape(pixels.shape[0] // factor, factor, pixels.shape[1] // factor, factor).min(axis=(1, 3))
+    pixels = pixels.astype(np.float32) / 255.0
+
+    ink = pixels < INK_LEVEL
+    content_rows = ink.mean(axis=1) <= RULE_FRACTION
+    content_cols = ink.mean(axis=0) <= RULE_FRACTION
+    content = pixels[np.ix_(content_rows, content_cols)]
+    if content.size == 0:
+        content = pixels
+
+    ink_density = float((content < INK_LEVEL).mean())
+    std = float(content.std())
+    return {
+        "blank": ink_density < BLANK_PAGE_INK_DENSITY and std < BLANK_PAGE_MAX_STD,
+        "ink_density": round(ink_density, 5),
+        "std": round(std, 4)
+    }
+
+
+def read_text_layer(page) -> str:
+    """Extract the embedded text of a pdfium page"""
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        textpage.close()
+
+
+class PageStream:
+    """
+    Producer-consumer page renderer.
+
+    A background thread renders pages into a bounded queue while the consumer
+    OCRs earlier ones, so rendering and OCR overlap. Rendering pauses whenever
+    the pages that are queued or still being OCR'd would exceed the memory
+    budget. The consumer must call release(image) once it is done with a page.
+
+    Pages whose embedded text layer passes the quality check are not rendered
+    at all; their text is collected in text_layer_pages instead. Rendered
+    pages classified as blank are collected in blank_pages and not yielded.
+    Yielded images carry their 1-based page number in image.info["page_number"].
+    """
+
+    def __init__(self,
+                 pdf_path: str,
+                 scale: float = PDF_RENDER_SCALE,
+                 memory_budget_mb: float = OCR_MEMORY_BUDGET_MB,
+                 max_queued_pages: int = OCR_MAX_QUEUED_PAGES,
+                 use_text_layer: bool = TEXT_LAYER_ENABLED,
+                 detect_blank_pages: bool = BLANK_PAGE_DETECTION):
+        self.pdf_path = pdf_path
+        self.scale = scale
+        self.use_text_layer = use_text_layer
+        self.detect_blank_pages = detect_blank_pages
+        self.text_layer_pages = {}  # page number -> {"text", "chars", "glyph_coverage", "seconds"}
+        self.blank_pages = {}  # page number -> {"ink_density", "std", "seconds"}
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._queue = queue.Queue(maxsize=max(1, max_queued_pages))
+        self._budget = threading.Condition()
+        self._in_flight = {}  # id(image) -> bytes
+        self._in_flight_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.page_count = None
+        self.peak_bytes = 0
+
+    def _reserve(self, page_bytes: int) -> bool:
+        """Block until the page fits in the budget; a single page is always allowed"""
+        with self._budget:
+            while (self._in_flight_bytes > 0
+                   and self._in_flight_bytes + page_bytes > self.memory_budget
+                   and not self._stop.is_set()):
+                self._budget.wait(timeout=0.5)
+            if self._stop.is_set():
+                return False
+            self._in_flight_bytes += page_bytes
+            self.peak_bytes = max(self.peak_bytes, self._in_flight_bytes)
+            return True
+
+    def release(self, image: Image.Image):
+        """Return a page's memory to the budget and close it"""
+        with self._budget:
+            page_bytes = self._in_flight.pop(id(image), 0)
+            self._in_flight_bytes -= page_bytes
+            self._budget.notify_all()
+        image.close()
+
+    def _produce(self):
+        try:
+            pdf = pdfium.PdfDocument(self.pdf_path)
+            try:
+                self.page_count = len(pdf)
+                for page_number in range(self.page_count):
+                    page = pdf[page_number]
+
+                    if self.use_text_layer:
+                        started = time.perf_counter()
+                        text = read_text_layer(page)
+                        quality = text_layer_quality(text)
+                        if quality["usable"]:
+                            self.text_layer_pages[page_number + 1] = {
+                                "text": text.strip(),
+                                "chars": quality["chars"],
+                                "glyph_coverage": quality["glyph_coverage"],
+                                "seconds": round(time.perf_counter() - started, 3)
+                            }
+                            page.close()
+                            continue
+
+                    width, height = page.get_size()
+                    # RGB bitmap, 3 bytes per pixel
+                    page_bytes = int(width * self.scale) * int(height * self.scale) * 3
+                    if not self._reserve(page_bytes):
+                        page.close()
+                        return
+
+                    started = time.perf_counter()
+                    bitmap = page.render(scale=self.scale)
+                    pil_image = bitmap.to_pil()
+                    pil_image.info["page_number"] = page_number + 1
+                    bitmap.close()
+                    page.close()
+
+                    if self.detect_blank_pages:
+                        verdict = classify_page(pil_image)
+                        if verdict["blank"]:
+                            self.blank_pages[page_number + 1] = {
+                                "ink_density": verdict["ink_density"],
+                                "std": verdict["std"],
+                                "seconds": round(time.perf_counter() - started, 3)
+                            }
+                            with self._budget:
+                                self._in_flight_bytes -= page_bytes
+                                self._budget.notify_all()
+                            pil_image.close()
+                            continue
+
+                    with self._budget:
+                        self._in_flight[id(pil_image)] = page_bytes
+                    self._put(pil_image)
+            finally:
+                pdf.close()
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(_DONE)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        if isinstance(item, Image.Image):
+            self.release(item)
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop rendering and free any pages still waiting in the queue"""
+        self._stop.set()
+        with self._budget:
+            self._budget.notify_all()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, Image.Image):
+                self.release(item)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+
+def extract_pages(pdf_path: str, progress: Optional[Callable] = None) -> Dict:
+    """
+    Extract text page by page, using the embedded text layer where it is good
+    enough, skipping blank pages and running vision OCR for every other page.
+
+    Args:
+        pdf_path (str): Path to the PDF
+        progress (callable, optional): Called as progress(stage, current, total),
+            first with "render" and then with "ocr" and the number of pages
+            finished out of the page count each time an OCR page completes
+
+    Returns:
+        dict: {"text": str, "page_count": int,
+               "pages": [{"page", "method", "status", "seconds", ...}, ...]}
+               where method is "text_layer", "blank" or "ocr"
+
+    Raises:
+        OcrPagesFailed: If any page still failed OCR after its retries, so a
+            sheet is never graded with pages missing (pages that succeeded
+            are in the OCR cache, so a retry only redoes the failed ones)
+    """
+    stream = PageStream(pdf_path)
+    on_page_done = None
+    if progress is not None:
+        progress("render", None, None)
+        ocr_done = []
+
+        def on_page_done(result: Dict):
+            # Text-layer and blank pages count as finished once they are skipped
+            ocr_done.append(result["page"])
+            finished = len(ocr_done) + len(stream.text_layer_pages) + len(stream.blank_pages)
+            progress("ocr", finished, stream.page_count)
+
+    # Hold the vision model resident for the whole document; pages are
+    # rendered, checked for a text layer and OCR'd while iterating the stream
     try:
-        images = pdf_to_image(pdf_path)
-        text = image_to_text(images)
-        return text
+        with residency.phase("ocr"):
+            ocr_results = ocr_pages(stream, release_page=stream.release, on_page_done=on_page_done)
     finally:
-        for img in images:
-            img.close()
+        stream.close()
+
+    pages = []
+    for page_number, info in stream.text_layer_pages.items():
+        pages.append({
+            "page": page_number,
+            "method": "text_layer",
+            "status": "ok",
+            "text": info["text"],
+            "chars": info["chars"],
+            "glyph_coverage": info["glyph_coverage"],
+            "seconds": info["seconds"]
+        })
+    for page_number, info in stream.blank_pages.items():
+        pages.append({
+            "page": page_number,
+            "method": "blank",
+            "status": "empty",
+            "text": "",
+            "ink_density": info["ink_density"],
+            "std": info["std"],
+            "seconds": info["seconds"]
+        })
+    for result in ocr_results:
+        pages.append(dict(result, method="ocr"))
+    pages.sort(key=lambda page: page["page"])
+
+    text_layer_count = len(stream.text_layer_pages)
+    print(f"Extracted {stream.page_count} pages: {text_layer_count} from text layer, "
+          f"{len(stream.blank_pages)} blank, {len(ocr_results)} by OCR, "
+          f"peak page memory {stream.peak_bytes / (1024 * 1024):.1f} MB")
+    raise_for_failed_pages(ocr_results)
+
+    return {
+        "text": "\n\n".join(page["text"] for page in pages if page["text"]).strip(),
+        "page_count": stream.page_count,
+        "pages": pages
+    }
+
+
+def extract_text_from_pdf(pdf_path: str) -> str:
+    return extract_pages(pdf_path)["text"]
 
 
 if __name__ == "__main__":
     pdf_path = r"Sample\20.pdf"
     extracted_text = extract_text_from_pdf(pdf_path)
-    print(extracted_text)
\ No newline at end of file
+    print(extracted_text)
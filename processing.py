@@ -0,0 +1,302 @@
+"""
+processing.py - PDF ingestion tasks run by the job workers
+
+These functions turn an uploaded PDF into a digital sheet: extract the text
+(text layer, blank detection or OCR per page), parse it into questions and
+answers with Gemma, and store the result. They are plain blocking functions;
+worker.py runs them in separate processes so the API never executes OCR or
+LLM work itself. Errors are raised so the job queue can retry them.
+
+Each function takes a progress(stage, current, total) callback that the worker
+uses to record the job's stage (render, ocr, parse, store, evaluate) and
+progress in the job queue. An upload job runs as up to three worker stages,
+ocr, parse and grade, so each can be given its own number of processes.
+"""
+
+import os
+import shutil
+import zipfile
+from typing import Any, Callable, Dict, List, Optional
+
+from db_manager import DBManager
+from textToCsv import parse_qa_text_student, parse_qa_text_teacher
+from pdfToText import extract_pages
+from answer_key import build_answer_key_artifacts
+from model_residency import residency
+from async_evaluator import evaluate_assessment_concurrent
+from job_queue import NextStage
+from sheet_cache import sheet_cache
+
+# Define the storage directory for uploaded PDFs
+UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Limits for bulk uploads, guarding against archive bombs
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "1000"))
+BULK_UPLOAD_MAX_FILE_MB = float(os.getenv("BULK_UPLOAD_MAX_FILE_MB", "100"))
+BULK_UPLOAD_MAX_TOTAL_MB = float(os.getenv("BULK_UPLOAD_MAX_TOTAL_MB", "5000"))
+# The uploaded ZIP itself; its entries can hardly be smaller than their
+# compressed size, so by default it may be as large as all of them together
+BULK_UPLOAD_MAX_ARCHIVE_MB = float(os.getenv("BULK_UPLOAD_MAX_ARCHIVE_MB", str(BULK_UPLOAD_MAX_TOTAL_MB)))
+
+
+def no_progress(stage: str, current: Optional[int] = None, total: Optional[int] = None):
+    """Progress callback used when the caller doesn't track progress"""
+
+
+def page_methods(extraction: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Which path (text layer, blank or OCR) each page of an extraction took"""
+    return [
+        {"page": page["page"], "method": page["method"], "status": page["status"]}
+        for page in extraction["pages"]
+    ]
+
+
+def extract_pdf_archive(archive_path: str, dest_dir: str = UPLOAD_DIR) -> Dict[str, Any]:
+    """
+    Extract the PDFs of a ZIP archive into dest_dir, one entry at a time.
+
+    Entries are streamed straight to disk, so neither the archive nor any
+    sheet is held in memory. Only the file name of each entry is kept, which
+    flattens folders and rules out paths escaping dest_dir; non-PDF entries
+    and macOS metadata are skipped. Entry count and sizes are capped by the
+    BULK_UPLOAD_* limits.
+
+    Args:
+        archive_path (str): Path to the ZIP file on disk
+        dest_dir (str): Directory to extract the PDFs into
+
+    Returns:
+        dict: {"sheets": [(student_id, pdf_path), ...], "skipped": [{"name", "reason"}, ...]}
+    """
+    max_file_bytes = int(BULK_UPLOAD_MAX_FILE_MB * 1024 * 1024)
+    max_total_bytes = int(BULK_UPLOAD_MAX_TOTAL_MB * 1024 * 1024)
+    sheets, skipped = {}, []
+    total_bytes = 0
+
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename.replace("\\", "/"))
+            if info.is_dir() or not name or info.filename.startswith("__MACOSX/") or name.startswith("."):
+                continue
+            if not name.lower().endswith(".pdf"):
+                skipped.append({"name": info.filename, "reason": "not a PDF"})
+                continue
+            if info.file_size > max_file_bytes:
+                skipped.append({"name": info.filename, "reason": "file too large"})
+                continue
+            if len(sheets) >= BULK_UPLOAD_MAX_FILES:
+                skipped.append({"name": info.filename, "reason": "too many files in archive"})
+                continue
+            if total_bytes + info.file_size > max_total_bytes:
+                skipped.append({"name": info.filename, "reason": "archive too large"})
+                continue
+
+            student_id = os.path.splitext(name)[0]
+            if student_id in sheets:
+                skipped.append({"name": info.filename, "reason": "duplicate student id"})
+                continue
+
+            file_path = os.path.join(dest_dir, name)
+            temp_path = file_path + ".part"
+            with archive.open(info) as source, open(temp_path, "wb") as target:
+                # Sizes in the archive header can lie; stop at the limit while copying
+                written = 0
+                while True:
+                    chunk = source.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > max_file_bytes:
+                        break
+                    target.write(chunk)
+            if written > max_file_bytes:
+                os.unlink(temp_path)
+                skipped.append({"name": info.filename, "reason": "file too large"})
+                continue
+
+            shutil.move(temp_path, file_path)
+            total_bytes += written
+            sheets[student_id] = file_path
+
+    return {"sheets": list(sheets.items()), "skipped": skipped}
+
+
+def extract_sheet_text(sheet_id: str, file_path: str, progress: Callable = no_progress) -> Dict[str, Any]:
+    """Extract the text of an answer sheet PDF (ocr stage); raises if any page failed OCR, so the job is retried"""
+    # Extract text from PDF, using the embedded text layer where possible
+    extraction = extract_pages(file_path, progress)
+
+    # Add diagnostic logging
+    print(f"Extraction paths for ID : {sheet_id}: {page_methods(extraction)}")
+
+    return {"text": extraction["text"], "pages": page_methods(extraction)}
+
+
+def parse_teacher_sheet(db: DBManager, teacher_id: str, extracted_text: str, pages: List[Dict],
+                        progress: Callable = no_progress) -> Dict[str, Any]:
+    """Parse and store the extracted text of a teacher's answer sheet (parse stage)"""
+    # Parse extracted text into structured DataFrame
+    progress("parse", None, None)
+    with residency.phase("parse"):
+        teacher_df = parse_qa_text_teacher(extracted_text)
+
+    # Validate DataFrame
+    if teacher_df.empty:
+        raise ValueError(f"Empty DataFrame after parsing teacher PDF for {teacher_id}")
+
+    # If word_limit and total_marks columns don't exist, add default values
+    if 'total_marks' not in teacher_df.columns:
+        teacher_df['total_marks'] = 10  # Default marks per question
+
+    if 'word_limit' not in teacher_df.columns:
+        teacher_df['word_limit'] = 100  # Default word limit per answer
+
+    # Ensure question_no is treated as integer
+    if 'question_no' in teacher_df.columns:
+        teacher_df['question_no'] = teacher_df['question_no'].astype(int)
+
+    # Convert DataFrame to JSON for storage
+    progress("store", None, None)
+    teacher_digital_sheet = teacher_df.to_json(orient="records")
+
+    # Update database with digital sheet
+    if not db.update_teacher_digital_sheet(teacher_id, teacher_digital_sheet):
+        raise RuntimeError(f"Could not store the digital sheet in the database for teacher {teacher_id}")
+
+    # Derive key concepts, keywords and embeddings once for all later evaluations
+    with residency.phase("parse"):
+        artifacts = build_answer_key_artifacts(teacher_df, teacher_digital_sheet)
+    if not db.update_teacher_artifacts(teacher_id, artifacts):
+        print(f"Warning: Could not store answer-key artifacts in database for teacher {teacher_id}")
+
+    # The digital sheet in the database is the only stored copy; keep it parsed for evaluation
+    sheet_cache.put("teacher", teacher_id, teacher_digital_sheet, teacher_df)
+    print(f"Processed teacher PDF for teacher ID : {teacher_id} successfully")
+
+    return {"teacher_id": teacher_id, "questions": len(teacher_df), "pages": pages}
+
+
+def parse_student_sheet(db: DBManager, student_id: str, extracted_text: str, pages: List[Dict],
+                        progress: Callable = no_progress) -> Dict[str, Any]:
+    """Parse and store the extracted text of a student's answer sheet (parse stage)"""
+    # Parse extracted text into structured DataFrame
+    progress("parse", None, None)
+    with residency.phase("parse"):
+        student_df = parse_qa_text_student(extracted_text)
+
+    # Validate DataFrame
+    if student_df.empty:
+        raise ValueError(f"Empty DataFrame after parsing student PDF for {student_id}")
+
+    # Normalize column name if needed (question_no or answer_no)
+    if 'answer_no' in student_df.columns and 'question_no' not in student_df.columns:
+        student_df = student_df.rename(columns={'answer_no': 'question_no'})
+
+    # Ensure question_no is treated as integer
+    if 'question_no' in student_df.columns:
+        student_df['question_no'] = student_df['question_no'].astype(int)
+
+    # Convert DataFrame to JSON for storage
+    progress("store", None, None)
+    student_digital_sheet = student_df.to_json(orient="records")
+
+    # Update database with digital sheet
+    if not db.update_student_digital_sheet(student_id, student_digital_sheet):
+        raise RuntimeError(f"Could not store the digital sheet in the database for student {student_id}")
+
+    # The digital sheet in the database is the only stored copy; keep it parsed for evaluation
+    sheet_cache.put("student", student_id, student_digital_sheet, student_df)
+    print(f"PDF processed for student ID : {student_id} successfully")
+
+    return {"student_id": student_id, "answers": len(student_df), "pages": pages}
+
+
+def process_teacher_pdf(db: DBManager, teacher_id: str, file_path: str,
+                        progress: Callable = no_progress) -> Dict[str, Any]:
+    """Extract, parse and store a teacher's answer sheet in one go"""
+    extraction = extract_sheet_text(teacher_id, file_path, progress)
+    return parse_teacher_sheet(db, teacher_id, extraction["text"], extraction["pages"], progress)
+
+
+def process_student_pdf(db: DBManager, student_id: str, file_path: str,
+                        progress: Callable = no_progress, teacher_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Extract, parse and store a student's answer sheet in one go, then
+    evaluate it against teacher_id's answer sheet if one is given
+    """
+    extraction = extract_sheet_text(student_id, file_path, progress)
+    result = parse_student_sheet(db, student_id, extraction["text"], extraction["pages"], progress)
+    if teacher_id:
+        progress("evaluate", None, None)
+        result = evaluated_student_result(db, result, teacher_id)
+    return result
+
+
+def evaluate_student_sheet(db: DBManager, student_id: str, teacher_id: str) -> Dict[str, Any]:
+    """
+    Grade a processed student sheet against a processed teacher sheet and
+    store the result, reusing the previous ratings of unchanged answers.
+    The sheet's questions are graded concurrently, bounded by OLLAMA_MAX_CONCURRENCY.
+    """
+    teacher_sheet = sheet_cache.get(db, "teacher", teacher_id)
+    student_sheet = sheet_cache.get(db, "student", student_id)
+    if teacher_sheet is None:
+        raise FileNotFoundError(f"Teacher sheet {teacher_id} not found or not processed yet")
+    if student_sheet is None:
+        raise FileNotFoundError(f"Student sheet {student_id} not found or not processed yet")
+
+    previous = db.get_evaluation_results(student_id=student_id, teacher_id=teacher_id)
+    evaluation_result = evaluate_assessment_concurrent(
+        teacher_sheet,
+        student_sheet,
+        answer_key_artifacts=db.get_teacher_artifacts(teacher_id),
+        previous_result=previous[0]['result_json'] if previous else None
+    )
+
+    success = db.store_evaluation_result(student_id, teacher_id, evaluation_result)
+    if not success:
+        print(f"Warning: Could not store evaluation result in database for {student_id}/{teacher_id}")
+    return evaluation_result
+
+
+def evaluated_student_result(db: DBManager, result: Dict[str, Any], teacher_id: str) -> Dict[str, Any]:
+    """Evaluate a parsed student sheet and add the marks to its processing result"""
+    evaluation = evaluate_student_sheet(db, result["student_id"], teacher_id)
+    return dict(result, teacher_id=teacher_id, total_marks=evaluation["total_marks"],
+                reused_questions=evaluation["reused_questions"])
+
+
+def run_extract_job(db: DBManager, payload: Dict[str, Any], progress: Callable, next_kind: str) -> NextStage:
+    """ocr stage: extract the PDF's text and hand it to the parse stage"""
+    sheet_id = payload.get("teacher_id") or payload.get("student_id")
+    extraction = extract_sheet_text(sheet_id, payload["file_path"], progress)
+    return NextStage(next_kind, dict(payload, **extraction))
+
+
+def run_parse_student_job(db: DBManager, payload: Dict[str, Any], progress: Callable):
+    """parse stage: store the student sheet, handing it to the grade stage if a teacher is given"""
+    result = parse_student_sheet(db, payload["student_id"], payload["text"], payload["pages"], progress)
+    if payload.get("teacher_id"):
+        return NextStage("evaluate_student_sheet", {"teacher_id": payload["teacher_id"], "result": result})
+    return result
+
+
+def run_evaluate_job(db: DBManager, payload: Dict[str, Any], progress: Callable) -> Dict[str, Any]:
+    """grade stage: evaluate a stored student sheet"""
+    progress("evaluate", None, None)
+    return evaluated_student_result(db, payload["result"], payload["teacher_id"])
+
+
+# Job kind -> handler(db, payload, progress), returning the job's result or
+# NextStage to pass the job on to the next worker stage (see job_queue.JOB_STAGES)
+JOB_HANDLERS = {
+    "process_teacher_pdf": lambda db, payload, progress: run_extract_job(
+        db, payload, progress, "parse_teacher_sheet"),
+    "process_student_pdf": lambda db, payload, progress: run_extract_job(
+        db, payload, progress, "parse_student_sheet"),
+    "parse_teacher_sheet": lambda db, payload, progress: parse_teacher_sheet(
+        db, payload["teacher_id"], payload["text"], payload["pages"], progress),
+    "parse_student_sheet": run_parse_student_job,
+    "evaluate_student_sheet": run_evaluate_job
+}
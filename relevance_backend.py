@@ -0,0 +1,141 @@
+"""
+relevance_backend.py - Pluggable backends for the content relevance criterion
+
+The "llm" backend asks Gemma for a similarity percentage, one call per answer.
+The "embedding" backend encodes model and student answers in batches with a
+sentence-transformers model and scores every pair at once with NumPy cosine
+similarity, mapped to the 0-100 scale through a configurable calibration.
+"""
+
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from ollamaKeyFactor import content_relevance
+
+RELEVANCE_BACKEND = os.getenv("RELEVANCE_BACKEND", "llm")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# Cosine similarity at or below the floor maps to 0, at or above the ceiling
+# maps to 100, linear in between
+RELEVANCE_COSINE_FLOOR = float(os.getenv("RELEVANCE_COSINE_FLOOR", "0.2"))
+RELEVANCE_COSINE_CEILING = float(os.getenv("RELEVANCE_COSINE_CEILING", "0.85"))
+
+
+class RelevanceCalibration:
+    """Linear mapping from cosine similarity to a 0-100 relevance rating"""
+
+    def __init__(self, floor: float = RELEVANCE_COSINE_FLOOR, ceiling: float = RELEVANCE_COSINE_CEILING):
+        if ceiling <= floor:
+            raise ValueError("Calibration ceiling must be greater than the floor")
+        self.floor = floor
+        self.ceiling = ceiling
+
+    def apply(self, cosine: np.ndarray) -> np.ndarray:
+        scaled = (cosine - self.floor) / (self.ceiling - self.floor) * 100.0
+        return np.clip(scaled, 0.0, 100.0)
+
+
+class LLMRelevanceBackend:
+    """Original behaviour: one Gemma call per answer pair"""
+
+    name = "llm"
+
+    def score(self, student_answers: List[str], teacher_answers: List[str],
+              teacher_embeddings: Optional[List] = None) -> List[float]:
+        return [content_relevance(s, t) for s, t in zip(student_answers, teacher_answers)]
+
+
+class EmbeddingRelevanceBackend:
+    """Batched sentence-embedding similarity computed on CPU"""
+
+    name = "embedding"
+
+    def __init__(self,
+                 model_name: str = EMBEDDING_MODEL,
+                 device: str = EMBEDDING_DEVICE,
+                 batch_size: int = EMBEDDING_BATCH_SIZE,
+                 calibration: Optional[RelevanceCalibration] = None):
+        self.model_name = model_name
+        self.device = device
+        self.batch_size = batch_size
+        self.calibration = calibration or RelevanceCalibration()
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        # Imported lazily so the LLM backend works without loading torch
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name, device=self.device)
+            return self._model
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts into L2-normalised embeddings, shape (len(texts), dim)"""
+        model = self._get_model()
+        embeddings = model.encode(
+            [str(t) if t is not None else "" for t in texts],
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def score_embeddings(self, student_embeddings: np.ndarray, teacher_embeddings: np.ndarray) -> np.ndarray:
+        """Row-wise cosine similarity of normalised embeddings, calibrated to 0-100"""
+        cosine = np.einsum("ij,ij->i", student_embeddings, teacher_embeddings)
+        return self.calibration.apply(cosine)
+
+    def score(self, student_answers: List[str], teacher_answers: List[str],
+              teacher_embeddings: Optional[List] = None) -> List[float]:
+        """
+        Score every (student, teacher) pair with a single batched encode.
+
+        teacher_embeddings may hold a precomputed embedding (or None) per pair;
+        those model answers are not encoded again.
+        """
+        if not student_answers:
+            return []
+        if teacher_embeddings is None:
+            teacher_embeddings = [None] * len(teacher_answers)
+
+        # Encode each distinct text once; a class shares the same model answers
+        pending = [str(t) for t, e in zip(teacher_answers, teacher_embeddings) if e is None]
+        texts = list(dict.fromkeys(pending + [str(s) for s in student_answers]))
+        index = {text: i for i, text in enumerate(texts)}
+        embeddings = self.encode(texts)
+
+        student_matrix = embeddings[[index[str(s)] for s in student_answers]]
+        teacher_matrix = np.stack([
+            np.asarray(e, dtype=np.float32) if e is not None else embeddings[index[str(t)]]
+            for t, e in zip(teacher_answers, teacher_embeddings)
+        ])
+        ratings = self.score_embeddings(student_matrix, teacher_matrix)
+
+        # An empty answer is never relevant
+        empty = np.array([not str(s).strip() for s in student_answers])
+        ratings[empty] = 0.0
+        return [round(float(r), 2) for r in ratings]
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_relevance_backend(name: Optional[str] = None):
+    """Return a shared relevance backend instance ('llm' or 'embedding')"""
+    name = name or RELEVANCE_BACKEND
+    with _backends_lock:
+        if name not in _backends:
+            if name == "llm":
+                _backends[name] = LLMRelevanceBackend()
+            elif name == "embedding":
+                _backends[name] = EmbeddingRelevanceBackend()
+            else:
+                raise ValueError(f"Unknown relevance backend '{name}', expected 'llm' or 'embedding'")
+        return _backends[name]
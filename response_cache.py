@@ -0,0 +1,245 @@
+"""
+response_cache.py - Persistent content-addressed cache for model responses
+
+Responses are stored in an embedded SQLite database keyed by a SHA-256 hash of
+everything that determines the model's output (model name, system prompt,
+prompt, options). Entries expire after a TTL and the least recently used ones
+are evicted once the entry or size limit is exceeded.
+
+The cache never fails a request: a lookup that errors (locked or unreadable
+database, full disk) counts as a miss and a store that errors is skipped.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.getcwd(), "cache"))
+CACHE_BUSY_TIMEOUT = float(os.getenv("CACHE_BUSY_TIMEOUT", "5"))  # seconds to wait on a locked cache
+# Limits are enforced every this many stores rather than on each one, so a
+# cache may briefly hold up to this many entries over its limits
+CACHE_EVICT_EVERY = int(os.getenv("CACHE_EVICT_EVERY", "100"))
+# A hit only rewrites an entry's last access time when it is older than this,
+# so most hits are read-only; LRU order is kept to within this many seconds
+CACHE_TOUCH_INTERVAL = float(os.getenv("CACHE_TOUCH_INTERVAL", "300"))
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_responses.db"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))  # seconds, 0 = never expire
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", os.path.join(CACHE_DIR, "ocr_pages.db"))
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "50000"))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", str(90 * 24 * 3600)))
+
+
+class ResponseCache:
+    """SQLite-backed LRU cache with TTL and size limits"""
+
+    def __init__(self,
+                 path: str,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 ttl_seconds: float = LLM_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._errors = 0
+        self._sets_since_evict = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # API and worker processes share the file, so wait briefly on their locks
+        self._conn = sqlite3.connect(path, timeout=CACHE_BUSY_TIMEOUT,
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute(f"PRAGMA busy_timeout={int(CACHE_BUSY_TIMEOUT * 1000)}")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)")
+
+    @staticmethod
+    def make_key(**parts: Any) -> str:
+        """Hash the given request parts into a stable cache key"""
+        canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _error(self, operation: str, error: Exception):
+        """Count and log a cache failure; callers hold self._lock"""
+        self._errors += 1
+        print(f"Warning: {operation} failed for cache {self.path}: {error}")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for key, or None on a miss, expired entry or error"""
+        with self._lock:
+            try:
+                return self._get(key, time.time())
+            except Exception as e:
+                self._error("Lookup", e)
+                self._misses += 1
+                return None
+
+    def _get(self, key: str, now: float) -> Optional[str]:
+        """Look up key; callers hold self._lock"""
+        row = self._conn.execute(
+            "SELECT value, created_at, last_access FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+            self._misses += 1
+            return None
+
+        value, created_at, last_access = row
+        if self.ttl_seconds and now - created_at > self.ttl_seconds:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._expirations += 1
+            self._misses += 1
+            return None
+
+        if now - last_access > CACHE_TOUCH_INTERVAL:
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        self._hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        """Store a value, periodically evicting old entries; errors are logged and ignored"""
+        now = time.time()
+        with self._lock:
+            try:
+                size = len(value.encode("utf-8"))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now)
+                )
+                self._sets_since_evict += 1
+                if self._sets_since_evict >= CACHE_EVICT_EVERY:
+                    self._sets_since_evict = 0
+                    self._evict(now)
+            except Exception as e:
+                self._error("Store", e)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least recently used ones beyond the limits"""
+        if self.ttl_seconds:
+            cursor = self._conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._expirations += max(cursor.rowcount, 0)
+
+        count, total_size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+
+        if count <= self.max_entries and total_size <= self.max_bytes:
+            return
+
+        # Walk entries from least to most recently used until back under both limits
+        to_delete = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC"):
+            if count <= self.max_entries and total_size <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            count -= 1
+            total_size -= size
+
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+        self._evictions += len(to_delete)
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss counters for this process and the current cache size;
+        the size is None if the database cannot be read
+        """
+        with self._lock:
+            try:
+                count, total_size = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+                ).fetchone()
+            except Exception as e:
+                self._error("Stats", e)
+                count, total_size = None, None
+            lookups = self._hits + self._misses
+            return {
+                "path": self.path,
+                "entries": count,
+                "size_bytes": total_size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "errors": self._errors
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def _open_cache(path: str, *limits) -> Optional[ResponseCache]:
+    """Open a cache, or run without one if its database cannot be opened"""
+    try:
+        return ResponseCache(path, *limits)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Warning: Could not open cache {path}, continuing without it: {e}")
+        return None
+
+def get_llm_cache() -> Optional[ResponseCache]:
+    """Return the process-wide LLM response cache, or None if caching is disabled"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        if "llm" not in _caches:
+            _caches["llm"] = _open_cache(LLM_CACHE_PATH)
+        return _caches["llm"]
+
+def get_ocr_cache() -> Optional[ResponseCache]:
+    """Return the process-wide page OCR cache, or None if caching is disabled"""
+    if not OCR_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        if "ocr" not in _caches:
+            _caches["ocr"] = _open_cache(OCR_CACHE_PATH, OCR_CACHE_MAX_ENTRIES,
+                                         OCR_CACHE_MAX_BYTES, OCR_CACHE_TTL)
+        return _caches["ocr"]
+
+def llm_cache_key(model: str, prompt: str, system_prompt: Optional[str] = None,
+                  options: Optional[Dict] = None, **extra: Any) -> str:
+    """Build the cache key for an LLM request"""
+    return ResponseCache.make_key(
+        model=model,
+        system=system_prompt or "",
+        prompt=prompt,
+        options=options or {},
+        **extra
+    )
+
+def is_deterministic(options: Optional[Dict]) -> bool:
+    """Only requests sampled at temperature 0 are safe to serve from cache"""
+    return bool(options) and float(options.get("temperature", 1)) == 0
@@ -0,0 +1,115 @@
+"""
+sheet_cache.py - In-process cache of parsed digital sheets
+
+Evaluation needs each teacher and student sheet as a DataFrame. The database
+digital_sheet column is the only stored copy; parsed DataFrames are kept here
+in an LRU cache keyed by sheet kind and id. Every lookup first reads the
+sheet's checksum from the database (a small indexed query) and reuses the
+cached DataFrame only if the checksum still matches, so a sheet re-processed
+by a worker process is never served stale.
+
+Cached DataFrames are shared between callers and must not be modified.
+"""
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from db_manager import sheet_checksum
+
+SHEET_CACHE_MAX_ENTRIES = int(os.getenv("SHEET_CACHE_MAX_ENTRIES", "2048"))
+
+
+def parse_digital_sheet(digital_sheet: str) -> pd.DataFrame:
+    """Turn a stored digital sheet (JSON records) into a DataFrame"""
+    return pd.DataFrame(json.loads(digital_sheet))
+
+
+class SheetCache:
+    """Thread-safe LRU cache of parsed sheets, validated by checksum"""
+
+    def __init__(self, max_entries: int = SHEET_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (kind, sheet_id) -> (checksum, DataFrame)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def put(self, kind: str, sheet_id: str, digital_sheet: str, df: pd.DataFrame):
+        """Cache a sheet that was just parsed and stored, saving the next lookup a parse"""
+        with self._lock:
+            self._store((kind, sheet_id), sheet_checksum(digital_sheet), df)
+
+    def get(self, db, kind: str, sheet_id: str) -> Optional[pd.DataFrame]:
+        """
+        Get one parsed sheet.
+
+        Args:
+            db (DBManager): Database holding the digital sheets
+            kind (str): "teacher" or "student"
+            sheet_id (str): Teacher or student id
+
+        Returns:
+            DataFrame, or None if the sheet has not been processed
+        """
+        return self.get_many(db, kind, [sheet_id]).get(sheet_id)
+
+    def get_many(self, db, kind: str, sheet_ids: List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Get many parsed sheets with one checksum query, loading only the
+        sheets that are missing from the cache or have changed.
+
+        Returns:
+            dict: sheet id -> DataFrame, for the ids that have been processed
+        """
+        checksums = db.get_sheet_checksums(kind, sheet_ids)
+
+        sheets, stale = {}, []
+        with self._lock:
+            for sheet_id, checksum in checksums.items():
+                entry = self._entries.get((kind, sheet_id))
+                if entry is not None and entry[0] == checksum:
+                    self._entries.move_to_end((kind, sheet_id))
+                    sheets[sheet_id] = entry[1]
+                    self._hits += 1
+                else:
+                    stale.append(sheet_id)
+                    self._misses += 1
+
+        if stale:
+            for sheet_id, (checksum, digital_sheet) in db.get_digital_sheets(kind, stale).items():
+                df = parse_digital_sheet(digital_sheet)
+                sheets[sheet_id] = df
+                with self._lock:
+                    self._store((kind, sheet_id), checksum, df)
+
+        return sheets
+
+    def _store(self, key, checksum: str, df: pd.DataFrame):
+        self._entries[key] = (checksum, df)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions
+            }
+
+
+# Shared by all evaluations in this process
+sheet_cache = SheetCache()
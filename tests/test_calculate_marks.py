@@ -0,0 +1,52 @@
+"""The vectorized marks calculation must match the per-question one exactly"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from calculateMarks import calculate_marks_batch, calculate_marks_obtained
+
+CREDIT_LISTS = [
+    [4, 3, 2, 1],
+    [2.5, 2.5, 2.5, 2.5],
+    [1, 0, 0, 0],
+    [0.1, 0.7, 0.13, 0.07],
+]
+
+
+@pytest.mark.parametrize("credit_list", CREDIT_LISTS)
+def test_batch_matches_scalar_on_random_ratings(credit_list):
+    rng = np.random.default_rng(0)
+    ratings = np.round(rng.uniform(0, 10, size=(40, 12, 4)), 2)
+    max_marks = rng.choice([1, 2, 2.5, 5, 10, 15], size=12)
+
+    marks, totals = calculate_marks_batch(ratings, credit_list, max_marks)
+
+    for s in range(ratings.shape[0]):
+        expected = [calculate_marks_obtained(list(ratings[s, q]), credit_list, float(max_marks[q]))
+                    for q in range(ratings.shape[1])]
+        assert marks[s].tolist() == expected
+        assert totals[s] == sum(expected)
+
+
+def test_batch_matches_scalar_on_half_way_marks():
+    # Ratings that land exactly on .5 marks, where rounding mode matters
+    credit_list = [1, 1, 1, 1]
+    ratings = [[[10 / 9.5, 10 / 9.5, 10 / 9.5, 10 / 9.5]], [[0, 0, 0, 0]], [[10, 10, 10, 10]]]
+    for max_marks in ([5.0], [15.0], [25.0]):
+        marks, _ = calculate_marks_batch(ratings, credit_list, max_marks)
+        for s, student in enumerate(ratings):
+            assert marks[s, 0] == calculate_marks_obtained(student[0], credit_list, max_marks[0])
+
+
+def test_batch_accepts_per_student_max_marks():
+    credit_list = [4, 3, 2, 1]
+    ratings = [[[7, 8, 9, 6], [3, 2, 5, 4]], [[10, 10, 10, 10], [0, 1, 0, 1]]]
+    max_marks = [[5, 10], [2, 4]]
+
+    marks, totals = calculate_marks_batch(ratings, credit_list, max_marks)
+
+    for s in range(2):
+        for q in range(2):
+            assert marks[s, q] == calculate_marks_obtained(ratings[s][q], credit_list, max_marks[s][q])
+    assert totals.tolist() == marks.sum(axis=1).tolist()
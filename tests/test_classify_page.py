@@ -0,0 +1,73 @@
+"""Blank-page detection must never drop a page that carries an answer"""
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pypdfium2")
+pytest.importorskip("requests")
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+from pdfToText import classify_page
+
+# An A4 page rendered at PDF_RENDER_SCALE 1.5
+PAGE_SIZE = (893, 1263)
+
+
+def blank_page():
+    return Image.new("RGB", PAGE_SIZE, "white")
+
+
+def ruled_page():
+    page = blank_page()
+    draw = ImageDraw.Draw(page)
+    for y in range(120, PAGE_SIZE[1] - 60, 36):
+        draw.line([(0, y), (PAGE_SIZE[0], y)], fill=(40, 40, 40), width=2)
+    draw.line([(80, 0), (80, PAGE_SIZE[1])], fill=(40, 40, 40), width=2)
+    return page
+
+
+def write_pencil_answer(page, lines=3, length=260):
+    """A short answer of thin, light pencil strokes"""
+    draw = ImageDraw.Draw(page)
+    for line in range(lines):
+        y = 150 + line * 36 + 12
+        points = [(120 + x, y + (8 if (x // 6) % 2 else 0)) for x in range(0, length, 6)]
+        draw.line(points, fill=(110, 110, 110), width=1)
+    return page
+
+
+def test_empty_page_is_blank():
+    assert classify_page(blank_page())["blank"]
+
+
+def test_ruled_page_without_answer_is_blank():
+    assert classify_page(ruled_page())["blank"]
+
+
+def test_sparse_pencil_answer_is_not_blank():
+    assert not classify_page(write_pencil_answer(blank_page()))["blank"]
+
+
+def test_sparse_pencil_answer_on_ruled_page_is_not_blank():
+    assert not classify_page(write_pencil_answer(ruled_page()))["blank"]
+
+
+def test_single_short_answer_line_is_not_blank():
+    assert not classify_page(write_pencil_answer(blank_page(), lines=1, length=200))["blank"]
+
+
+def test_single_handwritten_word_is_not_blank():
+    assert not classify_page(write_pencil_answer(ruled_page(), lines=1, length=60))["blank"]
+
+
+def test_page_with_scanner_dust_is_blank():
+    page = ruled_page()
+    draw = ImageDraw.Draw(page)
+    for x, y in [(150, 300), (400, 520), (620, 880), (300, 1000), (700, 200)]:
+        draw.ellipse([(x, y), (x + 2, y + 2)], fill="black")
+    assert classify_page(page)["blank"]
+
+
+def test_dark_scan_is_not_blank():
+    assert not classify_page(Image.new("RGB", PAGE_SIZE, (90, 90, 90)))["blank"]
@@ -0,0 +1,77 @@
+"""Leases: crashed workers' jobs are recovered and stale owners cannot finish them"""
+
+import pytest
+
+from job_queue import STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def expire_lease(queue, job_id):
+    queue._conn().execute("UPDATE jobs SET lease_expires = 0 WHERE id = ?", (job_id,))
+
+
+def test_expired_lease_is_requeued(queue):
+    job_id = queue.enqueue("ocr", {"pdf": "a.pdf"})
+    first = queue.claim(["ocr"], "worker-a")
+    assert first["id"] == job_id and first["attempts"] == 1
+
+    # A live lease keeps the job away from other workers
+    assert queue.claim(["ocr"], "worker-b") is None
+
+    expire_lease(queue, job_id)
+    second = queue.claim(["ocr"], "worker-b")
+    assert second["id"] == job_id
+    assert second["locked_by"] == "worker-b"
+    assert second["status"] == STATUS_RUNNING
+    assert second["attempts"] == 2
+
+
+def test_expired_lease_on_last_attempt_fails_the_job(queue):
+    job_id = queue.enqueue("ocr", {}, max_attempts=1)
+    queue.claim(["ocr"], "worker-a")
+
+    expire_lease(queue, job_id)
+    assert queue.claim(["ocr"], "worker-b") is None
+
+    job = queue.get(job_id)
+    assert job["status"] == STATUS_FAILED
+    assert job["error"] == "Worker lease expired"
+
+
+def test_stale_owner_cannot_complete_or_fail(queue):
+    job_id = queue.enqueue("ocr", {})
+    queue.claim(["ocr"], "worker-a")
+    expire_lease(queue, job_id)
+    queue.claim(["ocr"], "worker-b")
+
+    assert queue.complete(job_id, "worker-a", {"text": "stale"}) is False
+    assert queue.fail(job_id, "worker-a", "stale error") is False
+    assert queue.heartbeat(job_id, "worker-a") is False
+    assert queue.advance(job_id, "worker-a", "parse", {}) is False
+
+    job = queue.get(job_id)
+    assert job["status"] == STATUS_RUNNING
+    assert job["locked_by"] == "worker-b"
+    assert job["result"] is None and job["error"] is None
+
+    assert queue.complete(job_id, "worker-b", {"text": "ok"}) is True
+    job = queue.get(job_id)
+    assert job["status"] == STATUS_SUCCEEDED
+    assert job["result"] == {"text": "ok"}
+
+
+def test_requeued_job_cannot_be_finished_by_its_old_owner(queue):
+    job_id = queue.enqueue("ocr", {})
+    queue.claim(["ocr"], "worker-a")
+    expire_lease(queue, job_id)
+    # Expired leases are only requeued when a worker next claims; no job of this kind is waiting
+    assert queue.claim(["parse"], "worker-b") is None
+    assert queue.get(job_id)["status"] == STATUS_QUEUED
+
+    assert queue.complete(job_id, "worker-a") is False
+    assert queue.fail(job_id, "worker-a", "late error") is False
+    assert queue.get(job_id)["status"] == STATUS_QUEUED
@@ -0,0 +1,56 @@
+"""Multi-criterion responses are parsed defensively; bad criteria become None"""
+
+import pytest
+
+pytest.importorskip("requests")
+
+from ollamaKeyFactor import CRITERIA_FIELDS, parse_criteria_response
+
+ALL_NONE = {key: None for key in CRITERIA_FIELDS}
+
+
+def test_well_formed_response():
+    response = ('{"keyword_matching": 80, "content_relevance": 72.5, '
+                '"grammatical_accuracy": 90, "word_length": 100}')
+    assert parse_criteria_response(response) == {
+        "keyword": 80.0, "content": 72.5, "grammar": 90.0, "length": 100.0
+    }
+
+
+def test_response_in_markdown_code_block():
+    response = 'Here you go:\n```json\n{"keyword": 60, "content": 70, "grammar": 80, "length": 90}\n```'
+    assert parse_criteria_response(response) == {
+        "keyword": 60.0, "content": 70.0, "grammar": 80.0, "length": 90.0
+    }
+
+
+@pytest.mark.parametrize("response", [
+    None,
+    "",
+    "I cannot rate this answer.",
+    '{"keyword_matching": 80, "content_relevance": 7',  # truncated mid-object
+    '{"keyword_matching": 80,, "content_relevance": 70}',
+    '{keyword_matching: 80}',
+    '[80, 70, 90, 100]',
+])
+def test_malformed_response_gives_no_ratings(response):
+    assert parse_criteria_response(response) == ALL_NONE
+
+
+def test_partial_response_keeps_the_valid_criteria():
+    response = '{"keyword_matching": 80, "grammatical_accuracy": "n/a", "word_length": null}'
+    assert parse_criteria_response(response) == {
+        "keyword": 80.0, "content": None, "grammar": None, "length": None
+    }
+
+
+def test_values_are_coerced_and_clamped():
+    response = ('{"keyword_matching": "85%", "content_relevance": 140, '
+                '"grammatical_accuracy": -5, "word_length": true}')
+    assert parse_criteria_response(response) == {
+        "keyword": 85.0, "content": 100.0, "grammar": 0.0, "length": None
+    }
+
+
+def test_nan_is_rejected():
+    assert parse_criteria_response('{"keyword_matching": NaN}')["keyword"] is None
@@ -3,6 +3,41 @@ import ollama
 import json
 import pandas as pd
 
+from response_cache import get_llm_cache, llm_cache_key, is_deterministic
+from model_residency import residency
+
+PARSER_MODEL = "gemma3:4b"  # or the specific Gemma 3 model you have
+
+# Deterministic sampling so repeated parses of the same text can be cached
+PARSER_OPTIONS = {"temperature": 0, "seed": 42}
+
+
+def chat_with_cache(prompt, model=PARSER_MODEL, options=PARSER_OPTIONS):
+    """
+    Send a single-message chat to Ollama, serving repeated requests from the
+    persistent response cache.
+
+    Returns:
+        str: The content of the model's reply
+    """
+    messages = [{"role": "user", "content": prompt}]
+
+    cache = get_llm_cache()
+    cache_key = None
+    if cache and is_deterministic(options):
+        cache_key = llm_cache_key(model, json.dumps(messages), options=options, endpoint="chat")
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    response = ollama.chat(model=model, messages=messages, options=options,
+                           keep_alive=residency.keep_alive)
+    content = response['message']['content']
+
+    if cache_key and content:
+        cache.set(cache_key, content)
+    return content
+
 
 # Function to parse QA text using Ollama's Gemma model
 def parse_qa_text_teacher(text):
@@ -16,17 +51,9 @@ def parse_qa_text_teacher(text):
     """ + text
     
     # Call Ollama API with Gemma 3 model
-    response = ollama.chat(
-        model="gemma3:4b",  # or the specific Gemma 3 model you have
-        messages=[{"role": "user", "content": prompt}]
-    )
-    
-    # Parse the JSON response
-    import json
-    import re
+    content = chat_with_cache(prompt)
     
     # Extract JSON from response
-    content = response['message']['content']
     # Sometimes the model returns the JSON with markdown code blocks
     json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
     if json_match:
@@ -63,11 +90,7 @@ def parse_qa_text_student(text) -> pd.DataFrame:
         "Example: [{\"question_no\": \"1\", \"answer\": \"...\"}, ...]\n\n"
         + text
     )
-    response = ollama.chat(
-        model="gemma3:4b",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    content = response['message']['content']
+    content = chat_with_cache(prompt)
 
     # 2) Strip any ```json … ``` fences
     m = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
@@ -0,0 +1,181 @@
+"""
+worker.py - Job worker processes for GraderPro
+
+Starts a pool of worker processes per stage, each claiming jobs from the
+durable job queue, running them and recording the outcome. Processes that
+die are restarted; jobs they were running are recovered once their lease
+expires. The ocr, parse and grade stages are sized separately; an "ingest"
+worker runs all of them.
+
+Usage:
+    python worker.py                             # concurrency from WORKER_CONCURRENCY
+    python worker.py --stage ocr=2 --stage parse=1 --stage grade=1
+    python worker.py --stage ingest=3            # three workers running every stage
+"""
+
+import os
+import time
+import signal
+import socket
+import argparse
+import threading
+import traceback
+import multiprocessing
+from typing import Dict
+
+from job_queue import JobQueue, NextStage, JOB_STAGES, JOB_LEASE_SECONDS
+
+# Worker processes per stage, e.g. "ocr=2,parse=1,grade=1"
+WORKER_CONCURRENCY = os.getenv("WORKER_CONCURRENCY", "ocr=1,parse=1,grade=1")
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1"))
+
+
+def parse_concurrency(spec: str) -> Dict[str, int]:
+    """Parse "stage=n,stage=n" into a dict"""
+    concurrency = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        stage, _, count = part.partition("=")
+        stage = stage.strip()
+        if stage not in JOB_STAGES:
+            raise ValueError(f"Unknown worker stage '{stage}', expected one of {list(JOB_STAGES)}")
+        concurrency[stage] = int(count or 1)
+    return concurrency
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and it was reclaimed, so this worker must stop running it"""
+
+
+def run_job(queue: JobQueue, db, job: Dict, worker_id: str):
+    """
+    Run one claimed job while renewing its lease. If the lease is lost the
+    job is abandoned at its next progress report and its outcome is not
+    recorded, since another worker now owns it.
+    """
+    # Imported here so the supervisor process does not load the ML stack
+    from processing import JOB_HANDLERS
+
+    done = threading.Event()
+    lost = threading.Event()
+
+    def keep_lease():
+        while not done.wait(JOB_LEASE_SECONDS / 3):
+            try:
+                if not queue.heartbeat(job["id"], worker_id):
+                    print(f"[{worker_id}] Lost the lease on job {job['id']}, stopping it")
+                    lost.set()
+                    return
+            except Exception as e:
+                # Transient (e.g. database busy); the lease has slack for the next attempt
+                print(f"[{worker_id}] Could not renew the lease on job {job['id']}: {e}")
+
+    heartbeat = threading.Thread(target=keep_lease, daemon=True)
+    heartbeat.start()
+    started = time.time()
+    try:
+        def progress(stage: str, current=None, total=None):
+            if lost.is_set():
+                raise LeaseLost(job["id"])
+            try:
+                queue.set_progress(job["id"], stage, current, total)
+            except Exception as e:
+                # Progress is informational; never fail the job over it
+                print(f"[{worker_id}] Could not record progress for job {job['id']}: {e}")
+
+        handler = JOB_HANDLERS[job["kind"]]
+        result = handler(db, job["payload"], progress)
+        if isinstance(result, NextStage):
+            if queue.advance(job["id"], worker_id, result.kind, result.payload):
+                print(f"[{worker_id}] Job {job['id']} ({job['kind']}) handed on to {result.kind} "
+                      f"after {time.time() - started:.1f}s")
+            else:
+                print(f"[{worker_id}] Job {job['id']} ({job['kind']}) was reclaimed, result discarded")
+        elif queue.complete(job["id"], worker_id, result):
+            print(f"[{worker_id}] Job {job['id']} ({job['kind']}) succeeded in {time.time() - started:.1f}s")
+        else:
+            print(f"[{worker_id}] Job {job['id']} ({job['kind']}) was reclaimed, result discarded")
+    except LeaseLost:
+        print(f"[{worker_id}] Job {job['id']} ({job['kind']}) abandoned after losing its lease")
+    except Exception as e:
+        traceback.print_exc()
+        if queue.fail(job["id"], worker_id, f"{type(e).__name__}: {e}"):
+            print(f"[{worker_id}] Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+        else:
+            print(f"[{worker_id}] Job {job['id']} ({job['kind']}) failed after being reclaimed: {e}")
+    finally:
+        done.set()
+
+
+def worker_loop(stage: str, index: int):
+    """Claim and run jobs of one stage until terminated"""
+    from db_manager import DBManager
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{stage}-{index}"
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    # Ctrl+C is handled by the supervisor, which stops workers between jobs
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    queue = JobQueue()
+    db = DBManager()
+    kinds = JOB_STAGES[stage]
+    print(f"[{worker_id}] Worker started for {kinds}")
+
+    # Keep this stage's models loaded and share their use with the other processes,
+    # so no process unloads a model another one is working with
+    from model_residency import residency, PHASE_MODELS
+    models = PHASE_MODELS.get(stage)
+    if models is None:
+        models = sorted({model for phase_models in PHASE_MODELS.values() for model in phase_models})
+    residency.start(models=models)
+
+    while not stopping.is_set():
+        job = queue.claim(kinds, worker_id)
+        if job is None:
+            stopping.wait(WORKER_POLL_INTERVAL)
+            continue
+        run_job(queue, db, job, worker_id)
+
+    residency.stop()
+    print(f"[{worker_id}] Worker stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run GraderPro job workers")
+    parser.add_argument("--stage", action="append", default=[],
+                        help="stage=processes, e.g. ocr=2 (repeatable; defaults to WORKER_CONCURRENCY)")
+    args = parser.parse_args()
+
+    concurrency = parse_concurrency(",".join(args.stage) if args.stage else WORKER_CONCURRENCY)
+    processes = {}
+
+    def spawn(stage: str, index: int):
+        process = multiprocessing.Process(target=worker_loop, args=(stage, index), daemon=False)
+        process.start()
+        processes[(stage, index)] = process
+
+    for stage, count in concurrency.items():
+        for index in range(count):
+            spawn(stage, index)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    # Restart crashed workers; their running jobs come back after the lease expires
+    while not stopping.wait(2):
+        for (stage, index), process in list(processes.items()):
+            if not process.is_alive():
+                print(f"Worker {stage}-{index} exited with code {process.exitcode}, restarting")
+                spawn(stage, index)
+
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        process.join(timeout=30)
+
+
+if __name__ == "__main__":
+    main()